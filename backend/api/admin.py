@@ -1,4 +1,6 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.conf import settings
+from concurrent.futures import ThreadPoolExecutor
 from .models import *
 from .choices import *
 from .utils import EmailNotifications
@@ -29,17 +31,33 @@ class ReportAdmin(admin.ModelAdmin):
 class QuitRequestAdmin(admin.ModelAdmin):
     list_display = ('account', 'status')
     list_filter = ('status',)
-    actions = ['approve_reports', 'reject_reports']
+    actions = ['approve_deletions', 'reject_deletions']
 
     def approve_deletions(self, request, queryset):
-        for deletion_request in queryset:
-            deletion_request.status = REQUEST_APPROVED_CHOICE
-            deletion_request.save()
+        deletion_requests = list(queryset.select_related('account__user'))
+
+        # the Supabase deletes are remote round-trips, so run them side by side; the database work stays here
+        def delete_supabase_user(deletion_request):
+            try:
+                deletion_request.account.delete_supabase_user()
+            except Exception as e:
+                return e
 
+        with ThreadPoolExecutor(max_workers=settings.SUPABASE_ADMIN_WORKERS) as pool:
+            errors = list(pool.map(delete_supabase_user, deletion_requests))
+
+        for deletion_request, error in zip(deletion_requests, errors):
             account = deletion_request.account
             user = account.user
+            if error is not None:
+                self.message_user(request, f"Could not delete {user.email} from Supabase: {str(error)}", messages.ERROR)
+                continue
+
+            deletion_request.status = REQUEST_APPROVED_CHOICE
+            deletion_request.save()
+
             EmailNotifications.notify_deletion_approved(user)
-            account.delete_account_user_profile()
+            account.delete_account_user_profile(delete_supabase_user=False)
 
     def reject_deletions(self, request, queryset):
         for deletion_request in queryset:
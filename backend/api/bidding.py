@@ -0,0 +1,108 @@
+from .models import Item, Bid
+from .choices import *
+from .orderbook import BidOrderBook, RANKED_STATUSES, write_ranked_statuses
+from .events import publish_item_update
+from .explore import mark_snapshots_stale
+from .collection_stats import record_bid
+from .hot_score import bump_hot_score
+from .recent_bids import record_recent_bid
+from django.db import connection, transaction
+from django.utils import timezone
+from redis.exceptions import RedisError
+
+
+class BidRejected(Exception):
+    pass
+
+
+# validates and claims the highest bid in one conditional UPDATE. the row lock it takes is held until
+# commit, so concurrent bidders on the same item queue up instead of racing; the locked subquery hands
+# back the highest bid the row had just before this one
+CLAIM_SQL = f"""
+    UPDATE {Item._meta.db_table} AS item
+    SET highest_bid = %(bid_price)s, total_bids = item.total_bids + 1
+    FROM (SELECT id, highest_bid FROM {Item._meta.db_table} WHERE id = %(item_id)s FOR UPDATE) AS previous
+    WHERE item.id = previous.id
+        AND item.availability = %(available)s
+        AND item.deadline > now()
+        AND item.highest_bid < %(bid_price)s
+    RETURNING previous.highest_bid
+"""
+
+# first key of the advisory lock that serializes order book updates per item (the second is the item id)
+RANKING_LOCK = 1
+
+
+# the book agrees with the Bid rows it points at; one left over from a restored database or a lost write doesn't
+def book_matches_bids(item, top):
+    prices = dict(Bid.objects.filter(item_id=item.pk, id__in=[bid_id for _, bid_id, _ in top]).values_list('id', 'bid_price'))
+    return all(bid_id in prices and float(prices[bid_id]) == price for _, bid_id, price in top)
+
+
+# adds a committed bid to the order book and writes 1st/2nd/3rd onto the Bid rows. updates for the same
+# item are serialized by an advisory lock instead of the item row lock, so bidders never wait on redis to
+# claim; whoever ranks last sees every earlier bid in the book
+def rank_bid(item, bid):
+    book = BidOrderBook(item)
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [RANKING_LOCK, item.pk])
+            previous_top = book.top(3)
+            book.add(bid)
+            current_top = book.top(3)
+            if not book_matches_bids(item, current_top):
+                print(f"Order book for item {item.pk} is stale, rebuilding it")
+                book.invalidate()
+                previous_top, current_top = [], book.top(3)
+            write_ranked_statuses(item.pk, previous_top, current_top)
+    except RedisError as e:
+        print(f"Failed to update order book for item {item.pk}: {str(e)}")
+        book.invalidate()
+        return
+
+    for status, (_, bid_id, _) in zip(RANKED_STATUSES, current_top):
+        if bid_id == bid.id:
+            bid.status = status
+
+
+# accepts a bid on an item; returns (new bid, bid that was highest before it or None). the transaction
+# holds the item row lock for the claim and the Bid insert only; everything derived from the bid
+# (order book, statistics, feeds) is updated once it has committed
+def accept_bid(item, profile, bid_price):
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(CLAIM_SQL, {'item_id': item.pk, 'bid_price': bid_price, 'available': AVAILABLE_CHOICE})
+            claimed = cursor.fetchone()
+
+        now = timezone.now()
+        if claimed is None:
+            current = Item.objects.filter(pk=item.pk).values('availability', 'deadline').first()
+            if current is None or current['availability'] != AVAILABLE_CHOICE or current['deadline'] <= now:
+                raise BidRejected("Bidding has ended")
+            raise BidRejected("Bid must be higher than current bid.")
+
+        bid = Bid.objects.create(
+            profile=profile,
+            item_id=item.pk,
+            bid_price=bid_price,
+            time_of_bid=now,
+            status=NOT_HIGHEST_CHOICE,
+        )
+    old_highest = claimed[0]
+
+    # every accepted bid beats the one before it, so the previous highest is the bid at the old price
+    previous_highest = Bid.objects.filter(item_id=item.pk, bid_price=old_highest).exclude(id=bid.id).select_related(
+        'profile__account__user'
+    ).order_by('time_of_bid').first()
+
+    rank_bid(item, bid)
+    record_bid(item, bid_price, old_highest, now)
+    bump_hot_score(item.pk, 'bid', now.timestamp())
+    record_recent_bid(item.pk)
+
+    item.refresh_from_db(fields=['highest_bid', 'total_bids'])
+    bid.item = item
+    publish_item_update(item)
+    mark_snapshots_stale('bid')
+
+    return bid, previous_highest
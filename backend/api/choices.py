@@ -114,6 +114,30 @@ WINNING_STATUS_CHOICES = [
 ]
 
 
+# notification ledger kinds
+NOTIFY_DEADLINE_24H_SELLER = 'DS'
+NOTIFY_DEADLINE_24H_BIDDER = 'DB'
+
+NOTIFICATION_KIND_CHOICES = [
+    (NOTIFY_DEADLINE_24H_SELLER, '24h Deadline Reminder (Seller)'),
+    (NOTIFY_DEADLINE_24H_BIDDER, '24h Deadline Reminder (Bidder)'),
+]
+
+
+# email outbox status
+OUTBOX_PENDING_CHOICE = 'P'
+OUTBOX_SENDING_CHOICE = 'C' # claimed by a worker
+OUTBOX_SENT_CHOICE = 'S'
+OUTBOX_FAILED_CHOICE = 'F'
+
+OUTBOX_STATUS_CHOICES = [
+    (OUTBOX_PENDING_CHOICE, 'Pending'),
+    (OUTBOX_SENDING_CHOICE, 'Sending'),
+    (OUTBOX_SENT_CHOICE, 'Sent'),
+    (OUTBOX_FAILED_CHOICE, 'Failed'),
+]
+
+
 # countries
 
 COUNTRY_CHOICES = [
@@ -0,0 +1,101 @@
+from .models import Item, Bid, CollectionStats
+from .choices import *
+from django.db import connection, transaction
+from django.db.models import Count, Max, Sum, Q
+from django.utils import timezone
+from decimal import Decimal
+
+# CollectionStats is kept current by the write paths below and rebuilt from scratch by
+# api.tasks.reconcile_collection_stats, which also repairs anything the incremental updates miss
+# (item deletes, direct admin edits)
+
+BUMP_SQL = f"""
+    INSERT INTO {CollectionStats._meta.db_table} AS stats
+        (collection_id, available_items, total_bids, highest_bid_sum, last_activity)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (collection_id) DO UPDATE SET
+        available_items = stats.available_items + EXCLUDED.available_items,
+        total_bids = stats.total_bids + EXCLUDED.total_bids,
+        highest_bid_sum = stats.highest_bid_sum + EXCLUDED.highest_bid_sum,
+        last_activity = GREATEST(stats.last_activity, EXCLUDED.last_activity)
+"""
+
+
+# one upsert per change, so concurrent writers never lose an increment and new collections need no setup
+def bump_collection_stats(collection_id, available_items=0, total_bids=0, highest_bid_sum=Decimal('0.00'), last_activity=None):
+    if collection_id is None:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(BUMP_SQL, [collection_id, available_items, total_bids, highest_bid_sum, last_activity])
+
+
+def record_item_listed(item):
+    if item.availability == AVAILABLE_CHOICE:
+        bump_collection_stats(item.collection_id, available_items=1, highest_bid_sum=item.highest_bid, last_activity=timezone.now())
+
+
+# old_highest is what the item's highest bid was before it. the upsert row-locks the collection's stats,
+# so it runs after the bid commits rather than making every bid in the collection queue behind it; a
+# delta lost in between is repaired by reconcile_collection_stats
+def record_bid(item, bid_price, old_highest, time_of_bid):
+    transaction.on_commit(lambda: bump_collection_stats(
+        item.collection_id, total_bids=1, highest_bid_sum=bid_price - old_highest, last_activity=time_of_bid,
+    ))
+
+
+# takes an item off the market (sold, expired) and counts it out, unless something else already closed it
+def close_item(item, availability):
+    closed = Item.objects.filter(pk=item.pk, availability=AVAILABLE_CHOICE).update(availability=availability)
+    if closed:
+        bump_collection_stats(item.collection_id, available_items=-1, highest_bid_sum=-item.highest_bid)
+    return bool(closed)
+
+
+# for set-based closes: rows of (collection_id, highest_bid) for the items that just left the market
+def record_items_closed(rows):
+    totals = {}
+    for collection_id, highest_bid in rows:
+        count, bid_sum = totals.get(collection_id, (0, Decimal('0.00')))
+        totals[collection_id] = (count + 1, bid_sum + highest_bid)
+    for collection_id, (count, bid_sum) in totals.items():
+        bump_collection_stats(collection_id, available_items=-count, highest_bid_sum=-bid_sum)
+
+
+# recomputes every collection's stats; items and bids are aggregated separately so the counts don't fan out
+def reconcile_collection_stats():
+    item_stats = Item.objects.filter(collection__isnull=False).values('collection_id').annotate(
+        available_items=Count('id', filter=Q(availability=AVAILABLE_CHOICE)),
+        highest_bid_sum=Sum('highest_bid', filter=Q(availability=AVAILABLE_CHOICE)),
+    )
+    bid_stats = {
+        row['item__collection_id']: row
+        for row in Bid.objects.filter(item__collection__isnull=False).values('item__collection_id').annotate(
+            total_bids=Count('id'),
+            last_activity=Max('time_of_bid'),
+        )
+    }
+
+    # listings also count as activity, and those are only recorded on the stats row
+    previous_activity = dict(CollectionStats.objects.values_list('collection_id', 'last_activity'))
+
+    stats = []
+    for row in item_stats:
+        bids = bid_stats.get(row['collection_id'], {})
+        activity = [t for t in (bids.get('last_activity'), previous_activity.get(row['collection_id'])) if t is not None]
+        stats.append(CollectionStats(
+            collection_id=row['collection_id'],
+            available_items=row['available_items'],
+            total_bids=bids.get('total_bids', 0),
+            highest_bid_sum=row['highest_bid_sum'] or Decimal('0.00'),
+            last_activity=max(activity, default=None),
+        ))
+
+    CollectionStats.objects.bulk_create(
+        stats,
+        update_conflicts=True,
+        unique_fields=['collection'],
+        update_fields=['available_items', 'total_bids', 'highest_bid_sum', 'last_activity'],
+    )
+    # collections whose items were all deleted
+    CollectionStats.objects.exclude(collection_id__in=[s.collection_id for s in stats]).delete()
+    return len(stats)
@@ -0,0 +1,72 @@
+from .models import Item
+from .utils import get_redis
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse, Http404
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+import json
+
+KEEP_ALIVE_SECONDS = 15
+
+
+def item_channel(item_id):
+    return f"item-events:{item_id}"
+
+
+def item_event_payload(item):
+    return {
+        'item': item.pk,
+        'highest_bid': float(item.highest_bid),
+        'total_bids': item.total_bids,
+        'deadline': item.deadline.isoformat(),
+        'availability': item.availability,
+    }
+
+
+# broadcasts the item's live auction state to everyone streaming /api/items/<id>/events/
+def publish_item_update(item):
+    message = json.dumps(item_event_payload(item))
+
+    def publish():
+        try:
+            get_redis().publish(item_channel(item.pk), message)
+        except RedisError as e:
+            print(f"Failed to publish update for item {item.pk}: {str(e)}")
+
+    # only tell listeners about state that actually committed
+    transaction.on_commit(publish)
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+# server-sent events stream of new highest bid, bid count and deadline changes for one item
+async def item_events(request, item_id):
+    item = await Item.objects.filter(pk=item_id).afirst()
+    if item is None:
+        raise Http404("Item not found")
+
+    async def stream():
+        client = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(item_channel(item_id))
+        try:
+            # current state first so the client does not need a separate fetch
+            yield _sse('item', json.dumps(item_event_payload(item)))
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=KEEP_ALIVE_SECONDS)
+                if message is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield _sse('item', message['data'])
+        finally:
+            await pubsub.unsubscribe(item_channel(item_id))
+            await pubsub.aclose()
+            await client.aclose()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # stop proxies from buffering the stream
+    return response
@@ -0,0 +1,153 @@
+from .models import *
+from .choices import *
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, DecimalField, ExpressionWrapper, F
+from .hot_score import hot_items
+from .recent_bids import recent_bid_items
+import time
+
+# explore page snapshots: each section is built by a query below, stored in the cache and rebuilt by
+# the refresh_explore_snapshots task when its interval is up or an event marked it stale, so page
+# loads only read the cache
+
+
+# collections with available items, busiest first, read from the denormalized CollectionStats
+def popular_collection_stats():
+    return CollectionStats.objects.filter(available_items__gt=0).annotate(
+        avg_bid=ExpressionWrapper(F('highest_bid_sum') / F('available_items'), output_field=DecimalField()),
+    ).order_by('-total_bids', '-avg_bid', '-available_items')
+
+
+def build_trending_categories():
+    return list(popular_collection_stats().values(
+        'total_bids',
+        'avg_bid',
+        id=F('collection_id'),
+        title=F('collection__title'),
+        item_count=F('available_items'),
+    )[:5])
+
+
+def build_recent_bids():
+    from .serializers import ItemSerializer
+
+    # last 10 available items with bids, from the feed the bid path maintains (api/recent_bids.py)
+    return ItemSerializer(recent_bid_items(10), many=True).data
+
+
+def build_popular_items():
+    from .serializers import ItemSerializer
+
+    # time-decayed bids/saves/comments, see api/hot_score.py
+    popular_items = hot_items(10).select_related('profile__account__user')
+
+    return ItemSerializer(popular_items, many=True).data
+
+
+def build_cheapest_in_popular():
+    from .serializers import ItemSerializer
+
+    # First get popular categories (those with most items and bids)
+    popular_categories = popular_collection_stats().values('collection_id')[:5]
+
+    # Then get cheapest available items from these categories
+    cheapest_items = Item.objects.filter(
+        availability=AVAILABLE_CHOICE,
+        collection__in=popular_categories
+    ).order_by(
+        'selling_price'
+    ).select_related('profile__account__user')[:10]
+
+    return ItemSerializer(cheapest_items, many=True).data
+
+
+def build_by_rating():
+    from .serializers import ItemSerializer
+
+    # items don't have reviews; sellers do
+    rated_items = Item.objects.filter(
+        availability=AVAILABLE_CHOICE
+    ).annotate(
+        avg_rating=Avg('profile__ratings_received__rating')
+    ).filter(
+        avg_rating__gte=3.0,
+        avg_rating__lte=3.9
+    ).order_by(
+        '-avg_rating',
+        'selling_price'  # Secondary sort by price
+    ).select_related('profile__account__user')[:10]
+
+    return ItemSerializer(rated_items, many=True).data
+
+
+# name -> (builder, events that make it stale); refresh intervals are in settings.EXPLORE_SNAPSHOT_INTERVALS
+SNAPSHOTS = {
+    'trending-categories': (build_trending_categories, {'bid', 'item'}),
+    'recent-bids': (build_recent_bids, {'bid', 'item'}),
+    'popular': (build_popular_items, {'bid', 'save', 'comment', 'item'}),
+    'best-deals': (build_cheapest_in_popular, {'bid', 'item'}),
+    'by-rating': (build_by_rating, {'item', 'rating'}),
+}
+
+
+def snapshot_key(name):
+    return f'explore_snapshot_{name}'
+
+
+def stale_key(name):
+    return f'explore_stale_{name}'
+
+
+# serves a snapshot from the cache; only a cold cache falls through to the database
+def get_snapshot(name):
+    entry = cache.get(snapshot_key(name))
+    if entry is not None:
+        return entry['data']
+    return build_snapshot(name)
+
+
+# single-flight: whoever gets the lock rebuilds, everyone else waits for its result
+def build_snapshot(name):
+    lock_key = f'explore_lock_{name}'
+    if not cache.add(lock_key, 1, timeout=settings.EXPLORE_SNAPSHOT_BUILD_TIMEOUT):
+        deadline = time.monotonic() + settings.EXPLORE_SNAPSHOT_BUILD_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(snapshot_key(name))
+            if entry is not None:
+                return entry['data']
+        # the builder died or is stuck; answer this request without caching
+        return SNAPSHOTS[name][0]()
+
+    try:
+        # cleared before building, so events that land mid-build still trigger the next refresh
+        cache.delete(stale_key(name))
+        data = SNAPSHOTS[name][0]()
+        cache.set(snapshot_key(name), {'data': data, 'built_at': time.time()}, timeout=None)
+        return data
+    finally:
+        cache.delete(lock_key)
+
+
+def refresh_snapshots(force=False):
+    refreshed = []
+    now = time.time()
+    for name in SNAPSHOTS:
+        entry = cache.get(snapshot_key(name))
+        if (
+            force
+            or entry is None
+            or cache.get(stale_key(name))
+            or now - entry['built_at'] >= settings.EXPLORE_SNAPSHOT_INTERVALS[name]
+        ):
+            build_snapshot(name)
+            refreshed.append(name)
+    return refreshed
+
+
+# marks every snapshot that depends on this kind of event ('bid', 'save', 'comment', 'item', 'rating') for a rebuild
+def mark_snapshots_stale(event):
+    names = [name for name, (builder, events) in SNAPSHOTS.items() if event in events]
+    transaction.on_commit(lambda: cache.set_many({stale_key(name): 1 for name in names}, timeout=None))
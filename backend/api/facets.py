@@ -0,0 +1,68 @@
+from .models import Collection
+from .choices import *
+from django.conf import settings
+from django.db import connection
+
+# every facet of a filtered item queryset in one grouped pass: GROUPING SETS produces the collection,
+# availability and price bucket counts (plus the overall total) from a single scan of the filtered rows,
+# and GROUPING() tells the sets apart
+FACETS_SQL = """
+    WITH filtered AS ({filtered})
+    SELECT
+        GROUPING(collection_id) AS by_collection,
+        GROUPING(availability) AS by_availability,
+        GROUPING(price_bucket) AS by_price,
+        collection_id, availability, price_bucket, COUNT(*)
+    FROM (
+        SELECT collection_id, availability, width_bucket(highest_bid, %s::numeric[]) AS price_bucket
+        FROM filtered
+    ) AS bucketed
+    GROUP BY GROUPING SETS ((collection_id), (availability), (price_bucket), ())
+"""
+
+
+def item_facets(queryset):
+    edges = settings.FACET_PRICE_BUCKETS
+    filtered, params = queryset.order_by().values('collection_id', 'availability', 'highest_bid').query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        cursor.execute(FACETS_SQL.format(filtered=filtered), [*params, edges])
+        rows = cursor.fetchall()
+
+    total = 0
+    collections, availability, price = {}, {}, {}
+    for by_collection, by_availability, by_price, collection_id, code, bucket, count in rows:
+        if not by_collection:
+            collections[collection_id] = count
+        elif not by_availability:
+            availability[code] = count
+        elif not by_price:
+            price[bucket] = count
+        else:
+            total = count
+
+    titles = dict(Collection.objects.filter(pk__in=[pk for pk in collections if pk is not None]).values_list('id', 'title'))
+    labels = dict(AVAILABILITY_CHOICES)
+
+    # width_bucket: 0 is below the first edge, len(edges) is at or above the last
+    def bucket_range(bucket):
+        return {
+            'min': edges[bucket - 1] if bucket > 0 else None,
+            'max': edges[bucket] if bucket < len(edges) else None,
+        }
+
+    return {
+        'total': total,
+        'collections': [
+            {'id': pk, 'title': titles.get(pk), 'count': count}
+            for pk, count in sorted(collections.items(), key=lambda facet: -facet[1])
+        ],
+        'availability': [
+            {'value': code, 'label': labels.get(code, code), 'count': count}
+            for code, count in sorted(availability.items(), key=lambda facet: -facet[1])
+        ],
+        'price': [
+            {**bucket_range(bucket), 'count': count}
+            for bucket, count in sorted(price.items())
+        ],
+    }
@@ -1,12 +1,46 @@
 from django_filters import FilterSet, CharFilter
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+from rest_framework.filters import BaseFilterBackend
 from .models import *
+from .choices import *
 
 class ItemFilter(FilterSet):
-    availability = CharFilter(field_name='availability', lookup_expr='iexact')
+    availability = CharFilter(method='filter_availability')
     class Meta:
         model = Item
         fields = {
             'collection__title': ['iexact'],
             'profile__account_id': ['exact'],
             'highest_bid': ['gt', 'lt']
-        }
\ No newline at end of file
+        }
+
+    # takes the stored code (A/S/E) or its label (available/sold/expired); an exact match can use the indexes
+    def filter_availability(self, queryset, name, value):
+        codes = {label.lower(): code for code, label in AVAILABILITY_CHOICES}
+        return queryset.filter(availability=codes.get(value.strip().lower(), value.strip().upper()))
+
+# full-text search over Item.search_vector (GIN indexed): ?q=vintage lamp, or the older ?search=
+# best matches come first unless the request also passes ?ordering=
+class ItemSearchFilter(BaseFilterBackend):
+    search_params = ['q', 'search']
+
+    def get_search_terms(self, request):
+        for param in self.search_params:
+            terms = request.query_params.get(param, '').strip()
+            if terms:
+                return terms
+        return None
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+
+        query = SearchQuery(terms, search_type='websearch', config='english')
+        # ts_rank is a real; as double precision the rank round-trips exactly through a pagination cursor,
+        # so rows tied on rank compare equal to it
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=Cast(SearchRank(F('search_vector'), query), FloatField())
+        ).order_by('-search_rank', '-id')
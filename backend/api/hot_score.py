@@ -0,0 +1,72 @@
+from .models import Item, Bid, Save, Comment
+from .choices import *
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+import math
+import time
+
+# Item.hot_score is the log of an exponentially decayed interaction count:
+#     ln(sum of weight * 2 ** ((t_event - HOT_SCORE_EPOCH) / half_life))
+# each event is weighted by when it happened instead of decaying the stored totals over time, so
+# ordering by the column ranks items by their decayed count right now and a score never needs
+# touching again after the event. storing the log keeps the growing exponent in float range.
+# changing HOT_SCORE_HALF_LIFE or HOT_SCORE_WEIGHTS needs a manage.py rebuild_hot_scores
+HOT_SCORE_EPOCH = 1767225600 # 2026-01-01 UTC
+
+
+def decay_rate():
+    return math.log(2) / settings.HOT_SCORE_HALF_LIFE
+
+
+def event_score(event, timestamp=None):
+    timestamp = time.time() if timestamp is None else timestamp
+    return math.log(settings.HOT_SCORE_WEIGHTS[event]) + decay_rate() * (timestamp - HOT_SCORE_EPOCH)
+
+
+# adds one 'bid'/'save'/'comment' to an item's score in a single UPDATE:
+# ln(e^a + e^b) = max(a, b) + ln(1 + e^-|a - b|), which never overflows
+def bump_hot_score(item_id, event, timestamp=None):
+    score = Value(event_score(event, timestamp), output_field=FloatField())
+    Item.objects.filter(pk=item_id).update(hot_score=Case(
+        When(hot_score__isnull=True, then=score),
+        default=Greatest(F('hot_score'), score) + Ln(Value(1.0) + Exp(-Abs(F('hot_score') - score))),
+        output_field=FloatField(),
+    ))
+
+
+def hot_items(limit=10):
+    # top-K walk of the partial index on available, scored items
+    return Item.objects.filter(availability=AVAILABLE_CHOICE, hot_score__isnull=False).order_by('-hot_score')[:limit]
+
+
+# recomputes every score from the bid, save and comment history, with the same log-sum-exp trick per item
+REBUILD_SQL = f"""
+    WITH events AS (
+        SELECT item_id, %(bid)s + %(rate)s * (EXTRACT(EPOCH FROM time_of_bid) - %(epoch)s) AS x FROM {Bid._meta.db_table}
+        UNION ALL
+        SELECT item_id, %(save)s + %(rate)s * (EXTRACT(EPOCH FROM time_saved) - %(epoch)s) FROM {Save._meta.db_table}
+        UNION ALL
+        SELECT item_id, %(comment)s + %(rate)s * (EXTRACT(EPOCH FROM date_of_comment) - %(epoch)s) FROM {Comment._meta.db_table}
+    ),
+    peaks AS (
+        SELECT item_id, MAX(x) AS peak FROM events GROUP BY item_id
+    ),
+    scores AS (
+        SELECT events.item_id, peaks.peak + LN(SUM(EXP(events.x - peaks.peak))) AS score
+        FROM events JOIN peaks ON peaks.item_id = events.item_id
+        GROUP BY events.item_id, peaks.peak
+    )
+    UPDATE {Item._meta.db_table} AS item SET hot_score = scores.score
+    FROM scores WHERE item.id = scores.item_id
+"""
+
+
+def rebuild_hot_scores():
+    params = {event: math.log(weight) for event, weight in settings.HOT_SCORE_WEIGHTS.items()}
+    params.update(rate=decay_rate(), epoch=HOT_SCORE_EPOCH)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"UPDATE {Item._meta.db_table} SET hot_score = NULL WHERE hot_score IS NOT NULL")
+        cursor.execute(REBUILD_SQL, params)
+        return cursor.rowcount
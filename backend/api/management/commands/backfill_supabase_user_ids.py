@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from backend.supabase_clients import get_service_client, supabase_call
+from api.models import Account
+
+
+class Command(BaseCommand):
+    help = 'Stores the Supabase auth user id on accounts registered before Account.supabase_user_id existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--per-page', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        supabase = get_service_client()
+        per_page = options['per_page']
+
+        # one pass over the Supabase users instead of a scan per account
+        ids_by_email = {}
+        page = 1
+        while True:
+            with supabase_call('auth.admin.list_users'):
+                users = supabase.auth.admin.list_users(page=page, per_page=per_page)
+            for user_data in users:
+                if user_data.email:
+                    ids_by_email[user_data.email.lower()] = user_data.id
+            if len(users) < per_page:
+                break
+            page += 1
+
+        self.stdout.write(f"Fetched {len(ids_by_email)} Supabase users")
+
+        accounts = []
+        for account in Account.objects.filter(supabase_user_id__isnull=True).select_related('user'):
+            supabase_user_id = ids_by_email.get(account.user.email.lower())
+            if supabase_user_id is None:
+                self.stdout.write(self.style.WARNING(f"No Supabase user for {account.user.email}"))
+                continue
+            account.supabase_user_id = supabase_user_id
+            accounts.append(account)
+
+        Account.objects.bulk_update(accounts, ['supabase_user_id'], batch_size=500)
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {len(accounts)} accounts"))
@@ -0,0 +1,349 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import RequestFactory, override_settings
+from backend.middleware import SupabaseAuthentication, verify_supabase_token
+from backend.identity import identity_cache
+from backend import supabase_clients
+from backend.supabase_clients import get_anon_client, supabase_call, OfflineSupabaseClient
+from rest_framework.test import APIRequestFactory
+from supabase import create_client
+from api.views import AccountViewSet, ItemViewSet
+from api.models import Account, Profile, Item, Bid
+from api.choices import *
+from api.hot_score import bump_hot_score, hot_items, rebuild_hot_scores
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from rest_framework.request import Request
+from api.filters import ItemSearchFilter
+from api.pagination import ItemKeysetPagination
+from api.serializers import ItemSerializer
+from django.utils import timezone
+from datetime import timedelta
+import statistics
+import time
+import jwt
+
+
+# vocabulary for the synthetic catalogue used by the search benchmarks
+CATALOGUE_WORDS = [
+    'vintage', 'lamp', 'oak', 'table', 'chair', 'leather', 'jacket', 'vinyl', 'record', 'camera', 'lens',
+    'brass', 'mirror', 'silk', 'scarf', 'ceramic', 'vase', 'walnut', 'desk', 'wool', 'rug', 'copper', 'kettle',
+    'guitar', 'amplifier', 'watch', 'bicycle', 'poster', 'print', 'marble', 'clock', 'velvet', 'sofa', 'glass',
+    'bowl', 'linen', 'shirt', 'denim', 'boots', 'pottery', 'teak', 'cabinet', 'bronze', 'statue', 'rare',
+] + [f"word{i}" for i in range(2000)]
+
+
+def measure(fn, iterations):
+    timings = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        fn(i)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'mean': statistics.mean(timings),
+        'p50': timings[len(timings) // 2],
+        'p95': timings[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0],
+        'ops': iterations / (sum(timings) / 1000),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks performance-sensitive code paths: python manage.py benchmark <target>'
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='target', required=True)
+
+        auth = subparsers.add_parser('auth', help='Per-request authentication overhead')
+        auth.add_argument('--iterations', type=int, default=1000)
+        auth.add_argument('--token', help='A real access token, to also time the remote get_user round-trip')
+
+        registration = subparsers.add_parser('registration', help='Registrations per second per worker, against the offline Supabase client')
+        registration.add_argument('--iterations', type=int, default=100)
+        registration.add_argument('--remote-latency', type=float, default=50.0, help='Simulated auth.admin round-trip in ms')
+
+        hot_score = subparsers.add_parser('hot-score', help='Popular items: per-request aggregation vs. the hot score index')
+        hot_score.add_argument('--items', type=int, default=10000)
+        hot_score.add_argument('--bids', type=int, default=1000000)
+        hot_score.add_argument('--iterations', type=int, default=50)
+
+        search = subparsers.add_parser('search', help='Item search: ILIKE scans vs. the full-text index, on a synthetic catalogue')
+        search.add_argument('--items', type=int, default=1000000)
+        search.add_argument('--iterations', type=int, default=50)
+
+        suggest = subparsers.add_parser('suggest', help='Autocomplete latency on a synthetic catalogue (target: p95 under 20 ms)')
+        suggest.add_argument('--items', type=int, default=1000000)
+        suggest.add_argument('--iterations', type=int, default=200)
+
+        pagination = subparsers.add_parser('pagination', help='Deep item pages: OFFSET vs. keyset cursors')
+        pagination.add_argument('--items', type=int, default=1000000)
+        pagination.add_argument('--iterations', type=int, default=20)
+        pagination.add_argument('--ordering', default='-date_posted', choices=ItemKeysetPagination.orderings)
+
+        serializer = subparsers.add_parser('serializer', help='Item list serialization throughput: instances vs. values() rows vs. sparse fieldsets')
+        serializer.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 10000])
+        serializer.add_argument('--iterations', type=int, default=10)
+        serializer.add_argument('--fields', default='id,title,selling_price,thumbnail')
+
+    def handle(self, *args, **options):
+        getattr(self, f"bench_{options['target'].replace('-', '_')}")(options)
+
+    def report(self, label, result):
+        self.stdout.write(
+            f"{label:<40} mean {result['mean']:8.3f} ms   p50 {result['p50']:8.3f} ms   "
+            f"p95 {result['p95']:8.3f} ms   {result['ops']:10.1f} ops/s"
+        )
+
+    # per-call Supabase latency recorded by supabase_call during the run
+    def report_supabase_calls(self):
+        for name, stats in sorted(supabase_clients.get_call_stats().items()):
+            self.stdout.write(
+                f"{'supabase ' + name:<40} calls {stats['count']:6d}   errors {stats['errors']:4d}   "
+                f"mean {stats['mean_ms']:8.3f} ms   max {stats['max_ms']:8.3f} ms"
+            )
+
+    def bench_auth(self, options):
+        iterations = options['iterations']
+        secret = 'benchmark-secret'
+        now = int(time.time())
+        tokens = [
+            jwt.encode(
+                {'sub': str(i), 'email': f"bench{i}@example.com", 'aud': 'authenticated', 'exp': now + 3600},
+                secret,
+                algorithm='HS256',
+            )
+            for i in range(iterations)
+        ]
+
+        with override_settings(SUPABASE_JWT_SECRET=secret):
+            self.report('local verification (cache miss)', measure(lambda i: verify_supabase_token(tokens[i]), iterations))
+
+            # full authenticate on a warm session cache, the common case
+            authentication = SupabaseAuthentication()
+            request = RequestFactory().get('/', HTTP_X_AUTH_TOKEN=tokens[0])
+            authentication.authenticate(request)
+            self.report('authenticate (session cached)', measure(lambda i: authentication.authenticate(request), iterations))
+            identity_cache.delete(tokens[0])
+            User.objects.filter(email="bench0@example.com", account__isnull=True).delete()
+
+        if options['token']:
+            # what every cache miss used to cost: a fresh client plus a network round-trip
+            def remote(i):
+                client = create_client(settings.SUPABASE_URL, settings.SUPABASE_ANON_KEY)
+                client.auth.get_user(options['token'])
+
+            self.report('remote get_user (previous behaviour)', measure(remote, min(iterations, 50)))
+
+            # same round-trip over the pooled client, reusing its keep-alive connection
+            def pooled(i):
+                with supabase_call('auth.get_user'):
+                    get_anon_client().auth.get_user(options['token'])
+
+            supabase_clients.reset_call_stats()
+            self.report('remote get_user (pooled client)', measure(pooled, min(iterations, 50)))
+            self.report_supabase_calls()
+
+    def bench_registration(self, options):
+        iterations = options['iterations']
+        latency = options['remote_latency'] / 1000
+
+        class SlowOfflineClient(OfflineSupabaseClient):
+            def _create_user(self, attributes):
+                time.sleep(latency)
+                return super()._create_user(attributes)
+
+        register = AccountViewSet.as_view({'post': 'register'})
+        factory = APIRequestFactory()
+        prefix = f"bench{int(time.time()) % 100000}"
+
+        def run(i):
+            response = register(factory.post('/api/accounts/register/', {
+                'username': f"{prefix}-{i}",
+                'email': f"{prefix}-{i}@example.com",
+                'password': 'benchmark-password',
+                'first_name': 'Bench',
+                'last_name': str(i),
+            }, format='json'))
+            assert response.status_code == 201, response.data
+
+        supabase_clients.set_client_factory(SlowOfflineClient)
+        supabase_clients.reset_call_stats()
+        try:
+            result = measure(run, iterations)
+        finally:
+            supabase_clients.set_client_factory(None)
+            users = User.objects.filter(email__startswith=f"{prefix}-")
+            Profile.objects.filter(account__user__in=users).delete()
+            Account.objects.filter(user__in=users).delete()
+            users.delete()
+
+        self.report(f"register ({options['remote_latency']:.0f} ms remote)", result)
+        self.report_supabase_calls()
+
+    # synthetic items and bids inside a transaction that is rolled back at the end
+    def seed_bids(self, items, bids):
+        profile = Profile.objects.select_related('account').first()
+        if profile is None:
+            raise SystemExit("benchmark needs at least one profile in the database")
+
+        deadline = timezone.now() + timedelta(days=7)
+        created = Item.objects.bulk_create(
+            [Item(title=f"benchmark {i}", profile=profile, description="", selling_price=10, deadline=deadline) for i in range(items)],
+            batch_size=5000,
+        )
+        item_ids = [item.id for item in created]
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                INSERT INTO {Bid._meta.db_table} (profile_id, item_id, bid_price, time_of_bid, status, winner_status)
+                SELECT %s, (%s::bigint[])[1 + floor(random() * %s)::int], round((random() * 1000)::numeric, 2),
+                       now() - random() * interval '30 days', %s, %s
+                FROM generate_series(1, %s)
+            """, [profile.id, item_ids, len(item_ids), NOT_HIGHEST_CHOICE, WINNING_INELIGIBLE_CHOICE, bids])
+            cursor.execute("ANALYZE")
+        return item_ids
+
+    def bench_hot_score(self, options):
+        iterations = options['iterations']
+
+        with transaction.atomic():
+            item_ids = self.seed_bids(options['items'], options['bids'])
+            self.stdout.write(f"seeded {len(item_ids)} items and {options['bids']} bids")
+
+            def aggregate(i):
+                list(Item.objects.filter(availability=AVAILABLE_CHOICE).annotate(
+                    bid_count=Count('bid', distinct=True),
+                    save_count=Count('save', distinct=True),
+                ).order_by('-bid_count', '-save_count').values_list('id', flat=True)[:10])
+
+            self.report('popular (count per request)', measure(aggregate, max(1, iterations // 10)))
+
+            started = time.perf_counter()
+            rebuild_hot_scores()
+            self.stdout.write(f"rebuild_hot_scores over {options['bids']} bids: {time.perf_counter() - started:.2f} s")
+
+            self.report('popular (hot score top-K)', measure(lambda i: list(hot_items(10).values_list('id', flat=True)), iterations))
+            self.report('bump_hot_score (per event)', measure(lambda i: bump_hot_score(item_ids[i % len(item_ids)], 'bid'), iterations))
+
+            transaction.set_rollback(True)
+
+    # a synthetic catalogue of random word titles and descriptions, generated in the database
+    def seed_items(self, count, words):
+        profile = Profile.objects.first()
+        if profile is None:
+            raise SystemExit("benchmark needs at least one profile in the database")
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                INSERT INTO {Item._meta.db_table} (title, image_urls, profile_id, description, selling_price, highest_bid,
+                    deadline, date_posted, total_bids, availability, minimum_bid, maximum_bid)
+                SELECT
+                    w[1 + floor(random() * n)::int] || ' ' || w[1 + floor(random() * n)::int] || ' ' || w[1 + floor(random() * n)::int],
+                    '[]', %s,
+                    w[1 + floor(random() * n)::int] || ' ' || w[1 + floor(random() * n)::int] || ' ' || w[1 + floor(random() * n)::int]
+                        || ' ' || w[1 + floor(random() * n)::int] || ' ' || w[1 + floor(random() * n)::int],
+                    10, 0, now() + interval '7 days', now(), 0, %s, 1, 1000000
+                FROM generate_series(1, %s), (SELECT %s::text[] AS w, cardinality(%s::text[]) AS n) AS vocabulary
+            """, [profile.id, AVAILABLE_CHOICE, count, words, words])
+            cursor.execute("ANALYZE")
+
+    def bench_search(self, options):
+        iterations = options['iterations']
+        queries = ['vintage lamp', 'oak desk', 'leather boots', 'ceramic', 'word1234', 'rare copper kettle']
+        search = ItemSearchFilter()
+
+        with transaction.atomic():
+            self.seed_items(options['items'], CATALOGUE_WORDS)
+            self.stdout.write(f"seeded {options['items']} items")
+
+            def ilike(i):
+                term = queries[i % len(queries)]
+                list(Item.objects.filter(
+                    Q(title__icontains=term) | Q(description__icontains=term)
+                ).values_list('id', flat=True)[:20])
+
+            def full_text(i):
+                request = Request(RequestFactory().get('/', {'q': queries[i % len(queries)]}))
+                list(search.filter_queryset(request, Item.objects.all(), None).values_list('id', flat=True)[:20])
+
+            self.report('search (ILIKE, previous SearchFilter)', measure(ilike, max(1, iterations // 5)))
+            self.report('search (full-text, ranked)', measure(full_text, iterations))
+
+            transaction.set_rollback(True)
+
+    def bench_suggest(self, options):
+        iterations = options['iterations']
+        prefixes = ['vin', 'vintag', 'vintge', 'lam', 'oak d', 'leathr', 'cer', 'word12', 'coppr ket', 'guit']
+        suggest = ItemViewSet.as_view({'get': 'suggest'})
+        factory = APIRequestFactory()
+
+        def run(i):
+            response = suggest(factory.get('/api/items/suggest/', {'prefix': prefixes[i % len(prefixes)]}))
+            assert response.status_code == 200
+
+        with transaction.atomic():
+            self.seed_items(options['items'], CATALOGUE_WORDS)
+            self.stdout.write(f"seeded {options['items']} items")
+
+            with override_settings(SUGGEST_CACHE_TIMEOUT=0):
+                uncached = measure(run, iterations)
+            self.report('suggest (uncached)', uncached)
+            self.report('suggest (cached prefixes)', measure(run, iterations))
+            self.stdout.write(f"p95 target of 20 ms {'met' if uncached['p95'] < 20 else 'NOT met'} without the cache")
+
+            transaction.set_rollback(True)
+
+    def bench_pagination(self, options):
+        iterations = options['iterations']
+        ordering = options['ordering']
+        page_size = ItemKeysetPagination.page_size
+        direction = '-' if ordering.startswith('-') else ''
+        items = Item.objects.filter(availability=AVAILABLE_CHOICE)
+
+        with transaction.atomic():
+            self.seed_items(options['items'], CATALOGUE_WORDS)
+            self.stdout.write(f"seeded {options['items']} items")
+
+            for depth in [0, 1000, 100000, options['items'] - page_size]:
+                paginator = ItemKeysetPagination()
+                cursor = None
+                if depth:
+                    # the cursor a client holds after paging down to this depth
+                    last = items.order_by(ordering, f'{direction}id')[depth - 1]
+                    cursor = paginator.encode_cursor(ordering, getattr(last, ordering.lstrip('-')), last.id)
+                params = {'ordering': ordering, **({'cursor': cursor} if cursor else {})}
+                request = Request(RequestFactory().get('/api/items/', params))
+
+                offset = lambda i: list(items.order_by(ordering, f'{direction}id')[depth:depth + page_size])
+                keyset = lambda i: paginator.paginate_queryset(items, request)
+
+                self.report(f"page at row {depth} (OFFSET)", measure(offset, iterations))
+                self.report(f"page at row {depth} (keyset)", measure(keyset, iterations))
+
+            transaction.set_rollback(True)
+
+    def bench_serializer(self, options):
+        iterations = options['iterations']
+        items = Item.objects.order_by('id')
+        full = ItemSerializer()
+        sparse = ItemSerializer(context={'request': Request(RequestFactory().get('/api/items/', {'fields': options['fields']}))})
+
+        with transaction.atomic():
+            self.seed_items(max(options['rows']), CATALOGUE_WORDS)
+            self.stdout.write(f"seeded {max(options['rows'])} items")
+
+            for rows in options['rows']:
+                paths = [
+                    # previous behaviour: instances, with username and display_icon traversed per row
+                    ('instances', lambda i: ItemSerializer(list(items[:rows]), many=True).data),
+                    ('instances + select_related', lambda i: ItemSerializer(list(items.select_related('profile__account__user')[:rows]), many=True).data),
+                    ('values() rows', lambda i: full.rows_to_representation(full.row_queryset(items)[:rows])),
+                    ('values() rows, sparse fields', lambda i: sparse.rows_to_representation(sparse.row_queryset(items)[:rows])),
+                ]
+                for label, fn in paths:
+                    result = measure(fn, iterations)
+                    self.report(f"{rows} rows, {label}", result)
+                    self.stdout.write(f"{'':<40} {rows * result['ops']:10.0f} rows/s")
+
+            transaction.set_rollback(True)
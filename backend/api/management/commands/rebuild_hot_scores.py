@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api.hot_score import rebuild_hot_scores
+
+
+class Command(BaseCommand):
+    help = 'Recomputes Item.hot_score from the bid, save and comment history (after changing HOT_SCORE_* settings)'
+
+    def handle(self, *args, **options):
+        updated = rebuild_hot_scores()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt hot scores for {updated} items"))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api.scheduler import schedule_open_auctions
+
+
+class Command(BaseCommand):
+    help = 'Adds every open auction to the redis close schedule (items listed before it existed, or after a redis outage)'
+
+    def handle(self, *args, **options):
+        scheduled = schedule_open_auctions()
+        self.stdout.write(self.style.SUCCESS(f"Scheduled {scheduled} open auctions"))
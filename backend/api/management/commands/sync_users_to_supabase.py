@@ -1,27 +1,109 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
-from django.conf import settings
-from supabase import create_client
+from backend.supabase_clients import get_service_client, supabase_call, BACKEND_APP_METADATA
+from api.models import Account
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import time
+
+CREATED, SKIPPED, FAILED = 'created', 'skipped', 'failed'
+
 
 class Command(BaseCommand):
     help = 'Syncs Django users to Supabase authentication'
 
-    def handle(self, *args, **kwargs):
-        supabase = create_client(
-            settings.SUPABASE_URL,
-            settings.SUPABASE_SERVICE_ROLE_KEY
-        )
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent auth.admin.create_user calls')
+        parser.add_argument('--checkpoint', default='.sync_users_to_supabase.json', help='Progress file used to resume an interrupted run')
+        parser.add_argument('--reset', action='store_true', help='Ignore the checkpoint and start from the first user')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be synced without calling Supabase')
 
-        users = User.objects.all()
-        self.stdout.write(f"Found {users.count()} users to sync")
+    def handle(self, *args, **options):
+        supabase = get_service_client()
+        checkpoint = options['checkpoint']
+        dry_run = options['dry_run']
 
-        for user in users:
+        last_user_id = 0 if options['reset'] else self.read_checkpoint(checkpoint)
+        users = User.objects.filter(id__gt=last_user_id).select_related('account').order_by('id')
+        self.stdout.write(f"Found {users.count()} users to sync" + (f" (resuming after user {last_user_id})" if last_user_id else ""))
+
+        def create_auth_user(user):
             try:
-                supabase.auth.admin.create_user({
-                    'email': user.email,
-                    'password': 'hY0@<T5s', 
-                    'email_confirm': True
-                })
-                self.stdout.write(self.style.SUCCESS(f"Created auth user for {user.email}"))
+                with supabase_call('auth.admin.create_user'):
+                    response = supabase.auth.admin.create_user({
+                        'email': user.email,
+                        'password': 'hY0@<T5s',
+                        'email_confirm': True,
+                        'app_metadata': BACKEND_APP_METADATA,
+                    })
+                return CREATED, response.user.id
             except Exception as e:
-                self.stdout.write(self.style.ERROR(f"Failed to create {user.email}: {str(e)}"))
\ No newline at end of file
+                # a rerun after a crash hits users created just before the checkpoint was written
+                if 'already' in str(e).lower():
+                    return SKIPPED, None
+                return FAILED, str(e)
+
+        counts = {CREATED: 0, SKIPPED: 0, FAILED: 0}
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for chunk in self.chunks(users.iterator(chunk_size=options['chunk_size']), options['chunk_size']):
+                pending = []
+                for user in chunk:
+                    account = getattr(user, 'account', None)
+                    if not user.email or (account is not None and account.supabase_user_id is not None):
+                        counts[SKIPPED] += 1
+                    else:
+                        pending.append(user)
+
+                if dry_run:
+                    counts[CREATED] += len(pending)
+                    continue
+
+                synced_accounts = []
+                for user, (result, detail) in zip(pending, pool.map(create_auth_user, pending)):
+                    counts[result] += 1
+                    if result == FAILED:
+                        self.stdout.write(self.style.ERROR(f"Failed to create {user.email}: {detail}"))
+                    elif result == CREATED and getattr(user, 'account', None) is not None:
+                        user.account.supabase_user_id = detail
+                        synced_accounts.append(user.account)
+
+                Account.objects.bulk_update(synced_accounts, ['supabase_user_id'])
+                # failed users are not retried on resume; rerun with --reset, synced accounts are skipped cheaply
+                self.write_checkpoint(checkpoint, chunk[-1].id)
+
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f"Synced up to user {chunk[-1].id}: {sum(counts.values())} users in {elapsed:.1f}s")
+
+        elapsed = time.perf_counter() - started
+        total = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Would create' if dry_run else 'Created'} {counts[CREATED]}, skipped {counts[SKIPPED]}, "
+            f"failed {counts[FAILED]} in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} users/s)"
+        ))
+
+    def chunks(self, iterable, size):
+        chunk = []
+        for item in iterable:
+            chunk.append(item)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)['last_user_id']
+        except FileNotFoundError:
+            return 0
+
+    def write_checkpoint(self, path, last_user_id):
+        # write-then-rename so a crash never leaves a truncated checkpoint
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump({'last_user_id': last_user_id}, f)
+        os.replace(f"{path}.tmp", path)
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_pendingnotification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='supabase_user_id',
+            field=models.UUIDField(blank=True, default=None, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_collection_stats(apps, schema_editor):
+    Item = apps.get_model('api', 'Item')
+    Bid = apps.get_model('api', 'Bid')
+    CollectionStats = apps.get_model('api', 'CollectionStats')
+
+    item_stats = Item.objects.filter(collection__isnull=False).values('collection_id').annotate(
+        available_items=models.Count('id', filter=models.Q(availability='A')),
+        highest_bid_sum=models.Sum('highest_bid', filter=models.Q(availability='A')),
+    )
+    bid_stats = {
+        row['item__collection_id']: row
+        for row in Bid.objects.filter(item__collection__isnull=False).values('item__collection_id').annotate(
+            total_bids=models.Count('id'),
+            last_activity=models.Max('time_of_bid'),
+        )
+    }
+    CollectionStats.objects.bulk_create([
+        CollectionStats(
+            collection_id=row['collection_id'],
+            available_items=row['available_items'],
+            total_bids=bid_stats.get(row['collection_id'], {}).get('total_bids', 0),
+            highest_bid_sum=row['highest_bid_sum'] or 0,
+            last_activity=bid_stats.get(row['collection_id'], {}).get('last_activity'),
+        )
+        for row in item_stats
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_account_supabase_user_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CollectionStats',
+            fields=[
+                ('collection', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='api.collection')),
+                ('available_items', models.IntegerField(default=0)),
+                ('total_bids', models.IntegerField(default=0)),
+                ('highest_bid_sum', models.DecimalField(decimal_places=2, default=0.0, max_digits=14)),
+                ('last_activity', models.DateTimeField(blank=True, default=None, null=True)),
+            ],
+        ),
+        migrations.RunPython(populate_collection_stats, migrations.RunPython.noop),
+    ]
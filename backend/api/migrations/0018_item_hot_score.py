@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:00
+
+import django.db.models.expressions
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_collectionstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='hot_score',
+            field=models.FloatField(blank=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(django.db.models.expressions.OrderBy(django.db.models.expressions.F('hot_score'), descending=True), condition=models.Q(('availability', 'A'), ('hot_score__isnull', False)), name='item_hot_score_idx'),
+        ),
+    ]
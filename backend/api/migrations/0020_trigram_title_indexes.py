@@ -0,0 +1,24 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:00
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_item_search_vector'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='collection',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['title'], name='collection_title_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['title'], name='item_title_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
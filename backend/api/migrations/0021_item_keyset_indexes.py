@@ -0,0 +1,25 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_trigram_title_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['date_posted', 'id'], name='item_date_posted_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['total_bids', 'id'], name='item_total_bids_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['highest_bid', 'id'], name='item_highest_bid_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.2 on 2026-10-18 15:00
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_item_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='collection',
+            index=models.Index(django.db.models.functions.text.Upper('title'), name='collection_title_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['collection', 'availability', 'highest_bid'], name='item_collection_browse_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['profile', 'availability', 'date_posted'], name='item_profile_browse_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('availability', 'A')), fields=['highest_bid'], name='item_available_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('availability', 'A')), fields=['deadline'], name='item_available_deadline_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['item', '-bid_price', 'time_of_bid'], name='bid_item_price_time_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_browse_and_deadline_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='item',
+            name='item_collection_browse_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='item',
+            name='item_available_price_idx',
+        ),
+    ]
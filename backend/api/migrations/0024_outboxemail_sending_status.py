@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_drop_redundant_item_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outboxemail',
+            name='status',
+            field=models.CharField(choices=[('P', 'Pending'), ('C', 'Sending'), ('S', 'Sent'), ('F', 'Failed')], default='P', max_length=1),
+        ),
+    ]
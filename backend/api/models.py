@@ -6,11 +6,17 @@ from django.contrib.auth.models import User
 from django.utils.timezone import now
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.contrib.auth.hashers import make_password, check_password
 from django.db.models.aggregates import Avg
-from django.db.models import Q
-from supabase import Client, create_client
+from django.db.models import F, Q
+from django.db.models.functions import Upper
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from backend.supabase_clients import find_user_by_email, get_service_client, supabase_call
 from django.conf import settings
+from backend.identity import identity_cache
 
 # Create your models here.
 class Note(models.Model):
@@ -54,6 +60,12 @@ class ShippingAddress(models.Model):
         return f"{self.street_address} {self.city}, {self.state} {self.zip}, {self.country}"
 
 
+# cached identities (backend.identity) carry the user's name and permission flags
+@receiver(post_save, sender=User)
+def invalidate_cached_identity(sender, instance, **kwargs):
+    identity_cache.invalidate_user(instance.id)
+
+
 class Account(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     status = models.CharField(max_length=3, choices=USER_STATUS_CHOICES, default=STATUS_VISITOR)
@@ -65,26 +77,40 @@ class Account(models.Model):
     suspension_fine_paid = models.BooleanField(default=False)
     suspension_strikes = models.PositiveIntegerField(default=0)
     points = models.PositiveIntegerField(null=True, blank=True, default=0)
+    supabase_user_id = models.UUIDField(null=True, blank=True, unique=True, default=None)  # auth.users id, set at registration
 
-    def delete_account_user_profile(self):
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # cached identities (backend.identity) carry the account status
+        identity_cache.invalidate_user(self.user_id)
+
+    # removes the Supabase auth user; accounts registered before supabase_user_id existed (and not yet
+    # backfilled with manage.py backfill_supabase_user_ids) fall back to looking the user up by email
+    def delete_supabase_user(self):
+        supabase_user_id = self.supabase_user_id
+        if supabase_user_id is None:
+            supabase_user = find_user_by_email(self.user.email)
+            if supabase_user is None:
+                print(f"No Supabase user found for {self.user.email}, nothing to delete")
+                return
+            supabase_user_id = supabase_user.id
+
+        with supabase_call('auth.admin.delete_user'):
+            get_service_client().auth.admin.delete_user(str(supabase_user_id))
+
+    def delete_account_user_profile(self, delete_supabase_user=True):
         try:
             user = self.user 
 
-            supabase = create_client(
-                settings.SUPABASE_URL,
-                settings.SUPABASE_SERVICE_ROLE_KEY,
-            )
-
-            for user_data in supabase.auth.admin.list_users():
-                if user_data.email == self.user.email:
-                    supabase.auth.admin.delete_user(user_data.id)
-                    break
+            if delete_supabase_user:
+                self.delete_supabase_user()
 
             self.profile.delete()
 
             self.delete()
 
             user.delete()
+            identity_cache.invalidate_user(user.id)
 
             return True
         except:
@@ -159,10 +185,29 @@ class Profile(models.Model):
 class Collection(models.Model):
     title = models.TextField(max_length=255)
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='collection_title_trgm_idx'), # /api/items/suggest/
+            models.Index(Upper('title'), name='collection_title_upper_idx'), # ?collection__title= (iexact)
+        ]
+
     def __str__(self):
         return self.title
 
 
+# denormalized explore-page numbers per collection, maintained by api.collection_stats
+class CollectionStats(models.Model):
+    collection = models.OneToOneField(Collection, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    available_items = models.IntegerField(default=0)
+    total_bids = models.IntegerField(default=0) # bids on all of the collection's items, ever
+    highest_bid_sum = models.DecimalField(max_digits=14, decimal_places=2, default=0.00) # over available items
+    last_activity = models.DateTimeField(null=True, blank=True, default=None)
+
+    @property
+    def avg_highest_bid(self):
+        return self.highest_bid_sum / self.available_items if self.available_items > 0 else None
+
+
 class Item(models.Model):
     title = models.TextField(max_length=100)
     image_urls = models.JSONField(default=list)
@@ -178,7 +223,37 @@ class Item(models.Model):
     winning_bid = models.OneToOneField('Bid', null=True, on_delete=models.SET_NULL, related_name='winning_item', default=None)
     minimum_bid = models.DecimalField(max_digits=10, decimal_places=2,help_text="Minimum bid amount allowed", default=1.00)
     maximum_bid = models.DecimalField(max_digits=10, decimal_places=2,help_text="Maximum bid amount allowed", default=1000000.00)
-    
+    hot_score = models.FloatField(null=True, blank=True, default=None, editable=False) # only written by api.hot_score's UPDATEs; null until the first bid/save/comment
+    # maintained by postgres; titles outrank descriptions in search results
+    search_vector = models.GeneratedField(
+        expression=SearchVector('title', weight='A', config='english') + SearchVector('description', weight='B', config='english'),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='item_search_vector_idx'),
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='item_title_trgm_idx'), # /api/items/suggest/
+            # keyset pagination (api.pagination): one (sort field, id) index per browse ordering, scanned either way.
+            # every bid rewrites highest_bid/total_bids, and any index on them makes that UPDATE touch every
+            # index of the row, so these two are the only ones on bid-driven columns (the price one also
+            # serves the highest_bid range filter); collection browsing uses the collection foreign key index
+            models.Index(fields=['date_posted', 'id'], name='item_date_posted_keyset_idx'),
+            models.Index(fields=['total_bids', 'id'], name='item_total_bids_keyset_idx'),
+            models.Index(fields=['highest_bid', 'id'], name='item_highest_bid_keyset_idx'),
+            # browse filters (api.filters.ItemFilter)
+            models.Index(fields=['profile', 'availability', 'date_posted'], name='item_profile_browse_idx'),
+            # auction closing and reminders (api.tasks) only ever look at open auctions
+            models.Index(fields=['deadline'], name='item_available_deadline_idx', condition=Q(availability=AVAILABLE_CHOICE)),
+            # "popular" is a top-K read of this index
+            models.Index(
+                F('hot_score').desc(),
+                name='item_hot_score_idx',
+                condition=Q(availability=AVAILABLE_CHOICE, hot_score__isnull=False),
+            ),
+        ]
+
     def save(self, *args, **kwargs):
         if self.highest_bid is None:
             self.highest_bid = self.selling_price
@@ -200,7 +275,7 @@ class Item(models.Model):
             if winning_bid:
                 self.winning_bid = winning_bid
                 self.availability = SOLD_CHOICE
-                self.save()
+                self.save(update_fields=['winning_bid', 'availability'])
                 return winning_bid
         return None
     
@@ -213,6 +288,12 @@ class Bid(models.Model):
     status = models.CharField(max_length=3, choices=BID_STATUS_CHOICES)
     winner_status = models.CharField(max_length=1, choices=WINNING_STATUS_CHOICES, default=WINNING_INELIGIBLE_CHOICE)
 
+    class Meta:
+        indexes = [
+            # an item's bids best first, earliest winning ties (order book rebuilds, winner selection)
+            models.Index(fields=['item', '-bid_price', 'time_of_bid'], name='bid_item_price_time_idx'),
+        ]
+
 
 class Transaction(models.Model):
     seller = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='to_ship')
@@ -232,6 +313,9 @@ class Rating(models.Model):
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
 
+        from .explore import mark_snapshots_stale
+        mark_snapshots_stale('rating')
+
         ratee = self.ratee
         ratee_user = ratee.account.user
         ratings = Rating.objects.filter(ratee=ratee)
@@ -337,3 +421,51 @@ class UserApplication(models.Model):
     captcha_completed = models.BooleanField(default=False)
     time_of_application = models.DateTimeField(auto_now_add=True)
 
+
+# one row per notification that went out, so periodic reminders are only ever sent once
+class SentNotification(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=2, choices=NOTIFICATION_KIND_CHOICES)
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'item', 'kind'], name='unique_sent_notification'),
+        ]
+
+
+# emails waiting to be sent by api.tasks.flush_email_outbox
+class OutboxEmail(models.Model):
+    to_email = models.EmailField()
+    subject = models.TextField()
+    body = models.TextField()
+    from_email = models.EmailField(null=True, blank=True, default=None)
+    status = models.CharField(max_length=1, choices=OUTBOX_STATUS_CHOICES, default=OUTBOX_PENDING_CHOICE)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True, default=None)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_pending_idx'),
+        ]
+
+
+# notifications waiting to be bundled into a per-user digest by api.tasks.flush_notification_digests
+class PendingNotification(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    subject = models.TextField()
+    message = models.TextField()
+    coalesce_key = models.CharField(max_length=100, null=True, blank=True, default=None)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'coalesce_key'], name='unique_pending_notification_key'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='pending_notification_age_idx'),
+        ]
@@ -0,0 +1,108 @@
+from .models import Bid
+from .choices import *
+from .utils import get_redis
+from datetime import timedelta
+from redis.exceptions import RedisError
+
+RANKED_STATUSES = [HIGHEST_CHOICE, SECOND_HIGHEST_CHOICE, THIRD_HIGHEST_CHOICE]
+
+
+# sorted per-item order book kept in redis: one entry per profile holding its best bid.
+# a profile's newest accepted bid is always its best, since every bid must beat the current highest
+class BidOrderBook:
+    def __init__(self, item, redis_client=None):
+        self.item = item
+        self.redis = redis_client or get_redis()
+        self.key = f"orderbook:item:{item.pk}"
+        self.bids_key = f"{self.key}:bids"  # profile id -> bid id
+
+    def ensure_loaded(self):
+        if self.redis.exists(self.key):
+            return
+
+        # cold start: best bid per profile, earliest first on ties
+        best_bids = Bid.objects.filter(item_id=self.item.pk).order_by(
+            'profile_id', '-bid_price', 'time_of_bid'
+        ).distinct('profile_id').values_list('profile_id', 'id', 'bid_price')
+
+        pipe = self.redis.pipeline()
+        pipe.delete(self.key, self.bids_key)
+        for profile_id, bid_id, bid_price in best_bids:
+            pipe.zadd(self.key, {profile_id: float(bid_price)})
+            pipe.hset(self.bids_key, profile_id, bid_id)
+        self._expire(pipe)
+        pipe.execute()
+
+    def _expire(self, pipe):
+        # the book is only useful while the auction runs; it is rebuilt from Bid rows if needed again
+        expire_at = self.item.deadline + timedelta(days=1)
+        pipe.expireat(self.key, expire_at)
+        pipe.expireat(self.bids_key, expire_at)
+
+    # drop the cached book so the next reader rebuilds it from Bid rows
+    def invalidate(self):
+        try:
+            self.redis.delete(self.key, self.bids_key)
+        except RedisError:
+            pass
+
+    def add(self, bid):
+        self.ensure_loaded()
+        pipe = self.redis.pipeline()
+        pipe.zadd(self.key, {bid.profile_id: float(bid.bid_price)})
+        pipe.hset(self.bids_key, bid.profile_id, bid.id)
+        self._expire(pipe)
+        pipe.execute()
+
+    # [(profile id, bid id, bid price)] best first, O(log n + n). equal prices go to the earliest bid
+    # (lowest id) rather than redis' member order, so every profile tied with the n-th price is read too
+    def top(self, n=3):
+        self.ensure_loaded()
+        entries = self.redis.zrevrange(self.key, 0, n - 1, withscores=True)
+        if not entries:
+            return []
+        entries = self.redis.zrevrangebyscore(self.key, '+inf', entries[-1][1], withscores=True)
+        bid_ids = self.redis.hmget(self.bids_key, [profile_id for profile_id, _ in entries])
+        ranked = sorted(
+            ((int(profile_id), int(bid_id), price) for (profile_id, price), bid_id in zip(entries, bid_ids)),
+            key=lambda entry: (-entry[2], entry[1]),
+        )
+        return ranked[:n]
+
+    # 1-based position of the profile's best bid in top()'s order, None if it has not bid, O(log n).
+    # ZREVRANK orders equal prices by member, so within a run of ties the position is recounted by bid id
+    def rank(self, profile_id):
+        self.ensure_loaded()
+        pipe = self.redis.pipeline()
+        pipe.zscore(self.key, profile_id)
+        pipe.zrevrank(self.key, profile_id)
+        pipe.hget(self.bids_key, profile_id)
+        price, position, bid_id = pipe.execute()
+        if position is None:
+            return None
+
+        tied = self.redis.zrevrangebyscore(self.key, price, price)
+        if len(tied) == 1:
+            return position + 1
+        first_tied = position - tied.index(str(profile_id))
+        earlier = sum(1 for other_id in self.redis.hmget(self.bids_key, tied) if int(other_id) < int(bid_id))
+        return first_tied + earlier + 1
+
+    def highest_bid_id(self):
+        top = self.top(1)
+        return top[0][1] if top else None
+
+
+# writes 1st/2nd/3rd back onto Bid rows in one batch when the ranking has changed
+def write_ranked_statuses(item_id, previous_top, current_top):
+    previous_ids = [bid_id for _, bid_id, _ in previous_top]
+    current_ids = [bid_id for _, bid_id, _ in current_top]
+    if previous_ids == current_ids:
+        return
+
+    Bid.objects.filter(item_id=item_id, status__in=RANKED_STATUSES).exclude(
+        id__in=current_ids
+    ).update(status=NOT_HIGHEST_CHOICE)
+
+    ranked = [Bid(id=bid_id, status=status) for bid_id, status in zip(current_ids, RANKED_STATUSES)]
+    Bid.objects.bulk_update(ranked, ['status'])
@@ -0,0 +1,118 @@
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from decimal import Decimal
+import base64
+import json
+
+
+# keyset pagination for item browsing: each page continues from the (sort value, id) of the last row of
+# the previous one, so page 500 is an index range scan just like page 1 and rows added or removed
+# meanwhile don't shift what comes next. the id tiebreak keeps cursors stable across equal sort values
+class ItemKeysetPagination(BasePagination):
+    page_size = 24
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    orderings = ['-date_posted', 'date_posted', 'total_bids', '-total_bids', 'highest_bid', '-highest_bid']
+    default_ordering = '-date_posted'
+    rank_ordering = '-search_rank' # ItemSearchFilter's relevance order, when searching without ?ordering=
+
+    def get_ordering(self, request, queryset):
+        ordering = request.query_params.get(self.ordering_query_param)
+        if ordering in self.orderings:
+            return ordering
+        if 'search_rank' in queryset.query.annotations:
+            return self.rank_ordering
+        return self.default_ordering
+
+    # the columns a values() queryset must include for any of the orderings to be paged
+    def get_keyset_fields(self, queryset):
+        fields = ['id', *(ordering.lstrip('-') for ordering in self.orderings)]
+        if 'search_rank' in queryset.query.annotations:
+            fields.append('search_rank')
+        return list(dict.fromkeys(fields))
+
+    def get_page_size(self, request):
+        try:
+            return max(1, min(int(request.query_params[self.page_size_query_param]), self.max_page_size))
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def encode_cursor(self, ordering, value, pk):
+        if isinstance(value, Decimal):
+            value = str(value)
+        elif hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        payload = json.dumps({'o': ordering, 'v': value, 'id': pk}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, request, ordering, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if cursor['o'] != ordering:
+                raise ValueError("cursor belongs to a different ordering")
+            field = ordering.lstrip('-')
+            if field == 'search_rank':
+                value = float(cursor['v'])
+            else:
+                value = model._meta.get_field(field).to_python(cursor['v'])
+            return value, int(cursor['id'])
+        except (TypeError, ValueError, KeyError, json.JSONDecodeError):
+            raise NotFound("Invalid cursor")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(request, queryset)
+        self.field = self.ordering.lstrip('-')
+        descending = self.ordering.startswith('-')
+        direction = '-' if descending else ''
+
+        queryset = queryset.order_by(self.ordering, f'{direction}id')
+
+        cursor = self.decode_cursor(request, self.ordering, queryset.model)
+        if cursor is not None:
+            value, pk = cursor
+            after = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__{after}': value}) | Q(**{self.field: value, f'id__{after}': pk})
+            )
+
+        page_size = self.get_page_size(request)
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.page = rows[:page_size]
+        return self.page
+
+    # rows can be model instances or dicts from a values() queryset
+    def get_row_value(self, row, field):
+        return row[field] if isinstance(row, dict) else getattr(row, field)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        cursor = self.encode_cursor(self.ordering, self.get_row_value(last, self.field), self.get_row_value(last, 'id'))
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,27 @@
+# per-action queryset plans: the relations each endpoint's serializer walks are loaded up front, so a page
+# of results costs the same number of queries as a single row. a viewset declares
+#     queryset_plans = {'list': {'select_related': [...], 'prefetch_related': [...], 'only': [...]}}
+# keyed by action name. get_queryset() applies the current action's plan; actions that serialize some
+# other model's rows name it with 'model' and pass their queryset through self.plan_queryset()
+def apply_queryset_plan(queryset, plan):
+    if plan.get('select_related'):
+        queryset = queryset.select_related(*plan['select_related'])
+    if plan.get('prefetch_related'):
+        queryset = queryset.prefetch_related(*plan['prefetch_related'])
+    if plan.get('only'):
+        queryset = queryset.only(*plan['only'])
+    return queryset
+
+
+class QuerysetPlanMixin:
+    queryset_plans = {}
+
+    def plan_queryset(self, queryset):
+        plan = self.queryset_plans.get(self.action)
+        # a plan for another model's rows doesn't apply to the lookups the action makes on the way
+        if plan is None or plan.get('model', self.queryset.model) is not queryset.model:
+            return queryset
+        return apply_queryset_plan(queryset, plan)
+
+    def get_queryset(self):
+        return self.plan_queryset(super().get_queryset())
@@ -0,0 +1,90 @@
+from .models import Item, Bid
+from .choices import *
+from .utils import get_redis
+from collections import deque
+from django.db import transaction
+from django.db.models import Max
+from redis.exceptions import RedisError, WatchError
+import threading
+
+# capped feed of the items bid on most recently, newest first and each item at most once. kept as a
+# redis list; when redis is down the bid path and the reads fall back to a per-process copy
+RECENT_BIDS_KEY = 'recent-bids'
+RECENT_BIDS_CAPACITY = 50 # more than the page shows, so items that closed since can be skipped
+
+_local_feed = deque(maxlen=RECENT_BIDS_CAPACITY)
+_local_lock = threading.Lock()
+
+
+def _push_local(item_id):
+    with _local_lock:
+        if item_id in _local_feed:
+            _local_feed.remove(item_id)
+        _local_feed.appendleft(item_id)
+
+
+def record_recent_bid(item_id):
+    def push():
+        try:
+            pipe = get_redis().pipeline()
+            pipe.lrem(RECENT_BIDS_KEY, 0, item_id)
+            pipe.lpush(RECENT_BIDS_KEY, item_id)
+            pipe.ltrim(RECENT_BIDS_KEY, 0, RECENT_BIDS_CAPACITY - 1)
+            pipe.execute()
+        except RedisError as e:
+            print(f"Failed to record recent bid on item {item_id}: {str(e)}")
+            _push_local(item_id)
+
+    transaction.on_commit(push)
+
+
+# the most recent items first, as the bid table has them; only used to seed an empty feed
+def load_recent_bid_item_ids():
+    return list(
+        Bid.objects.values('item_id').annotate(
+            latest_bid_time=Max('time_of_bid')
+        ).order_by('-latest_bid_time').values_list('item_id', flat=True)[:RECENT_BIDS_CAPACITY]
+    )
+
+
+# seeds the feed only if it is still empty; a bid pushed meanwhile wins and the seed is dropped
+def seed_feed(redis, item_ids):
+    with redis.pipeline() as pipe:
+        try:
+            pipe.watch(RECENT_BIDS_KEY)
+            if pipe.exists(RECENT_BIDS_KEY):
+                return
+            pipe.multi()
+            pipe.rpush(RECENT_BIDS_KEY, *item_ids)
+            pipe.execute()
+        except WatchError:
+            pass
+
+
+def recent_item_ids():
+    try:
+        redis = get_redis()
+        item_ids = [int(item_id) for item_id in redis.lrange(RECENT_BIDS_KEY, 0, -1)]
+        if not item_ids:
+            item_ids = load_recent_bid_item_ids()
+            if item_ids:
+                seed_feed(redis, item_ids)
+        return item_ids
+    except RedisError as e:
+        print(f"Recent bids feed unavailable: {str(e)}")
+
+    with _local_lock:
+        if _local_feed:
+            return list(_local_feed)
+    item_ids = load_recent_bid_item_ids()
+    with _local_lock:
+        if not _local_feed:
+            _local_feed.extend(item_ids)
+        return list(_local_feed)
+
+
+# available items from the feed, in feed order
+def recent_bid_items(limit=10):
+    item_ids = recent_item_ids()
+    items = Item.objects.filter(pk__in=item_ids, availability=AVAILABLE_CHOICE).select_related('profile__account__user').in_bulk()
+    return [items[item_id] for item_id in item_ids if item_id in items][:limit]
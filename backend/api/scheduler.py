@@ -0,0 +1,53 @@
+from .models import Item
+from .choices import AVAILABLE_CHOICE
+from .utils import get_redis
+from django.db import transaction
+from redis.exceptions import RedisError
+
+# redis sorted set of item id -> deadline timestamp, drained by api.tasks.close_due_auctions
+AUCTION_DEADLINES_KEY = 'auction-deadlines'
+
+# how many items a single ZADD schedules when backfilling
+SCHEDULE_BATCH_SIZE = 1000
+
+
+# (re)schedules an item's auction to close at its deadline; moving a deadline just moves the score
+def schedule_auction_close(item):
+    item_id, deadline = item.pk, item.deadline.timestamp()
+
+    def schedule():
+        try:
+            get_redis().zadd(AUCTION_DEADLINES_KEY, {item_id: deadline})
+        except RedisError as e:
+            # the hourly sweep in check_auction_deadlines still closes the item
+            print(f"Failed to schedule auction close for item {item_id}: {str(e)}")
+
+    transaction.on_commit(schedule)
+
+
+# schedules every open auction; ZADD only moves scores, so re-running it is harmless. picks up items listed
+# before the schedule existed and any schedule_auction_close lost to a redis outage
+def schedule_open_auctions(batch_size=SCHEDULE_BATCH_SIZE):
+    redis_client = get_redis()
+    deadlines = Item.objects.filter(availability=AVAILABLE_CHOICE).values_list('id', 'deadline')
+
+    total, batch = 0, {}
+    for item_id, deadline in deadlines.iterator(chunk_size=batch_size):
+        batch[item_id] = deadline.timestamp()
+        if len(batch) == batch_size:
+            redis_client.zadd(AUCTION_DEADLINES_KEY, batch)
+            total, batch = total + len(batch), {}
+    if batch:
+        redis_client.zadd(AUCTION_DEADLINES_KEY, batch)
+        total += len(batch)
+    return total
+
+
+def due_auctions(now):
+    return [int(item_id) for item_id in get_redis().zrangebyscore(AUCTION_DEADLINES_KEY, '-inf', now.timestamp())]
+
+
+# drops auctions that no longer need closing; anything else stays scheduled for the next run
+def unschedule_auctions(item_ids):
+    if item_ids:
+        get_redis().zrem(AUCTION_DEADLINES_KEY, *item_ids)
@@ -7,9 +7,14 @@ from django.utils.encoding import force_bytes
 from django.core.mail import send_mail
 from django.urls import reverse
 from .utils import *
+from .explore import mark_snapshots_stale
+from .hot_score import bump_hot_score
+from .bidding import accept_bid, BidRejected
 from django.conf import settings
-from supabase import create_client
+from backend.supabase_clients import get_service_client, supabase_call, find_user_by_email, BACKEND_APP_METADATA
 from django.db import transaction
+from django.db.models import F
+from django.db.models.fields.json import KeyTransform
 
 from django.utils import timezone
 
@@ -93,62 +98,78 @@ class RegisterSerializer(serializers.Serializer):
     first_name = serializers.CharField()
     last_name = serializers.CharField()
 
+    def validate_email(self, value):
+        # supabase auth is keyed by email, so it has to be unique on our side too
+        if User.objects.filter(email__iexact=value).exists():
+            raise serializers.ValidationError("Username or email already in use")
+        return value
+
     def create(self, validated_data):
-        supabase_user = None
-        try:
-            # First create Supabase user
-            supabase = create_client(
-                settings.SUPABASE_URL,
-                settings.SUPABASE_SERVICE_ROLE_KEY,
+        # Django rows first, all or nothing
+        with transaction.atomic():
+            user = User.objects.create_user(
+                username=validated_data["username"],
+                email=validated_data["email"],
+                password=validated_data["password"],  # create_user handles password hashing
+                first_name=validated_data["first_name"],
+                last_name=validated_data["last_name"]
+            )
+            account = Account.objects.create(user=user)
+            display_name = f"{validated_data['first_name']} {validated_data['last_name']}"
+            profile = Profile.objects.create(
+                account=account,
+                display_name=display_name,
+                description=""
             )
 
-            print("Creating Supabase user...")
-            supabase_response = supabase.auth.admin.create_user({
-                'email': validated_data['email'],
-                'password': validated_data['password'],
-                'email_confirm': True
-            })
-            # Convert generator to user data
-            supabase_user = next(iter(supabase_response))
-            print(f"Supabase user created: {supabase_user}")
-
-            # Use transaction to ensure all Django models are created or none
-            with transaction.atomic():
-                print("Creating Django user...")
-                user = User.objects.create_user(
-                    username=validated_data["username"],
-                    email=validated_data["email"],
-                    password=validated_data["password"],  # create_user handles password hashing
-                    first_name=validated_data["first_name"],
-                    last_name=validated_data["last_name"]
-                )
-                print(f"Django user created: {user}")
-
-                print("Creating Account and Profile...")
-                account = Account.objects.create(user=user)
-                
-                display_name = f"{validated_data['first_name']} {validated_data['last_name']}"
-                profile = Profile.objects.create(
-                    account=account,
-                    display_name=display_name,
-                    description=""
-                )
-                print("Account and Profile created")
-
-                return user
-
+        try:
+            provision_supabase_user(account, validated_data['password'])
         except Exception as e:
-            print(f"Error occurred: {str(e)}")
-            if supabase_user:
-                try:
-                    print("Attempting to delete Supabase user...")
-                    supabase.auth.admin.delete_user(supabase_user.user.id)  # Access the ID correctly
-                    print("Supabase user deleted")
-                except Exception as cleanup_error:
-                    print(f"Failed to delete Supabase user: {str(cleanup_error)}")
+            print(f"Supabase provisioning failed for {user.email}: {str(e)}")
+            with transaction.atomic():
+                profile.delete()
+                account.delete()
+                user.delete()
             raise serializers.ValidationError(f"Failed to create user: {str(e)}")
 
-    
+        return user
+
+
+# creates the Supabase auth user for an account and records its id. an auth user that already has the
+# email is only adopted if this backend made it (a registration that died after the remote create) and no
+# other account is linked to it; it then gets the password just chosen. anything else fails the registration
+def provision_supabase_user(account, password):
+    if account.supabase_user_id is not None:
+        return
+
+    email = account.user.email
+    try:
+        with supabase_call('auth.admin.create_user'):
+            response = get_service_client().auth.admin.create_user({
+                'email': email,
+                'password': password,
+                'email_confirm': True,
+                'app_metadata': BACKEND_APP_METADATA,
+            })
+        supabase_user_id = response.user.id
+    except Exception as e:
+        if 'already' not in str(e).lower():
+            raise
+        existing = find_user_by_email(email)
+        if existing is None:
+            raise
+        metadata = getattr(existing, 'app_metadata', None) or {}
+        linked = Account.objects.filter(supabase_user_id=existing.id).exclude(pk=account.pk).exists()
+        if linked or any(metadata.get(key) != value for key, value in BACKEND_APP_METADATA.items()):
+            raise Exception(f"{email} is already registered to another sign-in")
+
+        print(f"Adopting existing Supabase user for {email}")
+        with supabase_call('auth.admin.update_user_by_id'):
+            get_service_client().auth.admin.update_user_by_id(str(existing.id), {'password': password})
+        supabase_user_id = existing.id
+
+    account.supabase_user_id = supabase_user_id
+    Account.objects.filter(pk=account.pk).update(supabase_user_id=supabase_user_id)
 
 class AccountSerializer(serializers.ModelSerializer):
     # the following fields are not in the Account model, but in the User model
@@ -260,19 +281,66 @@ class RatingSerializer(serializers.ModelSerializer):
         return Rating.objects.create(**validated_data)
     
 
-class ItemSerializer(serializers.ModelSerializer):
+# ?fields=id,title,thumbnail trims a read down to the listed fields; unknown names are ignored
+class DynamicFieldsMixin:
+    fields_query_param = 'fields'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET' or not request.query_params.get(self.fields_query_param):
+            return
+        wanted = {name.strip() for name in request.query_params[self.fields_query_param].split(',')}
+        for name in set(self.fields) - wanted:
+            self.fields.pop(name)
+
+
+class ItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     username = serializers.CharField(required=False, source="profile.account.user.username")
-    display_icon = serializers.ImageField(required=False, source="profile.display_icon")
+    display_icon = serializers.CharField(required=False, source="profile.display_icon") # a url, not an uploaded image
     image_urls = serializers.ListField(write_only=True, required=False)
+    thumbnail = serializers.SerializerMethodField()
+
+    # the values() column behind each read field that isn't a plain Item column, for list endpoints that
+    # read rows instead of building Item instances (see to_row_representation)
+    row_columns = {
+        'username': F('profile__account__user__username'),
+        'display_icon': F('profile__display_icon'),
+        'thumbnail': KeyTransform('0', 'image_urls'),
+    }
 
     class Meta:
         model = Item
-        fields = ['id', 'title', 'username', 'display_icon', 'description', 'deadline', 'collection', 'image_urls', 'selling_price', 'profile', 'maximum_bid', 'minimum_bid']
+        fields = ['id', 'title', 'username', 'display_icon', 'thumbnail', 'description', 'deadline', 'collection', 'image_urls', 'selling_price', 'profile', 'maximum_bid', 'minimum_bid']
         extra_kwargs = {
             "username": {"read_only": True},
             "display_icon": {"read_only": True}
         }
 
+    def get_thumbnail(self, item):
+        return item.image_urls[0] if item.image_urls else None
+
+    # a values() queryset with exactly the columns the (possibly trimmed) read fields need, joining
+    # profile/account/user only when username or display_icon was asked for. extra adds columns the
+    # caller needs itself, like the paginator's sort keys
+    def row_queryset(self, queryset, extra=()):
+        names = [field.field_name for field in self._readable_fields]
+        columns = {name: self.row_columns[name] for name in names if name in self.row_columns}
+        plain = dict.fromkeys([*(name for name in names if name not in columns), *extra])
+        return queryset.values(*plain, **columns)
+
+    # same output as to_representation, from row_queryset rows
+    def rows_to_representation(self, rows):
+        fields = [
+            # row_columns and foreign keys (which come back as their ids) are already the final value
+            (field.field_name, None if field.field_name in self.row_columns or isinstance(field, serializers.RelatedField) else field)
+            for field in self._readable_fields
+        ]
+        return [
+            {name: row[name] if field is None or row[name] is None else field.to_representation(row[name]) for name, field in fields}
+            for row in rows
+        ]
+
     def create(self, validated_data):
         # Remove extra fields before creating the item
         validated_data.pop('username', None)
@@ -298,9 +366,18 @@ class ItemSerializer(serializers.ModelSerializer):
             gcs_urls.append(url)
         
         item.image_urls = gcs_urls
-        item.save()
+        item.save(update_fields=['image_urls'])
 
         return item
+
+    # writes only the edited columns: highest_bid, total_bids and hot_score move under concurrent bids
+    # (api.bidding, api.hot_score), so a full save would put back the copies loaded with the instance
+    def update(self, instance, validated_data):
+        serializers.raise_errors_on_nested_writes('update', self, validated_data)
+        for name, value in validated_data.items():
+            setattr(instance, name, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
     
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -337,10 +414,12 @@ class CommentSerializer(serializers.ModelSerializer):
         validated_data['parent'] = parent
 
         comment = Comment.objects.create(**validated_data)
+        bump_hot_score(item.pk, 'comment')
+        mark_snapshots_stale('comment')
 
         item_user = item.profile.account.user
         text = validated_data['text']
-        item_user.email_user("New Comment for You", f"{user.username} commented: {text}", from_email=settings.EMAIL_HOST_USER)
+        EmailNotifications.notify_new_comment(item_user, user, text)
 
         return comment
     
@@ -382,6 +461,8 @@ class SaveSerializer(serializers.ModelSerializer):
         validated_data['profile'] = profile
 
         save = Save.objects.create(**validated_data)
+        bump_hot_score(item.pk, 'save')
+        mark_snapshots_stale('save')
 
         return save
 
@@ -421,7 +502,7 @@ class LikeSerializer(serializers.ModelSerializer):
         like = Like.objects.create(profile=profile, comment=comment)
 
         comment_user = comment.profile.account.user
-        comment_user.email_user('New Like on Your Comment', f'{user.username} has liked your comment: {comment.text}')
+        EmailNotifications.notify_comment_liked(comment_user, user, comment)
 
         return like
     
@@ -452,16 +533,12 @@ class BidSerializer(serializers.ModelSerializer):
         profile = user.account.profile
 
         bid_price = validated_data['bid_price']
-        status = NOT_HIGHEST_CHOICE
-        validated_data['status'] = status
-
-        bid = Bid.objects.create(
-            profile=profile,
-            item=item,
-            bid_price=bid_price,
-            time_of_bid=timezone.now(),
-            status=status
-        )
+
+        # go through the bid engine so highest_bid/total_bids stay consistent under concurrency
+        try:
+            bid, outbid = accept_bid(item, profile, bid_price)
+        except BidRejected as e:
+            raise serializers.ValidationError({"bid_price": str(e)})
 
         return bid
     
@@ -1,63 +1,291 @@
 from celery import shared_task
 from django.utils import timezone
 from datetime import timedelta
-from .models import Item, Report, Transaction
+from .models import Item, Report, Transaction, Bid, Profile, Account, SentNotification, OutboxEmail, PendingNotification
 from .choices import *
-from .utils import EmailNotifications
+from .utils import EmailNotifications, queue_email
 from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+import time
 from django.db.models import Q
+from django.db import connection, transaction
+from redis.exceptions import RedisError
+from .scheduler import due_auctions, unschedule_auctions, schedule_open_auctions
+from .events import publish_item_update
+from .explore import refresh_snapshots, mark_snapshots_stale
+from . import collection_stats
 
-@shared_task
-def check_auction_deadlines():
-    
-    # perform proper actions for items sold
-    items_ended = Item.objects.filter(
-        deadline__lte=timezone.now(),
-        availability=AVAILABLE_CHOICE,
-    )
 
-    for item in items_ended:
-        item.availability = EXPIRED_CHOICE
-        item.save()
+# how many auctions a single UPDATE ... RETURNING closes
+EXPIRY_BATCH_SIZE = 1000
+
+
+# flips ended auctions to expired in set-based batches and hands the closed ids to the notification
+# fan-out; the conditional WHERE makes it safe to run twice on the same items. returns the closed ids;
+# rows locked by an in-flight bid are skipped and left for the next run
+def expire_ended_auctions(item_ids=None, batch_size=EXPIRY_BATCH_SIZE):
+    table = Item._meta.db_table
+    id_filter = "AND id = ANY(%s)" if item_ids is not None else ""
+    sql = f"""
+        UPDATE {table} SET availability = %s
+        WHERE id IN (
+            SELECT id FROM {table}
+            WHERE availability = %s AND deadline <= %s {id_filter}
+            ORDER BY deadline
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, collection_id, highest_bid
+    """
+
+    now = timezone.now()
+    closed = []
+    while True:
+        params = [EXPIRED_CHOICE, AVAILABLE_CHOICE, now]
+        if item_ids is not None:
+            params.append(list(item_ids))
+        params.append(batch_size)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            closed_ids = [row[0] for row in rows]
+            collection_stats.record_items_closed((collection_id, highest_bid) for item_id, collection_id, highest_bid in rows)
+
+        if closed_ids:
+            transaction.on_commit(lambda ids=closed_ids: notify_auctions_ended.delay(ids))
+            mark_snapshots_stale('item')
+            closed.extend(closed_ids)
+        if len(closed_ids) < batch_size:
+            return closed
+
 
+# notification stage for a batch of closed auctions: one joined query for the sellers
+@shared_task
+def notify_auctions_ended(item_ids):
+    items = Item.objects.filter(pk__in=item_ids).select_related('profile__account__user')
+    for item in items:
+        publish_item_update(item)
         EmailNotifications.notify_deadline_to_seller(
             item.profile.account.user,
             item,
         )
+
+
+# closes each auction within seconds of its deadline; driven by the redis deadline schedule
+@shared_task
+def close_due_auctions():
+    now = timezone.now()
+    item_ids = due_auctions(now)
+    if not item_ids:
+        return
+
+    closed_ids = expire_ended_auctions(item_ids)
+    # an auction a bid had locked at its deadline was skipped and stays scheduled; only ids that were closed
+    # here or are no longer open (sold, expired by the sweep, deleted) come off the schedule
+    still_open = set(Item.objects.filter(pk__in=item_ids, availability=AVAILABLE_CHOICE).values_list('id', flat=True))
+    unschedule_auctions(set(closed_ids) | {item_id for item_id in item_ids if item_id not in still_open})
+
+
+@shared_task
+def check_auction_deadlines():
     
+    # safety net for auctions the deadline schedule missed
+    expire_ended_auctions()
+
+    # and puts any open auction it is missing back on it
+    try:
+        schedule_open_auctions()
+    except RedisError as e:
+        print(f"Failed to reconcile the auction close schedule: {str(e)}")
+
     # item has arrived
     transactions_items_arrived = Transaction.objects.filter(estimated_delivery__lte=timezone.now, status=SHIPPED_CHOICE)
-    for transaction in transactions_items_arrived:
-        buyer_user = transaction.buyer.user
-        item = transaction.bid.item
+    for shipped in transactions_items_arrived:
+        buyer_user = shipped.buyer.user
+        item = shipped.bid.item
 
         EmailNotifications.notify_item_arrived(
             buyer_user, 
             item,
         )
-    
-     # send relevant emails for items sold in 24h
-    items_ending_in_24h = Item.objects.filter(
-        deadline__lte=timezone.now() + timedelta(days=1),
-        deadline__gt=timezone.now(),
-        availability = AVAILABLE_CHOICE
+
+    # send relevant emails for items sold in 24h, once per user and item
+    send_deadline_reminders()
+
+
+# claims every unsent 24h reminder in one statement: candidates (sellers plus distinct bidders of items
+# ending within a day) are inserted into the ledger, and the unique constraint drops the ones already sent
+REMINDER_CLAIM_SQL = """
+    INSERT INTO {ledger} (user_id, item_id, kind, sent_at)
+    SELECT candidates.user_id, candidates.item_id, candidates.kind, %(now)s
+    FROM (
+        SELECT account.user_id, item.id AS item_id, %(seller_kind)s AS kind
+        FROM {item} item
+        JOIN {profile} profile ON profile.id = item.profile_id
+        JOIN {account} account ON account.id = profile.account_id
+        WHERE item.availability = %(available)s AND item.deadline > %(now)s AND item.deadline <= %(until)s
+        UNION
+        SELECT account.user_id, item.id AS item_id, %(bidder_kind)s AS kind
+        FROM {bid} bid
+        JOIN {item} item ON item.id = bid.item_id
+        JOIN {profile} profile ON profile.id = bid.profile_id
+        JOIN {account} account ON account.id = profile.account_id
+        WHERE item.availability = %(available)s AND item.deadline > %(now)s AND item.deadline <= %(until)s
+    ) candidates
+    ON CONFLICT (user_id, item_id, kind) DO NOTHING
+    RETURNING user_id, item_id, kind
+"""
+
+
+def send_deadline_reminders():
+    now = timezone.now()
+    sql = REMINDER_CLAIM_SQL.format(
+        ledger=SentNotification._meta.db_table,
+        item=Item._meta.db_table,
+        profile=Profile._meta.db_table,
+        account=Account._meta.db_table,
+        bid=Bid._meta.db_table,
     )
+    params = {
+        'now': now,
+        'until': now + timedelta(days=1),
+        'available': AVAILABLE_CHOICE,
+        'seller_kind': NOTIFY_DEADLINE_24H_SELLER,
+        'bidder_kind': NOTIFY_DEADLINE_24H_BIDDER,
+    }
 
-    for item in items_ending_in_24h:
-        EmailNotifications.notify_deadline_24h(
-            item.profile.account.user,
-            item,
-            is_seller=True
-        )
+    # if dispatching fails the claims roll back and the next run retries them
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            claimed = cursor.fetchall()
 
-        bidders = User.objects.filter(account__profile__bid__item=item).distinct()
-        for bidder in bidders:
+        users = User.objects.in_bulk({user_id for user_id, _, _ in claimed})
+        items = Item.objects.in_bulk({item_id for _, item_id, _ in claimed})
+        for user_id, item_id, kind in claimed:
             EmailNotifications.notify_deadline_24h(
-                bidder,
-                item,
-                is_seller=False
+                users[user_id],
+                items[item_id],
+                is_seller=(kind == NOTIFY_DEADLINE_24H_SELLER),
             )
 
 
+# backs off a failed email exponentially, or gives up on it after EMAIL_OUTBOX_MAX_ATTEMPTS
+def retry_email_later(email, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OUTBOX_FAILED_CHOICE
+    else:
+        email.status = OUTBOX_PENDING_CHOICE
+        backoff = settings.EMAIL_OUTBOX_RETRY_BACKOFF * 2 ** (email.attempts - 1)
+        email.next_attempt_at = timezone.now() + timedelta(seconds=backoff)
+
+
+# sends due outbox emails over a single reused SMTP connection, paced to EMAIL_OUTBOX_RATE_LIMIT.
+# failures are retried with exponential backoff until EMAIL_OUTBOX_MAX_ATTEMPTS
+@shared_task
+def flush_email_outbox():
+    interval = 1.0 / settings.EMAIL_OUTBOX_RATE_LIMIT
+    now = timezone.now()
+
+    # claim the batch and commit before talking to SMTP, so no row lock or transaction is held while sending.
+    # a claim is a lease: if the worker dies mid-batch its emails come due again after EMAIL_OUTBOX_CLAIM_TIMEOUT
+    with transaction.atomic():
+        # skip_locked lets several workers claim from the outbox at once without sharing rows
+        emails = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True).filter(
+                status__in=[OUTBOX_PENDING_CHOICE, OUTBOX_SENDING_CHOICE],
+                next_attempt_at__lte=now,
+            ).order_by('next_attempt_at')[:settings.EMAIL_OUTBOX_BATCH_SIZE]
+        )
+        if not emails:
+            return 0
+        OutboxEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            status=OUTBOX_SENDING_CHOICE,
+            next_attempt_at=now + timedelta(seconds=settings.EMAIL_OUTBOX_CLAIM_TIMEOUT),
+        )
+
+    sent = 0
+    smtp = get_connection()
+    try:
+        smtp.open()
+    except Exception as e:
+        # could not connect at all; the whole batch counts as a failed attempt
+        print(f"Email outbox connection error: {str(e)}")
+        for email in emails:
+            retry_email_later(email, e)
+        OutboxEmail.objects.bulk_update(emails, ['status', 'attempts', 'last_error', 'next_attempt_at'])
+        return 0
+
+    try:
+        for email in emails:
+            started = time.monotonic()
+            try:
+                EmailMessage(
+                    subject=email.subject,
+                    body=email.body,
+                    from_email=email.from_email,
+                    to=[email.to_email],
+                    connection=smtp,
+                ).send()
+                email.status = OUTBOX_SENT_CHOICE
+                email.sent_at = timezone.now()
+                sent += 1
+            except Exception as e:
+                retry_email_later(email, e)
+            # recorded one by one, so a crash mid-batch only re-sends the email that was in flight
+            email.save(update_fields=['status', 'sent_at', 'attempts', 'last_error', 'next_attempt_at'])
+
+            elapsed = time.monotonic() - started
+            if elapsed < interval:
+                time.sleep(interval - elapsed)
+    finally:
+        smtp.close()
+
+    return sent
+
 
-        
\ No newline at end of file
+# turns each user's buffered notifications into one digest email once the oldest is NOTIFICATION_DIGEST_WINDOW old
+@shared_task
+def flush_notification_digests():
+    cutoff = timezone.now() - timedelta(seconds=settings.NOTIFICATION_DIGEST_WINDOW)
+    user_ids = PendingNotification.objects.filter(created_at__lte=cutoff).values('user_id').distinct()
+
+    with transaction.atomic():
+        pending = list(
+            PendingNotification.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+                user_id__in=user_ids
+            ).select_related('user').order_by('user_id', 'created_at')
+        )
+
+        by_user = {}
+        for notification in pending:
+            by_user.setdefault(notification.user_id, []).append(notification)
+
+        for notifications in by_user.values():
+            user = notifications[0].user
+            if len(notifications) == 1:
+                subject, message = notifications[0].subject, notifications[0].message
+            else:
+                subject = f"You have {len(notifications)} new updates on BluePenguin"
+                message = "\n\n".join(notification.message for notification in notifications)
+            queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
+
+        PendingNotification.objects.filter(id__in=[notification.id for notification in pending]).delete()
+
+    return len(by_user)
+
+
+# rebuilds explore snapshots that are due or were marked stale by a bid/save/item/rating event
+@shared_task
+def refresh_explore_snapshots(force=False):
+    return refresh_snapshots(force)
+
+
+# rebuilds CollectionStats from the items and bids, fixing any drift in the incremental counts
+@shared_task
+def reconcile_collection_stats():
+    return collection_stats.reconcile_collection_stats()
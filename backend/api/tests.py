@@ -1,3 +1,1248 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from datetime import timedelta
+from decimal import Decimal
+import asyncio
+import json
+import os
+import random
+import redis
+import tempfile
+import threading
+import uuid
+from redis.exceptions import RedisError
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from .models import *
+from .choices import *
+from .bidding import accept_bid, BidRejected
+from .orderbook import BidOrderBook
+from .serializers import ItemSerializer, RegisterSerializer
+from .views import ItemViewSet
+from . import explore
+from .filters import ItemFilter
+from .hot_score import bump_hot_score, hot_items, rebuild_hot_scores
+from . import recent_bids, utils
+from .events import item_event_payload, publish_item_update
+from .scheduler import AUCTION_DEADLINES_KEY, schedule_auction_close, schedule_open_auctions
+from .collection_stats import close_item, record_item_listed, reconcile_collection_stats
+from .utils import EmailNotifications
+from .tasks import flush_email_outbox, flush_notification_digests, close_due_auctions, send_deadline_reminders, expire_ended_auctions
+from backend import supabase_clients
+from backend import middleware
+from backend.identity import identity_cache
+from jwt.exceptions import InvalidTokenError
+from cryptography.hazmat.primitives.asymmetric import rsa
+import jwt
+import time
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.exceptions import AuthenticationFailed
+
+
+def create_profile(username, balance=Decimal('9000.00')):
+    user = User.objects.create_user(username=username, email=f"{username}@example.com", password="password")
+    account = Account.objects.create(user=user, status=STATUS_USER, balance=balance)
+    return Profile.objects.create(account=account, display_name=username)
+
+
+def create_item(profile, title="Item", **kwargs):
+    kwargs.setdefault('deadline', timezone.now() + timedelta(days=2))
+    kwargs.setdefault('selling_price', Decimal('10.00'))
+    kwargs.setdefault('description', "")
+    return Item.objects.create(title=title, profile=profile, **kwargs)
+
+
+# redis-backed tests get a database of their own, emptied before each test
+REDIS_TEST_URL = os.getenv('REDIS_TEST_URL', 'redis://localhost:6379/15')
+
+
+class RedisTestMixin:
+    def setUp(self):
+        super().setUp()
+        self.redis = redis.Redis.from_url(REDIS_TEST_URL, decode_responses=True)
+        try:
+            self.redis.flushdb()
+        except RedisError:
+            self.skipTest("needs a redis server at REDIS_TEST_URL")
+        patcher = mock.patch.object(utils, '_redis_client', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "needs row-level locking")
+class ConcurrentBidTests(RedisTestMixin, TransactionTestCase):
+    BIDS = 300
+    WORKERS = 32
+
+    def setUp(self):
+        super().setUp()
+        self.seller = create_profile("seller")
+        self.bidders = [create_profile(f"bidder{i}") for i in range(10)]
+        self.item = create_item(self.seller)
+
+    def place(self, price):
+        try:
+            bid, _ = accept_bid(Item.objects.get(pk=self.item.pk), random.choice(self.bidders), price)
+            return bid.bid_price
+        except BidRejected:
+            return None
+        finally:
+            connection.close()
+
+    def test_parallel_bids_leave_one_highest(self):
+        prices = [Decimal(random.randint(1, 5000)) for _ in range(self.BIDS)]
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+            accepted = [price for price in pool.map(self.place, prices) if price is not None]
+
+        self.item.refresh_from_db()
+        bids = Bid.objects.filter(item=self.item)
+
+        self.assertEqual(self.item.highest_bid, max(prices))
+        self.assertEqual(self.item.total_bids, len(accepted))
+        self.assertEqual(bids.count(), len(accepted))
+        self.assertEqual(bids.filter(bid_price=self.item.highest_bid).count(), 1)
+
+        # every accepted bid strictly beat the one before it
+        ordered = list(bids.order_by('time_of_bid', 'id').values_list('bid_price', flat=True))
+        self.assertEqual(ordered, sorted(set(ordered)))
+
+    def test_bid_rejected_after_deadline(self):
+        Item.objects.filter(pk=self.item.pk).update(deadline=timezone.now() - timedelta(minutes=1))
+        with self.assertRaises(BidRejected):
+            accept_bid(self.item, self.bidders[0], Decimal('50.00'))
+
+
+class BidOrderBookTests(RedisTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.seller = create_profile("seller")
+        self.bidders = [create_profile(f"bidder{n}") for n in range(3)]
+        self.item = create_item(self.seller)
+
+    def place(self, bidder, price, seconds_ago=0):
+        return Bid.objects.create(
+            profile=bidder,
+            item=self.item,
+            bid_price=price,
+            time_of_bid=timezone.now() - timedelta(seconds=seconds_ago),
+            status=NOT_HIGHEST_CHOICE,
+        )
+
+    def test_accepted_bids_are_ranked(self):
+        first, previous = accept_bid(self.item, self.bidders[0], Decimal('20.00'))
+        self.assertIsNone(previous)
+        second, previous = accept_bid(self.item, self.bidders[1], Decimal('30.00'))
+        self.assertEqual(previous, first)
+
+        self.assertEqual([bid_id for _, bid_id, _ in BidOrderBook(self.item).top(3)], [second.id, first.id])
+        statuses = dict(Bid.objects.values_list('id', 'status'))
+        self.assertEqual((statuses[second.id], statuses[first.id]), (HIGHEST_CHOICE, SECOND_HIGHEST_CHOICE))
+
+    def test_claim_transaction_holds_only_the_claim_and_the_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            accept_bid(self.item, self.bidders[0], Decimal('20.00'))
+
+        statements = [query['sql'] for query in queries.captured_queries]
+        released = next(i for i, sql in enumerate(statements) if sql.startswith('RELEASE SAVEPOINT'))
+        self.assertTrue(statements[0].startswith('SAVEPOINT'))
+        claim, insert = statements[1:released]
+        self.assertIn('RETURNING previous.highest_bid', claim)
+        self.assertTrue(insert.startswith(f'INSERT INTO "{Bid._meta.db_table}"'))
+
+    def test_rejected_bids_leave_the_book_alone(self):
+        accept_bid(self.item, self.bidders[0], Decimal('20.00'))
+        with self.assertRaisesMessage(BidRejected, "higher"):
+            accept_bid(self.item, self.bidders[1], Decimal('20.00'))
+
+        Item.objects.filter(pk=self.item.pk).update(deadline=timezone.now() - timedelta(minutes=1))
+        with self.assertRaisesMessage(BidRejected, "ended"):
+            accept_bid(self.item, self.bidders[1], Decimal('30.00'))
+
+        self.assertEqual([profile_id for profile_id, _, _ in BidOrderBook(self.item).top(3)], [self.bidders[0].id])
+        self.assertEqual(Bid.objects.count(), 1)
+
+    def test_cold_start_keeps_each_profiles_best_bid(self):
+        self.place(self.bidders[0], 20)
+        best = self.place(self.bidders[0], 40)
+        other = self.place(self.bidders[1], 30)
+
+        self.assertEqual(BidOrderBook(self.item).top(3), [
+            (self.bidders[0].id, best.id, 40.0),
+            (self.bidders[1].id, other.id, 30.0),
+        ])
+
+    def test_equal_bids_rank_the_earliest_first(self):
+        # a profile's earliest bid at its best price is the one kept
+        kept = self.place(self.bidders[0], 30, seconds_ago=30)
+        self.place(self.bidders[0], 30, seconds_ago=10)
+        # and across profiles the earliest bid wins, although redis orders the tied members the other way
+        middle = self.place(self.bidders[1], 30, seconds_ago=20)
+        latest = self.place(self.bidders[2], 30)
+
+        self.assertEqual([bid_id for _, bid_id, _ in BidOrderBook(self.item).top(1)], [kept.id])
+        self.assertEqual([bid_id for _, bid_id, _ in BidOrderBook(self.item).top(3)], [kept.id, middle.id, latest.id])
+
+    def test_rank_matches_top(self):
+        self.place(self.bidders[0], 30, seconds_ago=30)
+        self.place(self.bidders[1], 40, seconds_ago=20)
+        self.place(self.bidders[2], 30, seconds_ago=10)
+        book = BidOrderBook(self.item)
+
+        ranks = {profile_id: book.rank(profile_id) for profile_id, _, _ in book.top(3)}
+        self.assertEqual(ranks, {self.bidders[1].id: 1, self.bidders[0].id: 2, self.bidders[2].id: 3})
+        self.assertEqual([profile_id for profile_id, _, _ in book.top(3)], [self.bidders[1].id, self.bidders[0].id, self.bidders[2].id])
+        self.assertIsNone(book.rank(self.seller.id))
+
+    def test_stale_book_is_rebuilt(self):
+        first, _ = accept_bid(self.item, self.bidders[0], Decimal('20.00'))
+        # e.g. left behind by a restored database
+        self.redis.zadd(f"orderbook:item:{self.item.pk}", {self.bidders[1].id: 99.0})
+        self.redis.hset(f"orderbook:item:{self.item.pk}:bids", self.bidders[1].id, 999999)
+
+        second, previous = accept_bid(self.item, self.bidders[1], Decimal('30.00'))
+        self.assertEqual(previous, first)
+        self.assertEqual([bid_id for _, bid_id, _ in BidOrderBook(self.item).top(3)], [second.id, first.id])
+
+
+@override_settings(REDIS_URL=REDIS_TEST_URL)
+class ItemEventsTests(RedisTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.item = create_item(create_profile("seller"))
+
+    def publish(self, highest_bid):
+        with self.captureOnCommitCallbacks(execute=True):
+            Item.objects.filter(pk=self.item.pk).update(highest_bid=highest_bid, total_bids=1)
+            self.item.refresh_from_db()
+            publish_item_update(self.item)
+
+    async def test_stream_sends_the_current_state_then_published_updates(self):
+        response = await self.async_client.get(f'/api/items/{self.item.pk}/events/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+
+        def frame():
+            return f"event: item\ndata: {json.dumps(item_event_payload(self.item))}\n\n".encode()
+
+        self.assertEqual(await asyncio.wait_for(anext(stream), 5), frame())
+
+        await sync_to_async(self.publish)(Decimal('25.00'))
+        update = await asyncio.wait_for(anext(stream), 5)
+        # the subscribe confirmation surfaces as a keep-alive
+        while update == b": keep-alive\n\n":
+            update = await asyncio.wait_for(anext(stream), 5)
+        self.assertEqual(update, frame())
+        self.assertEqual(item_event_payload(self.item)['highest_bid'], 25.0)
+        await stream.aclose()
+
+    async def test_unknown_item_is_not_found(self):
+        response = await self.async_client.get('/api/items/999999/events/')
+        self.assertEqual(response.status_code, 404)
+
+
+class PlaceBidTests(RedisTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.item = create_item(create_profile("seller"), title="Lamp")
+        self.first, self.second = create_profile("first"), create_profile("second")
+
+    def bid(self, profile, price):
+        client = APIClient()
+        client.force_authenticate(profile.account.user)
+        return client.post('/api/items/Lamp/perform-bid/', {'bid_price': price})
+
+    def test_bid_and_outbid(self):
+        response = self.bid(self.first, '20.00')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['status'], HIGHEST_CHOICE)
+
+        response = self.bid(self.second, '30.00')
+        self.assertEqual(response.status_code, 201, response.data)
+
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.highest_bid, self.item.total_bids), (Decimal('30.00'), 2))
+        statuses = dict(Bid.objects.values_list('profile__account__user__username', 'status'))
+        self.assertEqual(statuses, {"first": SECOND_HIGHEST_CHOICE, "second": HIGHEST_CHOICE})
+        # the outbid bidder hears about it
+        self.assertTrue(PendingNotification.objects.filter(user=self.first.account.user, coalesce_key=f"outbid:{self.item.pk}").exists())
+
+    def test_bid_below_the_highest_is_rejected(self):
+        self.bid(self.first, '20.00')
+        response = self.bid(self.second, '15.00')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Bid.objects.count(), 1)
+
+
+class ItemWriteTests(RedisTestMixin, TestCase):
+    def test_deadline_change_keeps_bids_accepted_meanwhile(self):
+        seller = create_profile("seller")
+        item = create_item(seller, title="Lamp")
+        stale = Item.objects.get(pk=item.pk) # what the view loaded before the bid landed
+        accept_bid(item, create_profile("bidder"), Decimal('50.00'))
+
+        new_deadline = (timezone.now() + timedelta(days=5)).replace(microsecond=0)
+        with mock.patch.object(ItemViewSet, 'get_object', return_value=stale), \
+                mock.patch('api.views.publish_item_update') as publish:
+            response = APIClient().post('/api/items/Lamp/change-deadline/', {'deadline': new_deadline.strftime("%Y-%m-%d %H:%M:%S")})
+        self.assertEqual(response.status_code, 200)
+        # the live update carries the bid that landed meanwhile, not the stale copy's numbers
+        published = item_event_payload(publish.call_args.args[0])
+        self.assertEqual((published['highest_bid'], published['total_bids']), (50.0, 1))
+
+        item.refresh_from_db()
+        self.assertEqual((item.highest_bid, item.total_bids), (Decimal('50.00'), 1))
+        self.assertEqual(item.deadline, timezone.make_aware(new_deadline.replace(tzinfo=None)))
+
+    def test_item_edit_keeps_bids_and_hot_score_written_meanwhile(self):
+        item = create_item(create_profile("seller"), title="Lamp")
+        stale = Item.objects.get(pk=item.pk)
+        accept_bid(item, create_profile("bidder"), Decimal('50.00'))
+        item.refresh_from_db()
+
+        serializer = ItemSerializer(stale, data={'description': "Brass, working"}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+
+        edited = Item.objects.get(pk=item.pk)
+        self.assertEqual(edited.description, "Brass, working")
+        self.assertEqual((edited.highest_bid, edited.total_bids, edited.hot_score), (item.highest_bid, 1, item.hot_score))
+        self.assertIsNotNone(edited.hot_score)
+
+
+# a sale that loses the race to close the item must not charge anyone
+class ItemSaleTests(TestCase):
+    def setUp(self):
+        self.seller = create_profile("seller")
+        self.buyer = create_profile("buyer")
+        self.item = create_item(self.seller, title="Lamp", availability=SOLD_CHOICE)
+        self.bid = Bid.objects.create(
+            profile=self.buyer, item=self.item, bid_price=Decimal('50.00'), time_of_bid=timezone.now(),
+            status=HIGHEST_CHOICE, winner_status=WINNING_PENDING_CHOICE,
+        )
+
+    def post(self, profile, url):
+        client = APIClient()
+        client.force_authenticate(profile.account.user)
+        return client.post(url, {'id': self.bid.pk})
+
+    def assertNotCharged(self):
+        self.assertFalse(Transaction.objects.exists())
+        balances = dict(Account.objects.values_list('user__username', 'balance'))
+        self.assertEqual(balances, {"seller": self.seller.account.balance, "buyer": self.buyer.account.balance})
+
+    def test_choosing_a_winner_for_a_closed_item_conflicts(self):
+        with mock.patch.object(ItemViewSet, 'get_object', return_value=self.item):
+            response = self.post(self.seller, '/api/items/Lamp/choose-winner/')
+        self.assertEqual(response.status_code, 409, response.data)
+        self.assertNotCharged()
+
+    def test_accepting_a_win_on_a_closed_item_conflicts(self):
+        response = self.post(self.buyer, '/api/accounts/accept-win/')
+        self.assertEqual(response.status_code, 409, response.data)
+        self.assertNotCharged()
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_OUTBOX_RATE_LIMIT=1000)
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        self.seller = create_profile("seller")
+        self.item = create_item(self.seller, title="Lamp")
+
+    def test_notifications_are_queued_not_sent(self):
+        EmailNotifications.notify_deadline_to_seller(self.seller.account.user, self.item)
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxEmail.objects.filter(status=OUTBOX_PENDING_CHOICE).count(), 1)
+
+    def test_flush_sends_pending_emails(self):
+        for _ in range(3):
+            EmailNotifications.notify_deadline_to_seller(self.seller.account.user, self.item)
+
+        self.assertEqual(flush_email_outbox(), 3)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].to, ["seller@example.com"])
+        self.assertEqual(OutboxEmail.objects.filter(status=OUTBOX_SENT_CHOICE).count(), 3)
+
+        # nothing left to send
+        self.assertEqual(flush_email_outbox(), 0)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_batch_is_claimed_before_sending(self):
+        EmailNotifications.notify_deadline_to_seller(self.seller.account.user, self.item)
+        statuses = []
+
+        def send(message):
+            statuses.append(OutboxEmail.objects.get().status)
+            return 1
+
+        with mock.patch('django.core.mail.EmailMessage.send', side_effect=send, autospec=True):
+            self.assertEqual(flush_email_outbox(), 1)
+
+        self.assertEqual(statuses, [OUTBOX_SENDING_CHOICE])
+        self.assertEqual(OutboxEmail.objects.get().status, OUTBOX_SENT_CHOICE)
+
+    def test_stale_claims_are_sent_again(self):
+        EmailNotifications.notify_deadline_to_seller(self.seller.account.user, self.item)
+        OutboxEmail.objects.update(status=OUTBOX_SENDING_CHOICE, next_attempt_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(flush_email_outbox(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_connection_failures_count_as_attempts(self):
+        EmailNotifications.notify_deadline_to_seller(self.seller.account.user, self.item)
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open', side_effect=OSError("refused")):
+            self.assertEqual(flush_email_outbox(), 0)
+
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.status, email.attempts, email.last_error), (OUTBOX_PENDING_CHOICE, 1, "refused"))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_OUTBOX_RATE_LIMIT=1000)
+class DeadlineReminderTests(TestCase):
+    def test_reminders_are_sent_once_per_user_and_item(self):
+        seller = create_profile("seller")
+        bidders = [create_profile("first"), create_profile("second")]
+        ending = create_item(seller, title="Ending", deadline=timezone.now() + timedelta(hours=12))
+        create_item(seller, title="Later", deadline=timezone.now() + timedelta(days=3))
+        for bidder, price in [(bidders[0], 20), (bidders[1], 30), (bidders[0], 40)]:
+            Bid.objects.create(profile=bidder, item=ending, bid_price=price, time_of_bid=timezone.now(), status=NOT_HIGHEST_CHOICE)
+
+        send_deadline_reminders()
+        send_deadline_reminders()
+
+        sent = SentNotification.objects.values_list('user__username', 'item_id', 'kind')
+        self.assertCountEqual(sent, [
+            ("seller", ending.pk, NOTIFY_DEADLINE_24H_SELLER),
+            ("first", ending.pk, NOTIFY_DEADLINE_24H_BIDDER),
+            ("second", ending.pk, NOTIFY_DEADLINE_24H_BIDDER),
+        ])
+
+        self.assertEqual(flush_email_outbox(), 3)
+        self.assertCountEqual([message.to for message in mail.outbox], [["seller@example.com"], ["first@example.com"], ["second@example.com"]])
+
+
+@override_settings(NOTIFICATION_DIGEST_WINDOW=900)
+class NotificationDigestTests(TestCase):
+    def setUp(self):
+        self.seller = create_profile("seller")
+        self.bidder = create_profile("bidder")
+        self.item = create_item(self.seller, title="Lamp")
+
+    def test_outbids_on_same_item_collapse_to_latest_price(self):
+        user = self.bidder.account.user
+        for price in [20, 30, 40]:
+            EmailNotifications.notify_outbid(user, self.item, Decimal(price))
+
+        pending = PendingNotification.objects.get(user=user)
+        self.assertIn("$40", pending.message)
+        self.assertEqual(OutboxEmail.objects.count(), 0)
+
+    def test_digest_sent_once_window_has_passed(self):
+        user = self.seller.account.user
+        EmailNotifications.notify_outbid(user, self.item, Decimal('25.00'))
+        EmailNotifications.notify_new_comment(user, self.bidder.account.user, "nice lamp")
+
+        self.assertEqual(flush_notification_digests(), 0)
+
+        PendingNotification.objects.update(created_at=timezone.now() - timedelta(minutes=20))
+        self.assertEqual(flush_notification_digests(), 1)
+        self.assertEqual(OutboxEmail.objects.filter(to_email=user.email).count(), 1)
+        self.assertFalse(PendingNotification.objects.exists())
+
+
+class SupabaseClientRegistryTests(TestCase):
+    def setUp(self):
+        supabase_clients.set_client_factory(supabase_clients.OfflineSupabaseClient)
+        self.addCleanup(supabase_clients.set_client_factory, None)
+
+    def test_service_client_is_shared_and_anon_client_is_per_thread(self):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            service_clients = set(pool.map(lambda i: id(supabase_clients.get_service_client()), range(8)))
+        self.assertEqual(len(service_clients), 1)
+
+        anon = supabase_clients.get_anon_client()
+        self.assertIs(supabase_clients.get_anon_client(), anon)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            self.assertIsNot(pool.submit(supabase_clients.get_anon_client).result(), anon)
+
+    def test_calls_are_timed(self):
+        supabase_clients.reset_call_stats()
+        client = supabase_clients.get_service_client()
+        with supabase_clients.supabase_call('auth.admin.create_user'):
+            client.auth.admin.create_user({'email': 'a@example.com', 'password': 'password'})
+        with self.assertRaises(Exception):
+            with supabase_clients.supabase_call('auth.admin.create_user'):
+                client.auth.admin.create_user({'email': 'a@example.com', 'password': 'password'})
+
+        stats = supabase_clients.get_call_stats()['auth.admin.create_user']
+        self.assertEqual((stats['count'], stats['errors']), (2, 1))
+
+    def test_account_deletion_deletes_supabase_user_by_id(self):
+        client = supabase_clients.get_service_client()
+        profile = create_profile("quitter")
+        account = profile.account
+        account.supabase_user_id = client.auth.admin.create_user({'email': account.user.email, 'password': 'password'}).user.id
+        account.save()
+
+        supabase_clients.reset_call_stats()
+        self.assertTrue(account.delete_account_user_profile())
+
+        self.assertEqual(client.users, {})
+        self.assertNotIn('auth.admin.list_users', supabase_clients.get_call_stats())
+        self.assertFalse(User.objects.filter(username="quitter").exists())
+
+    def test_account_deletion_finds_unlinked_supabase_user_past_the_first_page(self):
+        client = supabase_clients.get_service_client()
+        # more users than list_users returns on its default first page
+        for n in range(60):
+            client.auth.admin.create_user({'email': f'other{n}@example.com', 'password': 'password'})
+        profile = create_profile("quitter")
+        client.auth.admin.create_user({'email': profile.account.user.email, 'password': 'password'})
+
+        self.assertTrue(profile.account.delete_account_user_profile())
+
+        self.assertEqual(len(client.users), 60)
+        self.assertNotIn(profile.account.user.email, {user.email for user in client.users.values()})
+
+
+class SyncUsersToSupabaseTests(TestCase):
+    def setUp(self):
+        supabase_clients.set_client_factory(supabase_clients.OfflineSupabaseClient)
+        self.addCleanup(supabase_clients.set_client_factory, None)
+        self.supabase = supabase_clients.get_service_client()
+
+        checkpoint_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(checkpoint_dir.cleanup)
+        self.checkpoint = os.path.join(checkpoint_dir.name, 'checkpoint.json')
+
+    def sync(self, *args):
+        output = StringIO()
+        call_command('sync_users_to_supabase', '--checkpoint', self.checkpoint, '--workers', '2', *args, stdout=output)
+        return output.getvalue()
+
+    def test_creates_missing_users_and_skips_linked_ones(self):
+        missing = [create_profile(f"missing{n}").account for n in range(3)]
+        linked = create_profile("linked").account
+        linked.supabase_user_id = uuid.uuid4()
+        linked.save()
+
+        self.assertIn("Created 3, skipped 1, failed 0", self.sync())
+
+        emails = {user.email for user in self.supabase.users.values()}
+        self.assertEqual(emails, {account.user.email for account in missing})
+        for account in missing:
+            account.refresh_from_db()
+            self.assertEqual(str(account.supabase_user_id), next(
+                user.id for user in self.supabase.users.values() if user.email == account.user.email
+            ))
+
+    def test_rerun_is_idempotent(self):
+        for n in range(3):
+            create_profile(f"user{n}")
+        self.sync()
+        linked = dict(Account.objects.values_list('id', 'supabase_user_id'))
+
+        # resuming from the checkpoint finds nothing left, and a full rerun skips every linked account
+        self.assertIn("Created 0, skipped 0, failed 0", self.sync())
+        self.assertIn("Created 0, skipped 3, failed 0", self.sync('--reset'))
+
+        self.assertEqual(len(self.supabase.users), 3)
+        self.assertEqual(dict(Account.objects.values_list('id', 'supabase_user_id')), linked)
+
+
+@override_settings(SUPABASE_JWT_SECRET='test-secret', SUPABASE_URL='https://project.supabase.co')
+class SupabaseTokenTests(TestCase):
+    def claims(self, **overrides):
+        claims = {'sub': 'user-id', 'email': 'user@example.com', 'aud': 'authenticated', 'exp': int(time.time()) + 3600}
+        claims.update(overrides)
+        return {name: value for name, value in claims.items() if value is not None}
+
+    def test_valid_hs256_token(self):
+        token = jwt.encode(self.claims(), 'test-secret', algorithm='HS256')
+        self.assertEqual(middleware.verify_supabase_token(token)['email'], 'user@example.com')
+
+    def test_rejected_tokens(self):
+        rejected = {
+            'expired': jwt.encode(self.claims(exp=int(time.time()) - 60), 'test-secret', algorithm='HS256'),
+            'wrong audience': jwt.encode(self.claims(aud='anon'), 'test-secret', algorithm='HS256'),
+            'missing sub': jwt.encode(self.claims(sub=None), 'test-secret', algorithm='HS256'),
+            'missing exp': jwt.encode(self.claims(exp=None), 'test-secret', algorithm='HS256'),
+            'bad signature': jwt.encode(self.claims(), 'another-secret', algorithm='HS256'),
+        }
+        for reason, token in rejected.items():
+            with self.subTest(reason), self.assertRaises(InvalidTokenError):
+                middleware.verify_supabase_token(token)
+
+    def test_asymmetric_tokens_are_checked_against_the_project_jwks(self):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        signing_key = mock.Mock(key=private_key.public_key())
+
+        with mock.patch.object(middleware, '_jwks_client', None), mock.patch.object(middleware, 'PyJWKClient') as jwks_client:
+            jwks_client.return_value.get_signing_key_from_jwt.return_value = signing_key
+
+            token = jwt.encode(self.claims(), private_key, algorithm='RS256', headers={'kid': 'key-1'})
+            self.assertEqual(middleware.verify_supabase_token(token)['sub'], 'user-id')
+            self.assertEqual(jwks_client.call_args.args, ('https://project.supabase.co/auth/v1/.well-known/jwks.json',))
+
+            forged = jwt.encode(self.claims(), other_key, algorithm='RS256', headers={'kid': 'key-1'})
+            with self.assertRaises(InvalidTokenError):
+                middleware.verify_supabase_token(forged)
+
+            # the client, and with it the fetched keys, is reused across verifications
+            self.assertEqual(jwks_client.call_count, 1)
+
+
+@override_settings(SUPABASE_JWT_SECRET='test-secret')
+class IdentityCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        identity_cache.local.clear()
+        self.profile = create_profile("cached")
+        self.token = jwt.encode(
+            {'sub': 'user-id', 'email': 'cached@example.com', 'aud': 'authenticated', 'exp': int(time.time()) + 3600},
+            'test-secret',
+            algorithm='HS256',
+        )
+
+    def authenticate(self):
+        request = APIRequestFactory().get('/', HTTP_X_AUTH_TOKEN=f"Bearer {self.token}")
+        user, identity = middleware.SupabaseAuthentication().authenticate(request)
+        return user
+
+    def test_cached_identity_is_served_without_queries(self):
+        with CaptureQueriesContext(connection) as miss:
+            self.authenticate()
+        self.assertGreater(len(miss), 0)
+
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+            # the fields permission checks and serializers read
+            self.assertEqual(user.username, "cached")
+            self.assertEqual(user.email, "cached@example.com")
+            self.assertFalse(user.is_staff)
+            self.assertTrue(user.is_active)
+            self.assertEqual(user.account.status, STATUS_USER)
+            self.assertFalse(user.account.is_suspended)
+            self.assertEqual(user.account.profile.id, self.profile.id)
+
+    def test_saves_survive_a_cache_outage(self):
+        self.authenticate()
+        account = self.profile.account
+        with mock.patch.object(cache, 'delete', side_effect=redis.exceptions.ConnectionError("down")):
+            account.status = STATUS_VIP
+            account.save()
+            account.user.save()
+
+        account.refresh_from_db()
+        self.assertEqual(account.status, STATUS_VIP)
+        # the local copy is still dropped
+        self.assertEqual(identity_cache.local.entries, {})
+
+    def test_account_save_invalidates_the_cached_identity(self):
+        self.authenticate()
+        account = self.profile.account
+        account.status = STATUS_VIP
+        account.save()
+
+        self.assertEqual(self.authenticate().account.status, STATUS_VIP)
+
+    def test_user_save_invalidates_the_cached_identity(self):
+        self.authenticate()
+        user = self.profile.account.user
+        user.is_staff = True
+        user.save()
+
+        self.assertTrue(self.authenticate().is_staff)
+
+    def test_sign_out_revokes_the_token(self):
+        self.authenticate()
+        response = APIClient().post('/api/auth/signout/', HTTP_X_AUTH_TOKEN=f"Bearer {self.token}")
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+        # nor from a process whose local cache never saw the sign-out
+        identity_cache.local.clear()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+
+class RegistrationTests(TestCase):
+    def setUp(self):
+        supabase_clients.set_client_factory(supabase_clients.OfflineSupabaseClient)
+        self.addCleanup(supabase_clients.set_client_factory, None)
+        self.data = {'username': 'newuser', 'email': 'new@example.com', 'password': 'password', 'first_name': 'New', 'last_name': 'User'}
+
+    def register(self):
+        serializer = RegisterSerializer(data=self.data)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        return serializer.save()
+
+    def test_register_creates_rows_and_one_auth_user(self):
+        user = self.register()
+
+        client = supabase_clients.get_service_client()
+        self.assertEqual(len(client.users), 1)
+        self.assertEqual(str(user.account.supabase_user_id), next(iter(client.users)))
+        self.assertTrue(Profile.objects.filter(account__user=user).exists())
+
+    def test_auth_user_left_by_an_earlier_attempt_is_adopted(self):
+        client = supabase_clients.get_service_client()
+        orphan = client.auth.admin.create_user({
+            'email': self.data['email'], 'password': 'old-password', 'app_metadata': supabase_clients.BACKEND_APP_METADATA,
+        }).user
+
+        user = self.register()
+
+        self.assertEqual(str(user.account.supabase_user_id), orphan.id)
+        self.assertEqual(client.users[orphan.id].password, self.data['password'])
+        self.assertEqual(len(client.users), 1)
+
+    def test_foreign_auth_user_fails_the_registration(self):
+        client = supabase_clients.get_service_client()
+        foreign = client.auth.admin.create_user({'email': self.data['email'], 'password': 'their-password'}).user
+
+        with self.assertRaises(Exception):
+            self.register()
+
+        self.assertFalse(User.objects.filter(username='newuser').exists())
+        self.assertEqual(client.users[foreign.id].password, 'their-password')
+
+    def test_auth_user_linked_to_another_account_is_not_adopted(self):
+        client = supabase_clients.get_service_client()
+        taken = client.auth.admin.create_user({
+            'email': self.data['email'], 'password': 'password', 'app_metadata': supabase_clients.BACKEND_APP_METADATA,
+        }).user
+        other = create_profile("other").account
+        other.supabase_user_id = taken.id
+        other.save()
+
+        with self.assertRaises(Exception):
+            self.register()
+
+        self.assertFalse(User.objects.filter(username='newuser').exists())
+
+    def test_failed_provisioning_removes_the_django_rows(self):
+        def fail(attributes):
+            raise Exception("Supabase unavailable")
+        supabase_clients.get_service_client().auth.admin.create_user = fail
+
+        with self.assertRaises(Exception):
+            self.register()
+
+        self.assertFalse(User.objects.filter(username='newuser').exists())
+        self.assertFalse(Account.objects.exists())
+
+
+class ExploreSnapshotTests(RedisTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.profile = create_profile("seller")
+        self.item = create_item(self.profile, title="Lamp")
+
+    def test_snapshots_are_served_without_queries_once_built(self):
+        explore.refresh_snapshots(force=True)
+
+        with self.assertNumQueries(0):
+            for name in explore.SNAPSHOTS:
+                explore.get_snapshot(name)
+
+    def test_bid_marks_dependent_snapshots_stale(self):
+        explore.refresh_snapshots(force=True)
+        self.assertEqual(explore.get_snapshot('recent-bids'), [])
+
+        bidder = create_profile("bidder")
+        with self.captureOnCommitCallbacks(execute=True):
+            accept_bid(self.item, bidder, Decimal('20.00'))
+
+        self.assertIn('recent-bids', explore.refresh_snapshots())
+        self.assertNotIn('by-rating', explore.refresh_snapshots())
+        self.assertEqual([item['id'] for item in explore.get_snapshot('recent-bids')], [self.item.id])
+
+
+class CollectionStatsTests(RedisTestMixin, TestCase):
+    def test_incremental_stats_match_reconciled_stats(self):
+        collection = Collection.objects.create(title="Lamps")
+        seller = create_profile("seller")
+        bidder = create_profile("bidder")
+        items = [create_item(seller, title=f"Lamp {i}", collection=collection) for i in range(3)]
+        for item in items:
+            record_item_listed(item)
+
+        with self.captureOnCommitCallbacks() as deltas:
+            accept_bid(items[0], bidder, Decimal('20.00'))
+        # the stats row is left alone until the bid commits
+        self.assertEqual(CollectionStats.objects.get(collection=collection).total_bids, 0)
+        for delta in deltas:
+            delta()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            accept_bid(items[0], bidder, Decimal('25.00'))
+            accept_bid(items[1], bidder, Decimal('40.00'))
+        close_item(items[1], SOLD_CHOICE)
+
+        stats = CollectionStats.objects.get(collection=collection)
+        incremental = (stats.available_items, stats.total_bids, stats.highest_bid_sum)
+        self.assertEqual(incremental, (2, 3, Decimal('25.00')))
+
+        reconcile_collection_stats()
+        stats.refresh_from_db()
+        self.assertEqual((stats.available_items, stats.total_bids, stats.highest_bid_sum), incremental)
+
+
+class HotScoreTests(RedisTestMixin, TestCase):
+    def test_incremental_scores_decay_and_match_a_rebuild(self):
+        seller = create_profile("seller")
+        bidder = create_profile("bidder")
+        old = create_item(seller, title="Old")
+        new = create_item(seller, title="New")
+
+        week_ago = timezone.now() - timedelta(days=7)
+        for price in (20, 30, 40):
+            Bid.objects.create(profile=bidder, item=old, bid_price=price, time_of_bid=week_ago, status=NOT_HIGHEST_CHOICE)
+            bump_hot_score(old.pk, 'bid', week_ago.timestamp())
+        accept_bid(new, bidder, Decimal('20.00'))
+
+        # one fresh bid outweighs three week-old ones
+        self.assertEqual(list(hot_items()), [new, old])
+
+        incremental = dict(Item.objects.values_list('id', 'hot_score'))
+        rebuild_hot_scores()
+        for item_id, score in Item.objects.values_list('id', 'hot_score'):
+            self.assertAlmostEqual(score, incremental[item_id], places=6)
+
+
+class ExpireEndedAuctionsTests(TestCase):
+    def test_ended_auctions_expire_in_batches(self):
+        seller = create_profile("seller")
+        ended = [create_item(seller, title=f"Ended {n}", deadline=timezone.now() - timedelta(hours=n + 1)) for n in range(5)]
+        running = create_item(seller, title="Running")
+        sold = create_item(seller, title="Sold", availability=SOLD_CHOICE, deadline=timezone.now() - timedelta(hours=1))
+
+        with mock.patch('api.tasks.notify_auctions_ended') as notify, self.captureOnCommitCallbacks(execute=True):
+            closed_ids = expire_ended_auctions(batch_size=2)
+        self.assertCountEqual(closed_ids, [item.pk for item in ended])
+        # one notification fan-out per batch, oldest deadlines first
+        batches = [set(call.args[0]) for call in notify.delay.call_args_list]
+        self.assertEqual(batches, [{ended[4].pk, ended[3].pk}, {ended[2].pk, ended[1].pk}, {ended[0].pk}])
+
+        availability = dict(Item.objects.values_list('id', 'availability'))
+        self.assertEqual({availability[item.pk] for item in ended}, {EXPIRED_CHOICE})
+        self.assertEqual(availability[running.pk], AVAILABLE_CHOICE)
+        self.assertEqual(availability[sold.pk], SOLD_CHOICE)
+
+        # a second run finds nothing left to close
+        self.assertEqual(expire_ended_auctions(batch_size=2), [])
+
+
+class AuctionScheduleTests(RedisTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.seller = create_profile("seller")
+
+    def test_schedule_and_reschedule(self):
+        item = create_item(self.seller)
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule_auction_close(item)
+        self.assertEqual(self.redis.zscore(AUCTION_DEADLINES_KEY, item.pk), item.deadline.timestamp())
+
+        item.deadline += timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule_auction_close(item)
+        self.assertEqual(self.redis.zrange(AUCTION_DEADLINES_KEY, 0, -1, withscores=True), [(str(item.pk), item.deadline.timestamp())])
+
+    def test_due_auctions_are_closed_and_popped(self):
+        due = create_item(self.seller, title="Due", deadline=timezone.now() - timedelta(minutes=1))
+        later = create_item(self.seller, title="Later")
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule_auction_close(due)
+            schedule_auction_close(later)
+
+        close_due_auctions()
+
+        due.refresh_from_db()
+        later.refresh_from_db()
+        self.assertEqual((due.availability, later.availability), (EXPIRED_CHOICE, AVAILABLE_CHOICE))
+        self.assertEqual(self.redis.zrange(AUCTION_DEADLINES_KEY, 0, -1), [str(later.pk)])
+
+    def test_backfill_schedules_every_open_auction(self):
+        open_items = [create_item(self.seller, title=f"Open {n}") for n in range(3)]
+        create_item(self.seller, title="Sold", availability=SOLD_CHOICE)
+
+        self.assertEqual(schedule_open_auctions(batch_size=2), 3)
+        scheduled = dict(self.redis.zrange(AUCTION_DEADLINES_KEY, 0, -1, withscores=True))
+        self.assertEqual(scheduled, {str(item.pk): item.deadline.timestamp() for item in open_items})
+
+        # re-running it changes nothing
+        self.assertEqual(schedule_open_auctions(), 3)
+        self.assertEqual(self.redis.zcard(AUCTION_DEADLINES_KEY), 3)
+
+
+class LockedAuctionCloseTests(RedisTestMixin, TransactionTestCase):
+    def test_auction_locked_at_its_deadline_stays_scheduled(self):
+        seller = create_profile("seller")
+        locked = create_item(seller, title="Locked", deadline=timezone.now() - timedelta(seconds=1))
+        due = create_item(seller, title="Due", deadline=timezone.now() - timedelta(seconds=1))
+        schedule_auction_close(locked)
+        schedule_auction_close(due)
+
+        # a bid holding the row lock across the deadline
+        holding, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            with transaction.atomic():
+                Item.objects.select_for_update().get(pk=locked.pk)
+                holding.set()
+                release.wait(10)
+            connection.close()
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        holding.wait(10)
+        try:
+            with mock.patch('api.tasks.notify_auctions_ended'):
+                close_due_auctions()
+        finally:
+            release.set()
+            holder.join()
+
+        self.assertEqual(Item.objects.get(pk=locked.pk).availability, AVAILABLE_CHOICE)
+        self.assertEqual(self.redis.zrange(AUCTION_DEADLINES_KEY, 0, -1), [str(locked.pk)])
+
+        with mock.patch('api.tasks.notify_auctions_ended'):
+            close_due_auctions()
+        self.assertEqual(Item.objects.get(pk=locked.pk).availability, EXPIRED_CHOICE)
+        self.assertEqual(self.redis.zcard(AUCTION_DEADLINES_KEY), 0)
+
+
+class RecentBidsRedisFeedTests(RedisTestMixin, TestCase):
+    def test_feed_keeps_each_item_once_newest_first_and_trims(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for item_id in [1, 2, 3, 2] + list(range(100, 100 + recent_bids.RECENT_BIDS_CAPACITY)):
+                recent_bids.record_recent_bid(item_id)
+            recent_bids.record_recent_bid(2)
+
+        feed = recent_bids.recent_item_ids()
+        self.assertEqual(feed[0], 2)
+        self.assertEqual(len(feed), recent_bids.RECENT_BIDS_CAPACITY)
+        self.assertEqual(len(set(feed)), len(feed))
+        self.assertEqual(self.redis.llen(recent_bids.RECENT_BIDS_KEY), recent_bids.RECENT_BIDS_CAPACITY)
+
+    def test_read_path_serves_available_items_in_feed_order(self):
+        seller = create_profile("seller")
+        older, sold, newer = [create_item(seller, title=title) for title in ("Older", "Sold", "Newer")]
+        Item.objects.filter(pk=sold.pk).update(availability=SOLD_CHOICE)
+        with self.captureOnCommitCallbacks(execute=True):
+            for item in (older, sold, newer):
+                recent_bids.record_recent_bid(item.pk)
+
+        self.assertEqual(recent_bids.recent_bid_items(), [newer, older])
+
+    def test_empty_feed_is_seeded_from_bids(self):
+        seller = create_profile("seller")
+        bidder = create_profile("bidder")
+        items = [create_item(seller, title=f"Lamp {n}") for n in range(2)]
+        for minutes_ago, item in [(10, items[1]), (5, items[0])]:
+            Bid.objects.create(profile=bidder, item=item, bid_price=20, time_of_bid=timezone.now() - timedelta(minutes=minutes_ago), status=HIGHEST_CHOICE)
+
+        self.assertEqual(recent_bids.recent_item_ids(), [items[0].pk, items[1].pk])
+        self.assertEqual(self.redis.lrange(recent_bids.RECENT_BIDS_KEY, 0, -1), [str(items[0].pk), str(items[1].pk)])
+
+
+class RecentBidsFeedTests(TestCase):
+    def test_local_feed_keeps_each_item_once_newest_first(self):
+        recent_bids._local_feed.clear()
+        self.addCleanup(recent_bids._local_feed.clear)
+
+        for item_id in [1, 2, 3, 2] + list(range(100, 100 + recent_bids.RECENT_BIDS_CAPACITY)):
+            recent_bids._push_local(item_id)
+        recent_bids._push_local(2)
+
+        feed = list(recent_bids._local_feed)
+        self.assertEqual(feed[0], 2)
+        self.assertEqual(len(feed), recent_bids.RECENT_BIDS_CAPACITY)
+        self.assertEqual(len(set(feed)), len(feed))
+
+
+class ItemSearchTests(TestCase):
+    def setUp(self):
+        seller = create_profile("seller")
+        self.in_title = create_item(seller, title="Brass lamp")
+        self.in_description = create_item(seller, title="Side table", description="comes with a matching lamp")
+        create_item(seller, title="Oak chair")
+        create_item(seller, title="Brass lamp, sold", availability=SOLD_CHOICE)
+
+    def search(self, **params):
+        response = self.client.get('/api/items/', params)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()['results']]
+
+    def test_title_matches_rank_above_description_matches(self):
+        results = self.search(q="lamps", availability="A")
+        self.assertEqual(results, [self.in_title.id, self.in_description.id])
+
+    def test_legacy_search_param_still_works(self):
+        self.assertEqual(self.search(search="table"), [self.in_description.id])
+
+
+class ItemSuggestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_suggestions_tolerate_typos_and_are_cached(self):
+        seller = create_profile("seller")
+        lamp = create_item(seller, title="Vintage brass lamp", collection=Collection.objects.create(title="Vintage"))
+        create_item(seller, title="Oak chair")
+
+        response = self.client.get('/api/items/suggest/', {'prefix': 'vintge'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['items']], [lamp.id])
+        self.assertEqual([collection['title'] for collection in response.json()['collections']], ["Vintage"])
+        # below the cutoff
+        self.assertEqual(self.client.get('/api/items/suggest/', {'prefix': 'vxntxge'}).json(), {"items": [], "collections": []})
+
+        with self.assertNumQueries(0):
+            self.client.get('/api/items/suggest/', {'prefix': ' Vintge '})
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "grouping sets and width_bucket are postgres specific")
+class ItemFacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_facets_count_the_filtered_items_in_one_query(self):
+        seller = create_profile("seller")
+        lamps = Collection.objects.create(title="Lamps")
+        chairs = Collection.objects.create(title="Chairs")
+        create_item(seller, title="Brass lamp", collection=lamps, highest_bid=Decimal('10.00'))
+        create_item(seller, title="Glass lamp", collection=lamps, highest_bid=Decimal('30.00'))
+        create_item(seller, title="Paper lamp", collection=chairs, highest_bid=Decimal('75.00'), availability=SOLD_CHOICE)
+        create_item(seller, title="Oak chair", collection=chairs, highest_bid=Decimal('200.00'))
+
+        with self.assertNumQueries(2): # the grouped counts, then the collection titles
+            response = self.client.get('/api/items/facets/', {'q': 'lamp'})
+        facets = response.json()
+
+        self.assertEqual(facets['total'], 3)
+        self.assertEqual([(c['title'], c['count']) for c in facets['collections']], [("Lamps", 2), ("Chairs", 1)])
+        self.assertEqual({a['value']: a['count'] for a in facets['availability']}, {AVAILABLE_CHOICE: 2, SOLD_CHOICE: 1})
+        self.assertEqual(
+            [(p['min'], p['max'], p['count']) for p in facets['price']],
+            [(None, 25, 1), (25, 50, 1), (50, 100, 1)],
+        )
+
+        # same filters in another order, with a cursor, come from the cache
+        with self.assertNumQueries(0):
+            cached = self.client.get('/api/items/facets/?cursor=abc&q=lamp&ordering=-date_posted').json()
+        self.assertEqual(cached, facets)
+
+        available = self.client.get('/api/items/facets/', {'q': 'lamp', 'availability': 'available'}).json()
+        self.assertEqual(available['total'], 2)
+
+
+class ItemPaginationTests(TestCase):
+    def test_cursor_walk_visits_every_item_once_despite_ties(self):
+        seller = create_profile("seller")
+        items = [create_item(seller, title=f"Item {i}", total_bids=i % 3) for i in range(8)]
+        expected = [item.id for item in sorted(items, key=lambda item: (item.total_bids, item.id))]
+
+        seen = []
+        url = '/api/items/?ordering=total_bids&page_size=3&availability=A'
+        while url:
+            page = self.client.get(url).json()
+            seen += [item['id'] for item in page['results']]
+            url = page['next']
+            # new listings mid-walk neither repeat nor skip anything
+            create_item(seller, title="Late", total_bids=0)
+
+        self.assertEqual([item_id for item_id in seen if item_id in expected], expected)
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_cursor_walk_over_tied_search_ranks(self):
+        seller = create_profile("seller")
+        lamps = [create_item(seller, title="Brass lamp") for _ in range(5)]
+
+        seen = []
+        url = '/api/items/?q=lamp&page_size=2'
+        for _ in range(5): # a cursor that can't move past tied rows would otherwise page forever
+            page = self.client.get(url).json()
+            seen += [item['id'] for item in page['results']]
+            url = page['next']
+            if not url:
+                break
+
+        self.assertEqual(seen, sorted((lamp.id for lamp in lamps), reverse=True))
+
+    def test_invalid_cursor_is_rejected(self):
+        self.assertEqual(self.client.get('/api/items/', {'cursor': 'not-a-cursor'}).status_code, 404)
+
+
+class ItemListFieldsTests(TestCase):
+    def setUp(self):
+        seller = create_profile("seller")
+        self.collection = Collection.objects.create(title="Lamps")
+        self.lamp = create_item(seller, title="Brass lamp", collection=self.collection, image_urls=["front.jpg", "back.jpg"])
+        create_item(seller, title="Oak chair")
+
+    def test_list_rows_match_the_item_serializer(self):
+        with self.assertNumQueries(1):
+            results = self.client.get('/api/items/', {'ordering': 'date_posted'}).json()['results']
+        detail = self.client.get(f'/api/items/{self.lamp.title}/').json()
+
+        self.assertEqual(results[0], detail)
+        self.assertEqual(detail['username'], "seller")
+        self.assertEqual(detail['thumbnail'], "front.jpg")
+        self.assertIsNone(results[1]['thumbnail'])
+
+    def test_sparse_fieldsets(self):
+        results = self.client.get('/api/items/', {'fields': 'id,title,thumbnail,nonsense', 'ordering': 'date_posted'}).json()['results']
+        self.assertEqual(results[0], {'id': self.lamp.id, 'title': "Brass lamp", 'thumbnail': "front.jpg"})
+
+        detail = self.client.get(f'/api/items/{self.lamp.title}/', {'fields': 'title,collection'}).json()
+        self.assertEqual(detail, {'title': "Brass lamp", 'collection': self.collection.id})
+
+
+# the browse, bidding and deadline queries must be answerable from an index; with sequential scans
+# priced out, a Seq Scan in the plan means no usable index exists
+@unittest.skipUnless(connection.vendor == 'postgresql', "plans are postgres specific")
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sellers = [create_profile(f"seller{i}") for i in range(5)]
+        cls.collections = [Collection.objects.create(title=f"Collection {i}") for i in range(5)]
+        bidder = create_profile("bidder")
+        now = timezone.now()
+        cls.items = Item.objects.bulk_create([
+            Item(
+                title=f"Item {i}", description="", profile=cls.sellers[i % 5], collection=cls.collections[i % 5],
+                selling_price=10, highest_bid=i % 100, deadline=now + timedelta(hours=i % 72),
+                availability=[AVAILABLE_CHOICE, SOLD_CHOICE, EXPIRED_CHOICE][i % 3],
+            )
+            for i in range(300)
+        ])
+        Bid.objects.bulk_create([
+            Bid(profile=bidder, item=cls.items[i % 300], bid_price=i % 500, time_of_bid=now, status=NOT_HIGHEST_CHOICE)
+            for i in range(1500)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    # the plan reads through the named indexes (with seq scans off, any index would do otherwise)
+    def assertIndexed(self, queryset, *indexes):
+        plan = queryset.explain()
+        for index in indexes:
+            self.assertIn(index, plan, plan)
+
+    def browse(self, **params):
+        return ItemFilter(params, queryset=Item.objects.all()).qs
+
+    def test_ended_auctions(self):
+        self.assertIndexed(Item.objects.filter(availability=AVAILABLE_CHOICE, deadline__lte=timezone.now()).order_by('deadline')[:1000], 'item_available_deadline_idx')
+
+    def test_upcoming_deadlines(self):
+        now = timezone.now()
+        self.assertIndexed(Item.objects.filter(availability=AVAILABLE_CHOICE, deadline__gt=now, deadline__lte=now + timedelta(hours=24)), 'item_available_deadline_idx')
+
+    def test_browse_by_collection(self):
+        queryset = self.browse(collection__title__iexact="collection 1", availability="available").order_by('total_bids')
+        self.assertIndexed(queryset, 'api_item_collection_id', 'collection_title_upper_idx')
+
+    def test_browse_by_profile(self):
+        queryset = self.browse(profile__account_id=self.sellers[0].account_id, availability="A").order_by('-date_posted')
+        self.assertIndexed(queryset, 'item_profile_browse_idx', 'api_profile_account_id')
+
+    def test_browse_by_price_range(self):
+        self.assertIndexed(self.browse(highest_bid__gt=25, highest_bid__lt=50, availability="available"), 'item_highest_bid_keyset_idx')
+
+    def test_browse_by_total_bids(self):
+        self.assertIndexed(Item.objects.order_by('total_bids', 'id')[:20], 'item_total_bids_keyset_idx')
+
+    def test_popular(self):
+        self.assertIndexed(hot_items(), 'item_hot_score_idx')
+
+    def test_highest_bid_on_item(self):
+        self.assertIndexed(Bid.objects.filter(item=self.items[0]).order_by('-bid_price', 'time_of_bid')[:1], 'bid_item_price_time_idx')
+
+
+# every listing endpoint costs the same number of queries for one row as for many (see api.query_plans)
+class ConstantQueryCountTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.seller = create_profile("seller")
+        self.buyer = create_profile("buyer")
+        self.item = create_item(self.seller, title="Lamp")
+
+    def count_queries(self, url):
+        # a fresh user each time, so nothing cached on it from the previous request hides a query
+        self.client.force_authenticate(User.objects.get(pk=self.buyer.account.user_id))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, url, add_row):
+        add_row(0)
+        one = self.count_queries(url)
+        for i in range(1, 6):
+            add_row(i)
+        self.assertEqual(self.count_queries(url), one)
+
+    def add_bid(self, i):
+        seller = create_profile(f"seller{Profile.objects.count()}")
+        item = create_item(seller, title=f"Item {i}")
+        return Bid.objects.create(profile=self.buyer, item=item, bid_price=Decimal('20.00'), time_of_bid=timezone.now(),
+                                  status=HIGHEST_CHOICE, winner_status=WINNING_PENDING_CHOICE)
+
+    def add_transaction(self, i):
+        bid = self.add_bid(i)
+        Transaction.objects.create(seller=bid.item.profile.account, buyer=self.buyer.account, bid=bid)
+        Transaction.objects.create(seller=self.buyer.account, buyer=bid.item.profile.account, bid=self.add_bid(i))
+
+    def test_item_list(self):
+        self.assertConstantQueries('/api/items/', lambda i: create_item(create_profile(f"seller{i}"), title=f"Item {i}"))
+
+    def test_item_comments_and_replies(self):
+        parent = Comment.objects.create(item=self.item, profile=self.seller, text="first")
+
+        def add_comment(i):
+            commenter = create_profile(f"commenter{i}")
+            Comment.objects.create(item=self.item, profile=commenter, text="reply", parent=parent)
+            Comment.objects.create(item=self.item, profile=commenter, text="another")
+
+        add_comment(0)
+        one = (self.count_queries('/api/items/Lamp/comments/'), self.count_queries(f'/api/items/Lamp/replies/?parent={parent.id}'))
+        for i in range(1, 6):
+            add_comment(i)
+        self.assertEqual((self.count_queries('/api/items/Lamp/comments/'), self.count_queries(f'/api/items/Lamp/replies/?parent={parent.id}')), one)
+
+    def test_profiles(self):
+        self.assertConstantQueries('/api/profiles/', lambda i: create_profile(f"profile{i}"))
+
+    def test_saves(self):
+        self.assertConstantQueries('/api/profiles/saves/', lambda i: Save.objects.create(item=create_item(self.seller, title=f"Item {i}"), profile=self.buyer))
+
+    def test_pending_bids(self):
+        self.assertConstantQueries('/api/accounts/view-pending-bids/', self.add_bid)
+
+    def test_transactions(self):
+        for url in ['/api/transactions/seller-transactions/', '/api/transactions/awaiting-arrival/', '/api/transactions/next-actions/']:
+            with self.subTest(url=url):
+                self.assertConstantQueries(url, self.add_transaction)
@@ -2,6 +2,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import *
+from .events import item_events
 
 router = DefaultRouter()
 router.register(r'accounts', AccountViewSet, basename='account')
@@ -14,6 +15,9 @@ urlpatterns = [
     path('auth/signin/', SignInView.as_view(), name='signin'),
     path('auth/signout/', SignOutView.as_view(), name='signout'),
 
+    # live auction updates (server-sent events)
+    path('items/<int:item_id>/events/', item_events, name='item-events'),
+
     # include all viewset URLs under api/
     path('', include(router.urls)),
 
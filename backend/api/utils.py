@@ -2,6 +2,9 @@ from google.cloud import storage
 from django.conf import settings
 import random
 import operator
+import redis
+
+_redis_client = None
 
 class EmailNotifications:
     # notification for when after a bid is won - immediate task
@@ -9,33 +12,22 @@ class EmailNotifications:
     def notify_bid_won(user, item, bid_price):
         subject = f"Congratulations! You've won the auction for {item.title}"
         message = f"You have won the auction for {item.title} with your bid of ${bid_price}!"
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
     
     # notification after the deadline of the seller's item has approached - periodic task 
     @staticmethod
     def notify_deadline_to_seller(user, item):
         subject = f"The auction for {item.title} has ended."
         message = f"The auction for {item.title} has ended - log in to see who won."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
 
     # notification for when a user is outbid - immediate task
     @staticmethod
     def notify_outbid(user, item, new_bid):
         subject = f"You've been outbid on {item.title}!"
         message = f"Someone has placed a higher bid of ${new_bid} on {item.title}. Log in to reclaim your spot!"
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        # repeated outbids on the same item collapse to the latest price
+        queue_digest(user, subject, message, coalesce_key=f"outbid:{item.pk}")
     
     # notification for approaching deadline - periodic task
     @staticmethod
@@ -46,73 +38,45 @@ class EmailNotifications:
         else:
             subject = f"24 hours left to bid on {item.title}"
             message = f"The deadline for {item.title} is in 24 hours. Log in to secure your spot in first place if you haven't already!"
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
     
     # user is seller, winner is user instance
     @staticmethod
     def notify_sale_confirmed(user, item, winner):
         subject = "Transaction Accepted."
         message = f"{winner.username} has accepted the transaction for {item.title}. Your balance has now been updated, you may proceed to 'Next Actions' to ship the item."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
 
     # user is seller, winner is user instance
     @staticmethod
     def notify_sale_rejected(user, item, winner):
         subject = "Transaction Rejected."
         message = f"{winner.username} has rejected the transaction for {item.title}. You must log in and select a new winner before your item's deadline, or else your item will be expired."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
 
     @staticmethod
     def notify_item_shipped(user, item, seller, estimated_delivery, carrier, shipping_cost):
         subject = f"{item.title} has been shipped!"
         message = f"Your item {item.title} has been shipped!\n\nEstimated Delivery: {estimated_delivery},\nCarrier: {carrier},\nShipping Cost: {shipping_cost}.\n\nLog in to rate the seller {seller.user.username}!"
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
     
     @staticmethod
     def notify_item_arrived(user, item):
         subject = f"{item.title} has arrived!"
         message = f"Your item {item.title} has arrived! Log in to mark this item as 'received' for the seller to know."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
     
     @staticmethod
     def notify_item_received(user, item, buyer):
         subject = f"{buyer.user.username} has received your item!"
         message = f"Your item {item.title} has been received by {buyer.user.username}. Log in to rate this transaction if you haven't already."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
 
     @staticmethod
     def notify_deadline_changed(user, item, new_deadline):
         subject = f"Deadline changed for {item.title}."
         message = f"The item you have bidded on, {item.title}, has a changed deadline.\nThe new deadline is: {new_deadline}."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
 
     @staticmethod
     def notify_account_suspended(user, reason, is_vip):
@@ -123,149 +87,142 @@ class EmailNotifications:
             pay_fine_to = "Your items are no longer available for auction. Log in to pay a $50 fine to get access to your account again."
         subject = f"Account {consequence}."
         message = f"Your account {user.username} has been {consequence.lower()} because of the following reason:\n{reason}.\n\n{pay_fine_to}"
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
 
     @staticmethod
     def notify_account_balance_insufficient(user, current_balance):
         subject = "Unsuspended: Account Balance is Insufficient"
         message = f"You have been unsuspended, but your account balance is now at ${current_balance:.2f}. Log in to add to your account balance."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
     
     @staticmethod
     def notify_account_permanently_suspended(user):
         subject = "Your Account Has Been Permanently Suspended"
         message = "Your account has been permanently suspended. You can no longer reactivate your account or operate as a BluePenguin user."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
     
     @staticmethod
     def notify_VIP_status_earned(user):
         subject = "VIP Status Earned"
         message = "Your account has earned VIP status! It currently has over $5k balance, has no complaints, and 5+ transactions. You now have a 10 percent on all transactions you win and accept."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
     
     @staticmethod
     def notify_VIP_status_revoked(user):
         subject = "VIP Status Revoked"
         message = "Your account's VIP status has been revoked, because either your balance is under $5k or you have received a complaint."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
 
     @staticmethod
     def notify_items_deleted(user, items):
         subject = "Transaction Cancelled Due to Item Deletion"
         message = f"The following items have been deleted by either BluePenguin or its BluePenguin user: {', '.join(items)}."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
 
     @staticmethod
     def notify_quit_application_received(user):
         subject = "Quit Application Received."
         message = "Your quit application has been received. It is currently under review."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
     
     @staticmethod
     def notify_deletion_rejected(user):
         subject = "Account Deletion Request Rejected"
         message = f"After being reviewed by BluePenguin Superusers, they believed that your account deletion request is invalid."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
 
     @staticmethod
     def notify_report_received(user):
         subject = "Your Report Was Received."
         message = "It is under review by BluePenguin's superusers."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
 
     @staticmethod
     def notify_report_rejected(user):
         subject = "Report Rejected"
         message = f"After being reviewed by BluePenguin Superusers, they believed that your report is invalid."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
 
     @staticmethod
     def notify_reported(user, reason):
         subject = "Account Report"
         message = f"A BluePenguin user reported your account because of the following reason:{reason}. You are no longer eligible to be a VIP."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
 
     @staticmethod
     def notify_deletion_approved(user):
         subject = "We're sad to see you go."
         message = "BluePenguin superusers have agreed that your request to quit is valid. Your account and items have been automatically deleted."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
 
     @staticmethod
     def notify_account_reactivated(user):
         subject = "Account Reactivated Notice"
         message = "Your account has been reactivated by BluePenguin administration."
-        user.email_user(
-            subject=subject,
-            message=message,
-            from_email=settings.EMAIL_HOST_USER
-        )
+        queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
 
     @staticmethod
     def notify_user_application_received(user):
         subject = "User Application Received"
         message = "Your application to become a User has been received and is under review."
-        user.email_user(subject=subject, message=message)
+        queue_email(user, subject, message)
 
     @staticmethod
     def notify_user_application_approved(user):
         subject = "User Application Approved"
         message = "Your application to become a User has been approved! You now have full user privileges."
-        user.email_user(subject=subject, message=message)
+        queue_email(user, subject, message)
 
     @staticmethod
     def notify_user_application_rejected(user):
         subject = "User Application Rejected"
         message = "Your application to become a User has been rejected by BluePenguin administration."
-        user.email_user(subject=subject, message=message)
+        queue_email(user, subject, message)
+
+    @staticmethod
+    def notify_new_comment(user, commenter, text):
+        subject = "New Comment for You"
+        message = f"{commenter.username} commented: {text}"
+        queue_digest(user, subject, message)
+
+    @staticmethod
+    def notify_comment_liked(user, liker, comment):
+        subject = "New Like on Your Comment"
+        message = f"{liker.username} has liked your comment: {comment.text}"
+        queue_digest(user, subject, message)
+
+# notifications are written to the email outbox and sent in batches by api.tasks.flush_email_outbox,
+# so a request never waits on an SMTP round-trip. call inside the caller's transaction
+def queue_email(user, subject, message, from_email=None):
+    from .models import OutboxEmail
+
+    return OutboxEmail.objects.create(
+        to_email=user.email,
+        subject=subject,
+        body=message,
+        from_email=from_email,
+    )
+
+# high-volume notifications are buffered per user and sent as one digest by
+# api.tasks.flush_notification_digests once NOTIFICATION_DIGEST_WINDOW has passed.
+# entries sharing a coalesce_key replace each other instead of piling up
+def queue_digest(user, subject, message, coalesce_key=None):
+    from .models import PendingNotification
+
+    if not settings.NOTIFICATION_DIGEST_WINDOW:
+        return queue_email(user, subject, message, from_email=settings.EMAIL_HOST_USER)
+
+    notification = PendingNotification(user=user, subject=subject, message=message, coalesce_key=coalesce_key)
+    if coalesce_key is None:
+        notification.save()
+    else:
+        PendingNotification.objects.bulk_create(
+            [notification],
+            update_conflicts=True,
+            unique_fields=['user', 'coalesce_key'],
+            update_fields=['subject', 'message'],
+        )
+    return notification
 
 def upload_to_gcs(file_obj, destination_blob_name):
     print(f"Starting upload for {destination_blob_name}")
@@ -323,4 +280,11 @@ def complete_transaction(seller, buyer, amount):
     seller.save()
 
     buyer.balance = buyer_balance
-    buyer.save()
\ No newline at end of file
+    buyer.save()
+
+# shared redis connection pool for the process
+def get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _redis_client
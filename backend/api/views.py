@@ -3,11 +3,20 @@ from .serializers import *
 from .models import *
 from .permissions import *
 from .filters import *
+from .pagination import ItemKeysetPagination
 from .utils import EmailNotifications, complete_transaction
+from .bidding import accept_bid, BidRejected
+from .events import publish_item_update
+from .scheduler import schedule_auction_close
+from .explore import get_snapshot, mark_snapshots_stale
+from .collection_stats import record_item_listed, close_item
+from .facets import item_facets
+from .query_plans import QuerysetPlanMixin
 
 from django.shortcuts import render
 from django.contrib.auth.models import User
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
+from django.db.transaction import atomic
 from django.db.models.aggregates import Avg, Count, Max
 from django.utils import timezone
 from django.utils.encoding import force_str
@@ -19,14 +28,18 @@ from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.exceptions import NotFound
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.views import APIView
 from django.conf import settings
-from supabase import create_client
+from backend.supabase_clients import get_anon_client, get_service_client, supabase_call
+from backend.identity import identity_cache
+from backend.middleware import get_auth_token, token_lifetime
 from django.core.cache import cache
+from django.contrib.postgres.search import TrigramWordSimilarity
 
 from decimal import Decimal
-from time import sleep
+from urllib.parse import urlencode
+import hashlib
 import shippo
 
 
@@ -60,35 +73,15 @@ class CreateUserView(generics.CreateAPIView):
     permission_classes = [AllowAny] #allow anyone to call this to create new user
 '''
 
-# Explore page functions 
+# Explore page functions: served from the snapshots in api/explore.py, rebuilt by celery
 @api_view(['GET'])
 def shop_trending_categories(request):
-    trending_collections = Collection.objects.annotate(
-        item_count=Count('item', filter=Q(item__availability=AVAILABLE_CHOICE)),
-        total_bids=Count('item__bid'),
-        avg_bid=Avg('item__highest_bid'),
-    ).filter(item_count__gt=0).order_by(
-        '-total_bids',
-        '-avg_bid',
-        '-item_count'
-    )[:5]
-
-    return Response(trending_collections)
+    return Response(get_snapshot('trending-categories'))
 
 @api_view(['GET'])
 def shop_recent_bids(request):
     try:
-        recent_items = Item.objects.filter(
-            availability=AVAILABLE_CHOICE,
-            bid__isnull=False  # Has at least one bid
-        ).annotate(
-            latest_bid_time=Max('bid__time_of_bid')
-        ).order_by(
-            '-latest_bid_time'
-        )[:10]  # Last 10 items with bids
-
-        serializer = ItemSerializer(recent_items, many=True)
-        return Response(serializer.data)
+        return Response(get_snapshot('recent-bids'))
     except Exception as e:
         return Response(
             {"error": f"Failed to fetch recent bids: {str(e)}"},
@@ -98,21 +91,7 @@ def shop_recent_bids(request):
 @api_view(['GET'])
 def shop_popular_items(request):
     try:
-        popular_items = Item.objects.filter(
-            availability=AVAILABLE_CHOICE
-        ).annotate(
-            bid_count=Count('bid'),
-            save_count=Count('save'),
-            total_interactions=Count('bid') + Count('save')
-        ).filter(
-            total_interactions__gt=0
-        ).order_by(
-            '-total_interactions',
-            '-bid_count'
-        )[:10]
-
-        serializer = ItemSerializer(popular_items, many=True)
-        return Response(serializer.data)
+        return Response(get_snapshot('popular'))
     except Exception as e:
         return Response(
             {"error": f"Failed to fetch popular items: {str(e)}"},
@@ -122,24 +101,7 @@ def shop_popular_items(request):
 @api_view(['GET'])
 def shop_cheapest_in_popular(request):
     try:
-        # First get popular categories (those with most items and bids)
-        popular_categories = Collection.objects.annotate(
-            item_count=Count('item', filter=Q(item__availability=AVAILABLE_CHOICE)),
-            bid_count=Count('item__bid')
-        ).filter(
-            item_count__gt=0
-        ).order_by('-bid_count', '-item_count')[:5]
-
-        # Then get cheapest available items from these categories
-        cheapest_items = Item.objects.filter(
-            availability=AVAILABLE_CHOICE,
-            collection__in=popular_categories
-        ).order_by(
-            'starting_price'
-        )[:10]
-
-        serializer = ItemSerializer(cheapest_items, many=True)
-        return Response(serializer.data)
+        return Response(get_snapshot('best-deals'))
     except Exception as e:
         return Response(
             {"error": f"Failed to fetch cheapest items: {str(e)}"},
@@ -149,20 +111,7 @@ def shop_cheapest_in_popular(request):
 @api_view(['GET'])
 def shop_by_rating(request):
     try:
-        rated_items = Item.objects.filter(
-            availability=AVAILABLE_CHOICE
-        ).annotate(
-            avg_rating=Avg('review__rating')
-        ).filter(
-            avg_rating__gte=3.0,
-            avg_rating__lte=3.9
-        ).order_by(
-            '-avg_rating',
-            'starting_price'  # Secondary sort by price
-        )[:10]
-
-        serializer = ItemSerializer(rated_items, many=True)
-        return Response(serializer.data)
+        return Response(get_snapshot('by-rating'))
     except Exception as e:
         return Response(
             {"error": f"Failed to fetch rated items: {str(e)}"},
@@ -170,10 +119,16 @@ def shop_by_rating(request):
         )
 
 # use this to register and update account settings
-class AccountViewSet(viewsets.ModelViewSet):
+class AccountViewSet(QuerysetPlanMixin, viewsets.ModelViewSet):
     queryset = Account.objects.all()
     serializer_class = AccountSerializer
     permission_classes = [AllowAny]
+    queryset_plans = {
+        'list': {'select_related': ['user']},
+        'retrieve': {'select_related': ['user']},
+        # BidSerializer only needs the bid's own columns; the item is just filtered on
+        'view_pending_bids': {'model': Bid, 'only': ['id', 'bid_price', 'item', 'time_of_bid', 'status', 'profile']},
+    }
 
     # user registration
     @action(detail=False, methods=['post'], url_path='register', permission_classes=[AllowAny])
@@ -183,33 +138,13 @@ class AccountViewSet(viewsets.ModelViewSet):
 
         if serializer.is_valid():
             try:
-                user = serializer.save() # this is supposed to call the create() method in the serializer
-                sleep(1)
-
-                supabase = create_client(
-                    settings.SUPABASE_URL,
-                    settings.SUPABASE_ANON_KEY
-                )
-
-                print(f"Creating Supabase user for {request.data['email']}")
-
-                auth_response = supabase.auth.sign_up({
-                                'email': request.data['email'],
-                                'password': request.data['password'],
-                })
-
-                print("Supabase user created successfully")
-
-                return Response({
-                    'user': serializer.data,
-                    'access_token': auth_response.session.access_token if auth_response.session else None,
-                    'refresh_token': auth_response.session.refresh_token if auth_response.session else None
-                    }, status=status.HTTP_201_CREATED)
+                serializer.save() # creates the Django rows and the Supabase auth user; the client signs in afterwards
+                return Response({'user': serializer.data}, status=status.HTTP_201_CREATED)
             except IntegrityError: # if you put attribs as unique=True in the model class
                 return Response({"error": "Username or email already in use"}, status=status.HTTP_400_BAD_REQUEST)
             except Exception as e:
                 print(f"Registration error: {str(e)}")
-            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -343,13 +278,13 @@ class AccountViewSet(viewsets.ModelViewSet):
         try:
             account = request.user.account
             profile = account.profile
-            pending_bids = Bid.objects.filter(profile=profile, item__availability=AVAILABLE_CHOICE, winner_status__in=[WINNING_INELIGIBLE_CHOICE, WINNING_PENDING_CHOICE]).select_related('item')
+            pending_bids = self.plan_queryset(Bid.objects.filter(profile=profile, item__availability=AVAILABLE_CHOICE, winner_status__in=[WINNING_INELIGIBLE_CHOICE, WINNING_PENDING_CHOICE]))
 
             serializer = BidSerializer(pending_bids, many=True)
             return Response(
                 {
                     'pending_bids': serializer.data,
-                    'count': pending_bids.count()
+                    'count': len(serializer.data)
                 }
             )
         except Exception as e:
@@ -372,27 +307,33 @@ class AccountViewSet(viewsets.ModelViewSet):
             buyer_account = request.user.account
             item = winning_bid.item
 
-            complete_transaction(
-                seller=seller_account,
-                buyer=buyer_account,
-                amount=winning_bid.bid_price
-            )
+            with atomic():
+                # take the item off the market before any money moves; only one sale can win that race
+                if not close_item(item, SOLD_CHOICE):
+                    return Response({"error": "Item is no longer available"}, status=status.HTTP_409_CONFLICT)
 
-            buyer_account.get_VIP_discount()
-            buyer_account.update_points(winning_bid.bid_price)
+                complete_transaction(
+                    seller=seller_account,
+                    buyer=buyer_account,
+                    amount=winning_bid.bid_price
+                )
 
-            transaction = Transaction.objects.create(
-                seller=seller_account,
-                buyer=buyer_account,
-                bid=winning_bid 
-            )
+                buyer_account.get_VIP_discount()
+                buyer_account.update_points(winning_bid.bid_price)
 
-            seller_account.check_vip_eligibility()
-            buyer_account.check_vip_eligibility()
+                transaction = Transaction.objects.create(
+                    seller=seller_account,
+                    buyer=buyer_account,
+                    bid=winning_bid 
+                )
 
-            item.availability = SOLD_CHOICE
-            item.winning_bid = winning_bid
-            item.save()
+                seller_account.check_vip_eligibility()
+                buyer_account.check_vip_eligibility()
+
+                item.availability = SOLD_CHOICE
+                item.winning_bid = winning_bid
+                item.save(update_fields=['winning_bid'])
+            mark_snapshots_stale('item')
 
             winning_bid.bid.winner_status = WINNING_APPROVED_CHOICE
             winning_bid.save()
@@ -419,7 +360,7 @@ class AccountViewSet(viewsets.ModelViewSet):
             winning_bid.save()
             item = winning_bid.item
             item.winning_bid = None
-            item.save()
+            item.save(update_fields=['winning_bid'])
 
             seller_user = winning_bid.item.profile.account.user
             buyer_user = request.user
@@ -642,11 +583,7 @@ class SignInView(APIView):
             
             # Add error handling for Supabase client creation
             try:
-                supabase = create_client(
-                    settings.SUPABASE_URL,
-                    settings.SUPABASE_ANON_KEY,
-                )
-                print("Supabase client created successfully")
+                supabase = get_anon_client()
             except Exception as e:
                 print(f"Supabase client creation error: {str(e)}")
                 return Response(
@@ -657,10 +594,11 @@ class SignInView(APIView):
             print("Attempting Supabase authentication...")
             # sign in, get session
             try:
-                auth_response = supabase.auth.sign_in_with_password({
-                    'email': email,
-                    'password': password,
-                })
+                with supabase_call('auth.sign_in_with_password'):
+                    auth_response = supabase.auth.sign_in_with_password({
+                        'email': email,
+                        'password': password,
+                    })
                 print("Supabase authentication successful")
             except Exception as e:
                 print(f"Supabase authentication error: {str(e)}")
@@ -706,15 +644,12 @@ class SignOutView(APIView):
 
     def post(self, request):
         try:
-            supabase = create_client(
-                settings.SUPABASE_URL,
-                settings.SUPABASE_ANON_KEY
-            )
-
-            auth_header = request.META.get('HTTP_AUTHORIZATION')
-            if auth_header and auth_header.startswith('Bearer '):
-                token = auth_header.split(' ')
-                supabase.auth.sign_out(token)
+            token = get_auth_token(request)
+            if token:
+                # cached identities would keep serving the token until it expires
+                identity_cache.revoke(token, token_lifetime(token))
+                with supabase_call('auth.admin.sign_out'):
+                    get_service_client().auth.admin.sign_out(token)
 
             return Response({"message": "User logged out successfully"}, status=status.HTTP_200_OK)
         except Exception as e:
@@ -725,10 +660,15 @@ class SignOutView(APIView):
         
 
 # profile view 
-class ProfileViewSet(viewsets.ModelViewSet):
+class ProfileViewSet(QuerysetPlanMixin, viewsets.ModelViewSet):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
     permission_classes = [AllowAny]
+    queryset_plans = {
+        'list': {'select_related': ['account__user']},
+        'retrieve': {'select_related': ['account__user']},
+        'view_saves': {'model': Save, 'select_related': ['item']},
+    }
 
     # view profile
     # note: the action decorator is used to create custom actions on the viewset
@@ -736,7 +676,7 @@ class ProfileViewSet(viewsets.ModelViewSet):
         username = kwargs.get('pk')
 
         try:
-            profile = Profile.objects.get(account__user__username=username)
+            profile = self.get_queryset().get(account__user__username=username)
             serializer = self.get_serializer(profile)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Profile.DoesNotExist:
@@ -789,7 +729,7 @@ class ProfileViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], permission_classes=[AllowAny], url_path='saves')
     def view_saves(self, request):
         profile = request.user.account.profile
-        saves = Save.objects.filter(profile=profile)
+        saves = self.plan_queryset(Save.objects.filter(profile=profile))
         serializer = SaveSerializer(saves, many=True)
 
         return Response(serializer.data)
@@ -834,24 +774,35 @@ class ProfileViewSet(viewsets.ModelViewSet):
 
 
 # now work on item views
-class ItemViewSet(viewsets.ModelViewSet):
+FACETS_IGNORED_PARAMS = {'cursor', 'page_size', 'ordering', 'fields'}
+
+
+class ItemViewSet(QuerysetPlanMixin, viewsets.ModelViewSet):
     queryset = Item.objects.all()
     serializer_class = ItemSerializer
     permission_classes = [AllowAny]
-    search_fields = ['title', 'description', 'collection']
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    # list reads values() rows instead (see list below), which join only what the fields need
+    queryset_plans = {
+        'retrieve': {'select_related': ['profile__account__user']},
+        'view_comments': {'model': Comment, 'select_related': ['profile__account__user'], 'prefetch_related': ['children']},
+        'view_replies': {'model': Comment, 'select_related': ['profile__account__user'], 'prefetch_related': ['children']},
+    }
+    filter_backends = [DjangoFilterBackend, ItemSearchFilter, OrderingFilter]
     filterset_class = ItemFilter
+    pagination_class = ItemKeysetPagination # ?cursor= from the "next" link, ?page_size= up to 100
     lookup_field = 'title'
     # basic actions you can do from the filterset_class in ItemFilter:
     ## browse items by collection: api/items/?collection__title={title}&ordering=total_bids&availability=available
     ## browse items by profile: api/items/?profile__account_id={id}&ordering=-date_posted&availability=available ;; DO NOT FORGET TO PUT - BEFORE date_posted IF YOU WANT TO SORT BY MOST RECENT
     ## browse unavailable items by profile: api/items/?profile__account_id={id}&ordering=-date_posted&availability=sold
     ## browse items by highest bid AND collection: api/items/?collection__title={title}&ordering=total_bids&availability=available&highest_bid__gt={int}&highest_bid__lt={int}
-    ## browse items by search (including filters): api/items/?search={fields}&availability=available{whatever filters}
+    ## browse items by search (including filters): api/items/?q={words}&availability=available{whatever filters} ;; ranked by relevance, ?search= still works
+    ## facet counts for the same filters: api/items/facets/?q={words}&availability=available{whatever filters}
+    ## only some fields: api/items/?fields=id,title,selling_price,thumbnail{whatever filters} ;; works on any item read
     
     # 25-50
     # 50-100
-    # api/items/?search={sudgkjasals}&availability=available&highest_bid__gt=25&highest_bid__lt=50
+    # api/items/?q={sudgkjasals}&availability=available&highest_bid__gt=25&highest_bid__lt=50
     # create and view an item
     # you can edit an item's description but nothing else?
     # delete an item
@@ -865,6 +816,9 @@ class ItemViewSet(viewsets.ModelViewSet):
             
             if serializer.is_valid():
                 item = serializer.save()
+                schedule_auction_close(item)
+                record_item_listed(item)
+                mark_snapshots_stale('item')
                 profile = item.profile
                 item_count = Item.objects.filter(profile=profile).count()
                 profile.item_count = item_count
@@ -891,10 +845,73 @@ class ItemViewSet(viewsets.ModelViewSet):
     
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
+
+    # browsing reads plain rows: one values() query with only the columns the requested fields need,
+    # no Item instances and no per-row profile/account/user traversal
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer()
+        rows = serializer.row_queryset(queryset, extra=self.paginator.get_keyset_fields(queryset))
+        page = self.paginate_queryset(rows)
+        return self.get_paginated_response(serializer.rows_to_representation(page))
+
+    # /api/items/suggest/?prefix=vint -- typo-tolerant autocomplete for the search box
+    @action(detail=False, methods=['get'], url_path='suggest')
+    def suggest(self, request):
+        prefix = ' '.join(request.query_params.get('prefix', '').lower().split())[:50]
+        if len(prefix) < 2:
+            return Response({"items": [], "collections": []})
+
+        cache_key = f"item_suggest_{prefix}"
+        suggestions = cache.get(cache_key)
+        if suggestions is None:
+            # word similarity (the <% operator) matches a prefix or a misspelling against any word of the
+            # title, and is served by the gin_trgm_ops indexes on both titles. pg_trgm's default cutoff of 0.6
+            # misses one-letter typos like 'vintge', so it is lowered for this transaction only
+            with atomic(), connection.cursor() as cursor:
+                cursor.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)", [str(settings.SUGGEST_MIN_SIMILARITY)])
+                suggestions = self.suggest_matches(prefix)
+            cache.set(cache_key, suggestions, timeout=settings.SUGGEST_CACHE_TIMEOUT)
+
+        return Response(suggestions)
+
+    def suggest_matches(self, prefix):
+        items = Item.objects.filter(
+            availability=AVAILABLE_CHOICE,
+            title__trigram_word_similar=prefix,
+        ).annotate(
+            similarity=TrigramWordSimilarity(prefix, 'title')
+        ).order_by('-similarity', '-total_bids').values('id', 'title')[:settings.SUGGEST_LIMIT]
+
+        collections = Collection.objects.filter(
+            title__trigram_word_similar=prefix,
+        ).annotate(
+            similarity=TrigramWordSimilarity(prefix, 'title')
+        ).order_by('-similarity').values('id', 'title')[:settings.SUGGEST_LIMIT]
+
+        return {"items": list(items), "collections": list(collections)}
+
+    # /api/items/facets/?q=vintage&availability=available -- collection, availability and price bucket
+    # counts for the items the same filters would list
+    @action(detail=False, methods=['get'], url_path='facets')
+    def facets(self, request):
+        # cursor, page size and ordering don't change the counts, and parameter order shouldn't either
+        params = sorted(
+            (key, value)
+            for key, values in request.query_params.lists() if key not in FACETS_IGNORED_PARAMS
+            for value in values
+        )
+        cache_key = "item_facets_" + hashlib.md5(urlencode(params).encode()).hexdigest()
+        facets = cache.get(cache_key)
+        if facets is None:
+            facets = item_facets(self.filter_queryset(self.get_queryset()))
+            cache.set(cache_key, facets, timeout=settings.FACETS_CACHE_TIMEOUT)
+
+        return Response(facets)
     
     # /api/items/{pk}/delete-item
     @action(detail=True, methods=['delete'], permission_classes=[AllowAny, IsOwner], url_path='delete-item')
-    def delete_item(self, request, pk=None):
+    def delete_item(self, request, title=None):
         item = self.get_object()
         item.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
@@ -918,9 +935,9 @@ class ItemViewSet(viewsets.ModelViewSet):
     
     # /api/items/{pk}/view_comments
     @action(detail=True, methods=['get'], permission_classes=[AllowAny], url_path='comments')
-    def view_comments(self, request):
+    def view_comments(self, request, title=None):
         item = self.get_object()
-        comments = Comment.objects.filter(item=item)
+        comments = self.plan_queryset(Comment.objects.filter(item=item))
 
         serializer = CommentSerializer(comments, many=True)
 
@@ -946,10 +963,10 @@ class ItemViewSet(viewsets.ModelViewSet):
 
     # /api/items/{pk}/replies/?parent=<id>
     @action(detail=True, methods=['get'], permission_classes=[AllowAny], url_path='replies')
-    def view_replies(self, request):
+    def view_replies(self, request, title=None):
         parent_id = request.query_params.get('parent', None)
         parent = Comment.objects.get(id=parent_id)
-        replies = Comment.objects.filter(parent=parent)
+        replies = self.plan_queryset(Comment.objects.filter(parent=parent))
 
         serializer = CommentSerializer(replies, many=True)
 
@@ -1052,18 +1069,18 @@ class ItemViewSet(viewsets.ModelViewSet):
         return Response(serializer.errors, status=status.HTTP_404_NOT_FOUND)
     
     @action(detail=True, methods=['post'], permission_classes=[AllowAny], url_path='perform-bid')
-    def place_bid(self, request, pk=None):
+    def place_bid(self, request, title=None):
         item = self.get_object()
         user = request.user
         account = user.account
         if not item.is_available():
             return Response({"error": "Bidding has ended"})
-        
-        bid_amount = Decimal(request.data.get('bid_price'))
-        if bid_amount <= item.highest_bid:
-            return Response(
-                {"error": "Bid must be higher than current bid."},
-                status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = BidSerializer(data=request.data, context={'request': request, 'item': item})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        bid_amount = serializer.validated_data['bid_price']
         if bid_amount > account.balance:
             return Response(
                 {"error": "Insufficient funds."}, 
@@ -1081,27 +1098,23 @@ class ItemViewSet(viewsets.ModelViewSet):
                 "error": f"Bid cannot exceed ${item.maximum_bid}"
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        highest_bid = item.highest_bid
-        highest_bid_obj = Bid.objects.filter(item=item, bid_price=highest_bid).first()
-        serializer = BidSerializer(data=request.data, context={'request': request, 'item': item})
-        if serializer.is_valid():
-            bid = serializer.save()
-            curr_highest = Bid.objects.filter(item=item).order_by('-bid_price','time_of_bid').first()
-
-            if curr_highest == bid:
-                if highest_bid_obj:   
-                    EmailNotifications.notify_outbid(
-                        highest_bid_obj.profile.account.user,
-                        item,
-                        bid_amount
-                    )
+        try:
+            bid, outbid = accept_bid(item, account.profile, bid_amount)
+        except BidRejected as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if outbid and outbid.profile_id != bid.profile_id:
+            EmailNotifications.notify_outbid(
+                outbid.profile.account.user,
+                item,
+                bid_amount
+            )
+
+        return Response(BidSerializer(bid).data, status=status.HTTP_201_CREATED)
     
     # next make a choice to change bid deadline and/or complete bid
     @action(detail=True, methods=['post'], permission_classes=[AllowAny, IsOwner], url_path='change-deadline')
-    def change_deadline(self, request, pk=None):
+    def change_deadline(self, request, title=None):
         try:
             item = self.get_object()
 
@@ -1111,14 +1124,19 @@ class ItemViewSet(viewsets.ModelViewSet):
             }, status=status.HTTP_400_BAD_REQUEST)
 
             new_deadline = request.data.get('deadline')
-            new_deadline_dt = timezone.datetime.strptime(new_deadline, "%Y-%m-%d %H:%M:%S")
+            new_deadline_dt = timezone.make_aware(timezone.datetime.strptime(new_deadline, "%Y-%m-%d %H:%M:%S"))
             if new_deadline_dt <= timezone.now():
                 return Response({
                     "error": "New deadline must be in the future"
                     }, status=status.HTTP_400_BAD_REQUEST)
             
             item.deadline = new_deadline_dt
-            item.save()
+            item.save(update_fields=['deadline']) # a full save would roll back bids accepted meanwhile
+            schedule_auction_close(item)
+            # the bid fields loaded with the item may be stale by now; publish what is stored
+            item.refresh_from_db(fields=['highest_bid', 'total_bids', 'availability'])
+            publish_item_update(item)
+            mark_snapshots_stale('item')
 
             bidders = User.objects.filter(account__profile__bid__item=item).distinct()
 
@@ -1138,7 +1156,7 @@ class ItemViewSet(viewsets.ModelViewSet):
             }, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=True, methods=['get'], permission_classes=[AllowAny, IsOwner], url_path='view-item-bids')
-    def view_item_bids(self, request, pk=None):
+    def view_item_bids(self, request, title=None):
         item = self.get_object()
         profile = request.user.account.profile
         bids = Bid.objects.filter(profile=profile, item=item)
@@ -1147,7 +1165,7 @@ class ItemViewSet(viewsets.ModelViewSet):
         return Response(serializer.data, status=status.HTTP_200_OK)
     
     @action(detail=True, methods=['post'], permission_classes=[AllowAny, IsOwner], url_path='choose-winner')
-    def choose_winner(self, request, pk=None):
+    def choose_winner(self, request, title=None):
         try:
             item = self.get_object()
             try:
@@ -1163,33 +1181,39 @@ class ItemViewSet(viewsets.ModelViewSet):
             seller_account = item.profile.account
             buyer_account = winning_bid.profile.account
 
-            complete_transaction(
-                seller=seller_account,
-                buyer=buyer_account,
-                amount=winning_bid.bid_price
-            )
+            with atomic():
+                # take the item off the market before any money moves; only one sale can win that race
+                if not close_item(item, SOLD_CHOICE):
+                    return Response({"error": "Item is no longer available"}, status=status.HTTP_409_CONFLICT)
 
-            buyer_account.get_VIP_discount()
-            buyer_account.update_points(winning_bid.bid_price)
+                complete_transaction(
+                    seller=seller_account,
+                    buyer=buyer_account,
+                    amount=winning_bid.bid_price
+                )
 
-            transaction = Transaction.objects.create(
-                seller=seller_account,
-                buyer=buyer_account,
-                bid=winning_bid,
-            )
+                buyer_account.get_VIP_discount()
+                buyer_account.update_points(winning_bid.bid_price)
 
-            seller_account.check_vip_eligibility()
-            buyer_account.check_vip_eligibility()
+                transaction = Transaction.objects.create(
+                    seller=seller_account,
+                    buyer=buyer_account,
+                    bid=winning_bid,
+                )
+
+                seller_account.check_vip_eligibility()
+                buyer_account.check_vip_eligibility()
 
-            item.availability = SOLD_CHOICE
-            item.winning_bid = winning_bid
-            item.save()
+                item.availability = SOLD_CHOICE
+                item.winning_bid = winning_bid
+                item.save(update_fields=['winning_bid'])
+            mark_snapshots_stale('item')
 
             winning_bid.winner_status = WINNING_PENDING_CHOICE
             winning_bid.save()
 
             EmailNotifications.notify_bid_won(
-                buyer_account,
+                buyer_account.user,
                 item,
                 winning_bid.bid_price,
             )
@@ -1202,21 +1226,25 @@ class ItemViewSet(viewsets.ModelViewSet):
             return Response({"error": f"Failed to choose winner: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
         
         
-class TransactionViewSet(viewsets.ModelViewSet):
+class TransactionViewSet(QuerysetPlanMixin, viewsets.ModelViewSet):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
     permission_classes = [IsAuthenticated]
+    queryset_plans = dict.fromkeys(
+        ['list', 'retrieve', 'view_transactions', 'view_awaiting_arrivals', 'view_next_actions'],
+        {'select_related': ['seller__user', 'buyer__user', 'bid__item']},
+    )
 
     @action(detail=False, methods=['get'], permission_classes=[AllowAny], url_path='seller-transactions')
     def view_transactions(self, request):
         try:
             seller_account = request.user.account
-            seller_transactions = Transaction.objects.filter(seller=seller_account)
+            seller_transactions = self.get_queryset().filter(seller=seller_account)
             serializer = self.get_serializer(seller_transactions, many=True)
 
             return Response({
                 'transactions': serializer.data,
-                'count': seller_transactions.count()
+                'count': len(serializer.data)
             })
         except Exception as e:
             return Response(
@@ -1228,7 +1256,7 @@ class TransactionViewSet(viewsets.ModelViewSet):
     def view_awaiting_arrivals(self, request):
         try:
             buyer_account = request.user.account
-            transactions = Transaction.objects.filter(
+            transactions = self.get_queryset().filter(
                 buyer=buyer_account, 
                 status__in=[PENDING_CHOICE, SHIPPED_CHOICE]
             )
@@ -1236,7 +1264,7 @@ class TransactionViewSet(viewsets.ModelViewSet):
 
             return Response({
                 'awaiting_arrivals': serializer.data,
-                'count': transactions.count()
+                'count': len(serializer.data)
             })
         except Exception as e:
             return Response(
@@ -1248,11 +1276,11 @@ class TransactionViewSet(viewsets.ModelViewSet):
     def view_next_actions(self, request):
         try:
             account = request.user.account
-            to_ship = Transaction.objects.filter(
+            to_ship = self.get_queryset().filter(
                 seller=account,
                 status=PENDING_CHOICE
             )
-            awaiting = Transaction.objects.filter(
+            awaiting = self.get_queryset().filter(
                 buyer=account,
                 status__in=[PENDING_CHOICE, SHIPPED_CHOICE]
             )
@@ -1262,9 +1290,9 @@ class TransactionViewSet(viewsets.ModelViewSet):
 
             return Response({
                 'to_ship': to_ship_serializer.data,
-                'to_ship_count': to_ship.count(),
+                'to_ship_count': len(to_ship_serializer.data),
                 'awaiting_arrival': awaiting_serializer.data,
-                'awaiting_count': awaiting.count()
+                'awaiting_count': len(awaiting_serializer.data)
             })
         except Exception as e:
             return Response(
@@ -12,7 +12,27 @@ app.conf.beat_schedule = {
     'check-auction-deadlines': {
         'task': 'api.tasks.check_auction_deadlines',
         'schedule': crontab(minute=0) # it runs every hour
-    }
+    },
+    'close-due-auctions': {
+        'task': 'api.tasks.close_due_auctions',
+        'schedule': 5.0 # seconds; closes auctions shortly after their deadline
+    },
+    'flush-email-outbox': {
+        'task': 'api.tasks.flush_email_outbox',
+        'schedule': 10.0 # seconds
+    },
+    'flush-notification-digests': {
+        'task': 'api.tasks.flush_notification_digests',
+        'schedule': 60.0 # seconds
+    },
+    'reconcile-collection-stats': {
+        'task': 'api.tasks.reconcile_collection_stats',
+        'schedule': crontab(minute=30) # hourly, away from the deadline sweep
+    },
+    'refresh-explore-snapshots': {
+        'task': 'api.tasks.refresh_explore_snapshots',
+        'schedule': 10.0 # seconds; stale snapshots are rebuilt within this
+    },
 }
 
 app.autodiscover_tasks()
\ No newline at end of file
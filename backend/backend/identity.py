@@ -0,0 +1,170 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from collections import OrderedDict
+from redis.exceptions import RedisError
+import threading
+import time
+
+
+# small bounded per-process LRU with per-entry expiry
+class LocalLRUCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def delete_where(self, predicate):
+        with self.lock:
+            for key in [key for key, (value, _) in self.entries.items() if predicate(value)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# user and account fields request handling reads (permission checks, serializers, status checks); they are
+# rebuilt onto request.user from the cache, so none of them costs a query
+IDENTITY_USER_FIELDS = ['id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser']
+IDENTITY_ACCOUNT_FIELDS = ['id', 'status', 'is_suspended', 'profile__id']
+
+
+# two-tier identity cache for authenticated requests: a process-local LRU in front of the shared
+# (redis) django cache. tokens map to a user id until they expire; identities are kept per user so a
+# status change only has to invalidate one shared key. signing out revokes the token until it expires
+class IdentityCache:
+    def __init__(self):
+        self.local = LocalLRUCache(settings.IDENTITY_CACHE_LOCAL_MAX_ENTRIES)
+
+    def token_key(self, token):
+        return f'supabase_session_{token}'
+
+    def identity_key(self, user_id):
+        return f'identity_v2_{user_id}'
+
+    def revoked_key(self, token):
+        return f'supabase_session_revoked_{token}'
+
+    def get(self, token):
+        identity = self.local.get(token)
+        if identity is not None:
+            return identity
+
+        user_id = cache.get(self.token_key(token))
+        if user_id is None:
+            return None
+
+        identity = cache.get(self.identity_key(user_id))
+        if identity is None:
+            identity = load_identity(user_id)
+            if identity is None:
+                return None
+            cache.set(self.identity_key(user_id), identity, timeout=settings.IDENTITY_CACHE_TIMEOUT)
+
+        self.local.set(token, identity, settings.IDENTITY_CACHE_LOCAL_TTL)
+        return identity
+
+    def set(self, token, identity, timeout):
+        cache.set(self.token_key(token), identity['user_id'], timeout=timeout)
+        cache.set(self.identity_key(identity['user_id']), identity, timeout=min(timeout, settings.IDENTITY_CACHE_TIMEOUT))
+        self.local.set(token, identity, min(timeout, settings.IDENTITY_CACHE_LOCAL_TTL))
+
+    def delete(self, token):
+        cache.delete(self.token_key(token))
+        self.local.delete(token)
+
+    # sign-out: the token still verifies until it expires, so it is remembered as revoked until then.
+    # other processes drop their local copy within IDENTITY_CACHE_LOCAL_TTL
+    def revoke(self, token, timeout):
+        self.delete(token)
+        if timeout > 0:
+            cache.set(self.revoked_key(token), True, timeout=timeout)
+
+    def is_revoked(self, token):
+        return cache.get(self.revoked_key(token)) is not None
+
+    # other processes drop their local copy within IDENTITY_CACHE_LOCAL_TTL. called from every User and
+    # Account save, so a redis outage must not fail the save; the shared copy then expires on its own
+    def invalidate_user(self, user_id):
+        self.local.delete_where(lambda identity: identity['user_id'] == user_id)
+        try:
+            cache.delete(self.identity_key(user_id))
+        except RedisError as e:
+            print(f"Failed to invalidate cached identity for user {user_id}: {str(e)}")
+
+
+identity_cache = IdentityCache()
+
+
+def load_identity(user_id):
+    from api.models import Account
+
+    User = get_user_model()
+    user = User.objects.filter(id=user_id).values(*IDENTITY_USER_FIELDS).first()
+    if user is None:
+        return None
+
+    account = Account.objects.filter(user_id=user_id).values(*IDENTITY_ACCOUNT_FIELDS).first() or {}
+    return {
+        'user_id': user.pop('id'),
+        'user': user,
+        'account_id': account.get('id'),
+        'profile_id': account.get('profile__id'),
+        'status': account.get('status'),
+        'is_suspended': account.get('is_suspended'),
+    }
+
+
+def _from_ids(model, **values):
+    # an instance with only these fields loaded; anything else is fetched on first access, and save() only
+    # writes loaded fields, so cached values never clobber newer data
+    names = [field.attname for field in model._meta.concrete_fields if field.attname in values]
+    return model.from_db('default', names, [values[name] for name in names])
+
+
+# rebuilds request.user -> account -> profile from the cached identity without touching the database
+def user_from_identity(identity):
+    from api.models import Account, Profile
+
+    User = get_user_model()
+    user = _from_ids(User, id=identity['user_id'], **identity['user'])
+
+    if identity['account_id'] is not None:
+        account = _from_ids(
+            Account,
+            id=identity['account_id'],
+            user_id=identity['user_id'],
+            status=identity['status'],
+            is_suspended=identity['is_suspended'],
+        )
+        account.user = user
+        user.account = account
+        if identity['profile_id'] is not None:
+            account.profile = _from_ids(Profile, id=identity['profile_id'], account_id=identity['account_id'])
+            account.profile.account = account
+
+    return user
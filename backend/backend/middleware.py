@@ -2,10 +2,13 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
-from supabase import create_client, Client
 from django.conf import settings
-from django.core.cache import cache
+from backend.identity import identity_cache, load_identity, user_from_identity
 from api.models import *
+from jwt import PyJWKClient
+from jwt.exceptions import InvalidTokenError, PyJWKClientError
+import jwt
+import time
 
 User = get_user_model()  # Move this to the top level
 
@@ -17,98 +20,105 @@ class SupabaseMiddleware:
         response = self.get_response(request)
         return response
 
+_jwks_client = None
+
+
+# signing keys are fetched once and cached; PyJWKClient only goes back to the network for an unknown key id
+def get_jwks_client():
+    global _jwks_client
+    if _jwks_client is None:
+        _jwks_client = PyJWKClient(
+            f"{settings.SUPABASE_URL}/auth/v1/.well-known/jwks.json",
+            cache_keys=True,
+            lifespan=settings.SUPABASE_JWKS_CACHE_SECONDS,
+        )
+    return _jwks_client
+
+
+# verifies a Supabase access token locally and returns its claims
+def verify_supabase_token(token):
+    header = jwt.get_unverified_header(token)
+
+    if header.get('alg') == 'HS256':
+        # legacy projects sign with the shared JWT secret
+        if not settings.SUPABASE_JWT_SECRET:
+            raise InvalidTokenError('SUPABASE_JWT_SECRET is not configured')
+        key, algorithms = settings.SUPABASE_JWT_SECRET, ['HS256']
+    else:
+        key, algorithms = get_jwks_client().get_signing_key_from_jwt(token).key, ['RS256', 'ES256']
+
+    return jwt.decode(
+        token,
+        key,
+        algorithms=algorithms,
+        audience='authenticated',
+        options={'require': ['exp', 'sub']},
+    )
+
+
+# the access token the frontend sends in X-Auth-Token, with or without a 'Bearer ' prefix
+def get_auth_token(request):
+    # Check for custom header
+    auth_token = (
+        request.META.get('HTTP_X_AUTH_TOKEN') or
+        request.headers.get('X-Auth-Token')
+    )
+
+    # Remove 'Bearer ' prefix if present
+    if auth_token and auth_token.startswith('Bearer '):
+        auth_token = auth_token.split(' ')[1]
+    return auth_token
+
+
+# seconds until the token expires, read without verifying it; 0 if it has no usable exp
+def token_lifetime(token):
+    try:
+        claims = jwt.decode(token, options={'verify_signature': False})
+        return max(int(claims['exp'] - time.time()), 0)
+    except (InvalidTokenError, KeyError, TypeError):
+        return 0
+
+
 class SupabaseAuthentication(BaseAuthentication):
     def authenticate(self, request):
-        # Check for custom header
-        auth_token = (
-            request.META.get('HTTP_X_AUTH_TOKEN') or
-            request.headers.get('X-Auth-Token')
-        )
-        
+        auth_token = get_auth_token(request)
         if not auth_token:
             return None
-        
-        # Remove 'Bearer ' prefix if present
-        if auth_token.startswith('Bearer '):
-            auth_token = auth_token.split(' ')[1]
-
-        print("Debug token info:", {
-            'token_present': bool(auth_token),
-            'token_preview': auth_token[:20] if auth_token else None
-        })
 
+        identity = identity_cache.get(auth_token)
+        if identity:
+            return (user_from_identity(identity), identity)
 
         try:
-            # check if session exists in cache
-            session_key = f'supabase_session_{auth_token}'
-            cached_session = cache.get(session_key)
-            print(f"Cached session found: {bool(cached_session)}")  # Debug log
-
-
-            if cached_session:
-                User = get_user_model()
-                return (User.objects.get(email=cached_session['email']), None)
-        
-
-            # create Supabase client instance if there is no User
-            supabase: Client = create_client(
-                settings.SUPABASE_URL,
-                settings.SUPABASE_ANON_KEY
-            )
-            print("Supabase client created")  # Debug log
-
-
-            try:
-                auth_response = supabase.auth.get_user(auth_token)
-                user_data = auth_response.user
-                print(f"User data retrieved: {user_data.email}")  # Debug log
-            except Exception as e:
-                print(f"Error getting user data: {str(e)}")  # Debug log
-                raise AuthenticationFailed('Invalid token')
-            
-            User = get_user_model()
-            # get or create Django user 
-            django_user, user_created = User.objects.get_or_create(
-                email=user_data.email,
-                defaults={
-                    'username': user_data.email,
-                    'is_active': True
-                }
-            )
-            print(f"Django user {'created' if user_created else 'retrieved'}")  # Debug log
-
-
-            # if user_created:
-            #     try:
-            #         account = Account.objects.get(user=django_user)
-            #         Profile.objects.get(account=account)
-            #     except Exception as e:
-            #         print(f"Account/Profile creation error: {str(e)}")  # Debug log
-            #         django_user.delete()
-            #         raise AuthenticationFailed('Failed to create account')
-
-            # cache the session without verifying it
-            session_data = {
-                'email': user_data.email,
+            claims = verify_supabase_token(auth_token)
+        except (InvalidTokenError, PyJWKClientError) as e:
+            print(f"Token verification failed: {str(e)}")  # Debug log
+            raise AuthenticationFailed('Invalid token')
+
+        # signed out: the token still verifies, but the session is gone
+        if identity_cache.is_revoked(auth_token):
+            raise AuthenticationFailed('Invalid token')
+
+        email = claims.get('email')
+        if not email:
+            raise AuthenticationFailed('Invalid token')
+
+        # get or create Django user 
+        django_user, user_created = User.objects.get_or_create(
+            email=email,
+            defaults={
+                'username': email,
+                'is_active': True
             }
-            cache.set(
-                session_key,
-                session_data,
-                timeout=3600
-            )
-            print("Session cached")  # Debug log
-
-            return (django_user, None)
-            
-        except Exception as e:
-            print(f"Authentication error: {str(e)}")  # Debug log
-            try:
-                supabase.auth.sign_out()
-                cache.delete(session_key)
-            except:
-                pass
-            raise AuthenticationFailed(f'Invalid session: {str(e)}')
+        )
+
+        # cache the identity until the token itself expires
+        identity = load_identity(django_user.id)
+        timeout = int(claims['exp'] - time.time())
+        if timeout > 0:
+            identity_cache.set(auth_token, identity, timeout)
+
+        return (django_user, identity)
     
     def authenticate_header(self, request):
         return 'Bearer'
-
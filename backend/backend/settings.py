@@ -14,6 +14,7 @@ from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
 import os
+import sys
 from google.cloud import storage
 
 
@@ -60,6 +61,9 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
+# redis instance used by the app itself (bid order books, etc.), kept apart from the celery broker db
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/1')
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -69,6 +73,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'api',
     'rest_framework',
     # 'rest_framework_simplejwt',
@@ -92,11 +97,16 @@ MIDDLEWARE = [
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_ANON_KEY = os.getenv('SUPABASE_ANON_KEY')
 SUPABASE_SERVICE_ROLE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
+SUPABASE_JWT_SECRET = os.getenv('SUPABASE_JWT_SECRET') # only needed for projects still signing with HS256
+SUPABASE_JWKS_CACHE_SECONDS = 86400 # unknown key ids always trigger a refetch, so rotation is picked up immediately
+SUPABASE_ADMIN_WORKERS = 8 # parallel auth.admin calls for bulk admin actions
+SUPABASE_OFFLINE = os.getenv('SUPABASE_OFFLINE') == '1' # use the in-memory client from backend.supabase_clients (tests, local runs)
 
-if not SUPABASE_URL or not SUPABASE_ANON_KEY:
-    raise ValueError("Supabase credentials not properly configured in environment")
+if not SUPABASE_OFFLINE:
+    if not SUPABASE_URL or not SUPABASE_ANON_KEY:
+        raise ValueError("Supabase credentials not properly configured in environment")
 
-print(f"Supabase URL configured: {SUPABASE_URL[:20]}...")  # Log partial URL for verification
+    print(f"Supabase URL configured: {SUPABASE_URL[:20]}...")  # Log partial URL for verification
 
 ROOT_URLCONF = 'backend.urls'
 
@@ -200,12 +210,27 @@ CORS_ALLOW_HEADERS = [
     'x-auth-token',
 ]
 
+# shared between all workers, so sessions, captchas and snapshots survive across processes
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('CACHE_URL', 'redis://localhost:6379/2'),
     }
 }
 
+# the test suite gets a per-process cache rather than writing into the shared one
+if 'test' in sys.argv[1:2]:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# authenticated identities: a bounded per-process LRU in front of the shared cache (backend.identity)
+IDENTITY_CACHE_LOCAL_MAX_ENTRIES = 10000
+IDENTITY_CACHE_LOCAL_TTL = 30 # seconds; bounds how long another worker can see a stale status
+IDENTITY_CACHE_TIMEOUT = 300 # seconds
+
 # Add these settings to ensure preflight requests work correctly
 CORS_PREFLIGHT_MAX_AGE = 86400  # 24 hours
 CORS_EXPOSE_HEADERS = ["Content-Type", "X-CSRFToken"]
@@ -231,11 +256,43 @@ EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 EMAIL_USE_SSL = False
 EMAIL_USE_TLS = True
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+# email outbox (api.tasks.flush_email_outbox)
+EMAIL_OUTBOX_BATCH_SIZE = 100 # emails sent per connection
+EMAIL_OUTBOX_RATE_LIMIT = 10 # emails per second
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_RETRY_BACKOFF = 60 # seconds, doubled on every failed attempt
+EMAIL_OUTBOX_CLAIM_TIMEOUT = 900 # seconds before a claimed but unfinished batch is picked up again
+
+# outbid/comment/like notifications are coalesced per user over this many seconds (0 sends immediately)
+NOTIFICATION_DIGEST_WINDOW = 900
+
+# explore page snapshots (api.explore): seconds between rebuilds when nothing marks them stale
+EXPLORE_SNAPSHOT_INTERVALS = {
+    'trending-categories': 300,
+    'recent-bids': 60,
+    'popular': 120,
+    'best-deals': 300,
+    'by-rating': 600,
 }
+EXPLORE_SNAPSHOT_BUILD_TIMEOUT = 30 # seconds a rebuild may hold its lock
+
+# /api/items/suggest/ autocomplete
+SUGGEST_CACHE_TIMEOUT = 60 # seconds a prefix's suggestions are reused
+SUGGEST_LIMIT = 8
+SUGGEST_MIN_SIMILARITY = 0.5 # pg_trgm word similarity cutoff; 'vintge' vs 'vintage' scores 0.57
+
+# item facet counts (api.facets)
+FACETS_CACHE_TIMEOUT = 60 # seconds the counts for one filter set are reused
+FACET_PRICE_BUCKETS = [25, 50, 100] # highest bid bucket edges: under 25, 25-50, 50-100, 100 and up
+
+# hot score ranking for popular items (api.hot_score); run manage.py rebuild_hot_scores after changing these
+HOT_SCORE_HALF_LIFE = 86400 # seconds for an interaction to lose half its weight
+HOT_SCORE_WEIGHTS = {
+    'bid': 1.0,
+    'save': 1.0,
+    'comment': 0.5,
+}
+
 
 SHIPPO_API_KEY = os.getenv('SHIPPO_API_KEY')
 
@@ -0,0 +1,169 @@
+from django.conf import settings
+from supabase import create_client
+from contextlib import contextmanager
+from types import SimpleNamespace
+import threading
+import time
+import uuid
+
+
+_lock = threading.Lock()
+_service_client = None
+_thread_clients = threading.local()
+_client_factory = None
+
+_stats_lock = threading.Lock()
+_call_stats = {}
+
+# app_metadata set on every auth user this backend creates, so a half-finished registration can later be
+# told apart from an identity someone made with Supabase directly
+BACKEND_APP_METADATA = {'provisioned_by': 'backend'}
+
+
+def _create(key):
+    factory = _client_factory or (OfflineSupabaseClient if settings.SUPABASE_OFFLINE else create_client)
+    return factory(settings.SUPABASE_URL, key)
+
+
+# service-role client for auth.admin calls; those are stateless, so one per process is shared by all threads
+def get_service_client():
+    global _service_client
+    if _service_client is None:
+        with _lock:
+            if _service_client is None:
+                _service_client = _create(settings.SUPABASE_SERVICE_ROLE_KEY)
+    return _service_client
+
+
+# anon client for sign-in/sign-out; these keep session state on the client, so each thread gets its own
+# (still reused across requests, so the keep-alive connection survives)
+def get_anon_client():
+    client = getattr(_thread_clients, 'anon', None)
+    if client is None:
+        client = _thread_clients.anon = _create(settings.SUPABASE_ANON_KEY)
+    return client
+
+
+# swaps the client implementation, e.g. set_client_factory(OfflineSupabaseClient) in tests
+def set_client_factory(factory):
+    global _client_factory
+    _client_factory = factory
+    reset_clients()
+
+
+def reset_clients():
+    global _service_client
+    with _lock:
+        _service_client = None
+    _thread_clients.__dict__.clear()
+
+
+# records latency for a remote Supabase call: with supabase_call('auth.admin.create_user'): ...
+# the totals are read with get_call_stats(), e.g. by manage.py benchmark auth/registration
+@contextmanager
+def supabase_call(name):
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with _stats_lock:
+            stats = _call_stats.setdefault(name, {'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['count'] += 1
+            stats['errors'] += failed
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+
+
+# pages through auth.admin.list_users for the auth user with this email, None if there is none
+def find_user_by_email(email, per_page=1000):
+    client = get_service_client()
+    page = 1
+    while True:
+        with supabase_call('auth.admin.list_users'):
+            users = client.auth.admin.list_users(page=page, per_page=per_page)
+        for user in users:
+            if (user.email or '').lower() == email.lower():
+                return user
+        if len(users) < per_page:
+            return None
+        page += 1
+
+
+def get_call_stats():
+    with _stats_lock:
+        return {
+            name: dict(stats, mean_ms=stats['total_ms'] / stats['count'])
+            for name, stats in _call_stats.items()
+        }
+
+
+def reset_call_stats():
+    with _stats_lock:
+        _call_stats.clear()
+
+
+class _Response(SimpleNamespace):
+    # supabase responses are pydantic models, which iterate as (field, value) pairs
+    def __iter__(self):
+        return iter(vars(self).items())
+
+
+# in-memory stand-in for the parts of the Supabase client this project uses, for tests and offline runs
+class OfflineSupabaseClient:
+    def __init__(self, url=None, key=None):
+        self.users = {}
+        self.auth = SimpleNamespace(
+            admin=SimpleNamespace(
+                create_user=self._create_user,
+                update_user_by_id=self._update_user_by_id,
+                delete_user=self._delete_user,
+                list_users=self._list_users,
+                sign_out=lambda *args, **kwargs: None,
+            ),
+            sign_in_with_password=self._sign_in_with_password,
+            sign_out=lambda *args, **kwargs: None,
+        )
+
+    def _create_user(self, attributes):
+        email = attributes['email']
+        if any(user.email == email for user in self.users.values()):
+            raise Exception("A user with this email address has already been registered")
+        user = SimpleNamespace(
+            id=str(uuid.uuid4()),
+            email=email,
+            password=attributes.get('password'),
+            app_metadata=dict(attributes.get('app_metadata') or {}),
+        )
+        self.users[user.id] = user
+        return _Response(user=user)
+
+    def _update_user_by_id(self, user_id, attributes):
+        if user_id not in self.users:
+            raise Exception("User not found")
+        user = self.users[user_id]
+        for name, value in attributes.items():
+            setattr(user, name, value)
+        return _Response(user=user)
+
+    def _delete_user(self, user_id, *args, **kwargs):
+        self.users.pop(user_id, None)
+
+    def _list_users(self, page=None, per_page=None):
+        page, per_page = page or 1, per_page or 50
+        return list(self.users.values())[(page - 1) * per_page:page * per_page]
+
+    def _sign_in_with_password(self, credentials):
+        for user in self.users.values():
+            if user.email == credentials['email'] and user.password == credentials['password']:
+                session = SimpleNamespace(
+                    access_token=f"offline-{uuid.uuid4()}",
+                    refresh_token=f"offline-{uuid.uuid4()}",
+                    expires_at=int(time.time()) + 3600,
+                )
+                return _Response(user=user, session=session)
+        raise Exception("Invalid login credentials")